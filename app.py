@@ -1,14 +1,27 @@
-from flask import Flask, request, jsonify
+from flask import Flask, Response, g, request, jsonify
 from flask_cors import CORS
+import argparse
+import multiprocessing
 import os
 import signal
 import threading
 import time
 import atexit
+import gzip
+import ipaddress
+import json
+from datetime import date, datetime, timedelta
+import requests
 from dotenv import load_dotenv
 
 # Import your B-Tree logic and WAL-engine
 from btree_logic import BTree
+from change_feed import ChangeFeed
+from paged_btree import PagedBTree
+from indexes import ExpiryIndex, NameIndex, RangeDigest
+from ledger import EventLedger
+from rwlock import ReadWriteLock
+import metrics
 import wal_engine 
 
 load_dotenv()
@@ -19,27 +32,197 @@ app = Flask(__name__)
 app.secret_key = os.getenv("SECRET_KEY", "dev_secret_key_999")
 ADMIN_USERNAME = os.getenv("ADMIN_USER", "nurse")
 ADMIN_PASSWORD = os.getenv("ADMIN_PASS", "RuralClinic2026")
+# B-Tree minimum degree. Large clinic catalogues can raise this (e.g. 32-128)
+# for a flatter tree with fewer, wider nodes.
+BTREE_DEGREE = int(os.getenv("BTREE_DEGREE", "3"))
+# Storage backend: "memory" (whole tree in RAM, JSON checkpoints) or "paged"
+# (nodes in fixed-size pages on disk, cached in a bounded LRU buffer pool).
+# Paged stores want a wide node, e.g. BTREE_DEGREE=32 with the default 8 KiB pages.
+BTREE_BACKEND = os.getenv("BTREE_BACKEND", "memory")
+PAGE_CACHE_PAGES = int(os.getenv("PAGE_CACHE_PAGES", "4096"))
+PAGE_SIZE = int(os.getenv("PAGE_SIZE", "8192"))
+# WAL group commit: writes that queue up during an fsync share the next one.
+# A window (ms) makes shared commits wait for more writers; only slow disks need it.
+WAL_GROUP_COMMIT = os.getenv("WAL_GROUP_COMMIT", "0") == "1"
+WAL_COMMIT_WINDOW_MS = float(os.getenv("WAL_COMMIT_WINDOW_MS", "0"))
+# WAL encoding for new log files: "json" (default) or "binary" (CRC-framed, compact).
+WAL_FORMAT = os.getenv("WAL_FORMAT", "json")
+# The WAL is split into segments of about this size. Recovery decodes a large log's
+# segments in up to WAL_REPLAY_WORKERS processes (default: one per CPU core).
+WAL_SEGMENT_BYTES = int(os.getenv("WAL_SEGMENT_BYTES", str(4 * 1024 * 1024)))
+WAL_REPLAY_WORKERS = int(os.getenv("WAL_REPLAY_WORKERS", "0")) or None
+# Background checkpointing: snapshot + trim the WAL once any of these is reached.
+AUTO_CHECKPOINT = os.getenv("AUTO_CHECKPOINT", "1") == "1"
+CHECKPOINT_MAX_WAL_BYTES = int(os.getenv("CHECKPOINT_MAX_WAL_BYTES", str(16 * 1024 * 1024)))
+CHECKPOINT_MAX_WAL_RECORDS = int(os.getenv("CHECKPOINT_MAX_WAL_RECORDS", "50000"))
+CHECKPOINT_MAX_AGE_S = float(os.getenv("CHECKPOINT_MAX_AGE_S", "300"))
+# /api/view_all paging: largest page a client may ask for, and NDJSON stream chunk size.
+VIEW_MAX_PAGE_SIZE = int(os.getenv("VIEW_MAX_PAGE_SIZE", "5000"))
+VIEW_STREAM_CHUNK = 1000
+# /api/batch: most add/update/delete operations accepted in one request.
+BATCH_MAX_OPERATIONS = int(os.getenv("BATCH_MAX_OPERATIONS", "5000"))
+# How many recent changes /api/changes can serve before clients must refetch.
+CHANGE_FEED_SIZE = int(os.getenv("CHANGE_FEED_SIZE", "10000"))
+# P2P digest sync: peers listen on this port; timeout (seconds) per peer request.
+PEER_PORT = int(os.getenv("PEER_PORT", "5000"))
+PEER_TIMEOUT_S = float(os.getenv("PEER_TIMEOUT_S", "10"))
+# The peers /api/sync_peer may pull from, as "host[:port]", comma-separated
+# (e.g. "192.168.1.20,192.168.1.21:5001"). Left unset, any private LAN address
+# (10.x, 172.16-31.x, 192.168.x, fc00::/7) on PEER_PORT is accepted, so clinics on
+# one network sync without setup. Any other target is refused, so a request can't
+# make this server fetch arbitrary URLs (loopback, cloud metadata, the internet).
+PEER_HOSTS = [h for h in os.getenv("PEER_HOSTS", "").split(",") if h.strip()]
+PEER_FETCH_CHUNK = 500
+# Compaction: zero-qty (soft-deleted) batches are purged for good once they have
+# been empty this long, which leaves time for peers to sync the deletion first.
+TOMBSTONE_RETENTION_DAYS = float(os.getenv("TOMBSTONE_RETENTION_DAYS", "30"))
+# Event ledger (history of every write): snapshot the folded state every N events,
+# so time-travel reads replay at most N events.
+LEDGER_SNAPSHOT_EVERY = int(os.getenv("LEDGER_SNAPSHOT_EVERY", "5000"))
+# Production server (python app.py --production): waitress, a bounded pool of
+# worker threads behind one event loop that holds the sockets, so idle keep-alive
+# connections cost no thread. Past SERVER_CONNECTION_LIMIT open connections new
+# clients wait in the listen backlog (SERVER_BACKLOG), and past that are refused.
+SERVER_THREADS = int(os.getenv("SERVER_THREADS", "8"))
+SERVER_CONNECTION_LIMIT = int(os.getenv("SERVER_CONNECTION_LIMIT", "100"))
+SERVER_BACKLOG = int(os.getenv("SERVER_BACKLOG", "128"))
+SERVER_KEEPALIVE_S = int(os.getenv("SERVER_KEEPALIVE_S", "60"))
+# Latency histograms / counters for /api/metrics. "0" leaves only the free,
+# computed-at-scrape gauges (tree shape, WAL backlog).
+METRICS_ENABLED = os.getenv("METRICS_ENABLED", "1") == "1"
+# /api/profiler (sampling profiler) is off unless this is "1": it exposes stack
+# traces and costs CPU while it runs, so it is for a diagnosis session only.
+PROFILER_ENABLED = os.getenv("PROFILER_ENABLED", "0") == "1"
 
 CORS(app)
+metrics.set_enabled(METRICS_ENABLED)
 
 # --- 2. ENGINE SETUP ---
-# Initialize the B-Tree with degree t=3
-db = BTree(t=3)
+# Nothing touches the disk at import time: boot_engine() opens the data directory,
+# recovers the tree and builds the indexes, normally on a background thread
+# (start_engine), so the UI can load while a large store is still recovering.
+# Until then every route except the ones in OPEN_ENDPOINTS answers 503, and
+# /api/ready reports how far recovery has got.
+# The data directory comes from ANCHORMED_DATA_DIR (or --data-dir, see __main__).
+engine = wal_engine.configure(wal_format=WAL_FORMAT, segment_bytes=WAL_SEGMENT_BYTES,
+                              replay_workers=WAL_REPLAY_WORKERS)
+# The primary tree. A paged store is opened by boot_engine(); until then this is
+# an empty placeholder that no route reads.
+db = BTree(t=BTREE_DEGREE)
+# Guards the tree, its indexes and the change feed. Readers share db_lock.read;
+# a write is logged + applied under db_lock.write, so neither readers nor a
+# checkpoint ever see a half-applied change. Stored details are never mutated
+# in place: a write inserts a new dict, so a reader may keep one after unlocking.
+db_lock = ReadWriteLock()
+# Sequence-numbered feed of WAL-logged changes, for delta refreshes.
+changes = ChangeFeed(CHANGE_FEED_SIZE)
 
-# Let wal_engine handle all the pathing logic! We just call recover immediately.
-print("CORE: Booting AnchorMed Engine...")
-wal_engine.recover_tree(db)
+# Secondary indexes are derived from the primary tree, so they are rebuilt after recovery.
+expiry_index = ExpiryIndex(t=BTREE_DEGREE)
+name_index = NameIndex(t=BTREE_DEGREE)
+range_digest = RangeDigest()
+# Append-only history of the writes (dispense, restock, ...), opened by boot_engine().
+# Events are appended under db_lock.write, in the same order as the WAL records.
+ledger = None
+_ledger_snapshot_lock = threading.Lock()
+
+# Set once recovery and the index rebuild are done. boot_stage is one of "stopped",
+# "recovering", "indexing", "ready" or "failed" (boot_error then says why).
+engine_ready = threading.Event()
+boot_stage = "stopped"
+boot_error = None
+_boot_lock = threading.Lock()
+_boot_thread = None
+
+def boot_engine():
+    """Opens the store, recovers the tree and rebuilds the indexes, then opens the gates."""
+    global db, ledger, boot_stage, boot_error
+    print("CORE: Booting AnchorMed Engine...")
+    boot_stage = "recovering"
+    try:
+        if BTREE_BACKEND == "paged":
+            engine.open()
+            tree = PagedBTree(engine.page_file, t=BTREE_DEGREE,
+                              cache_pages=PAGE_CACHE_PAGES, page_size=PAGE_SIZE)
+        else:
+            tree = BTree(t=BTREE_DEGREE)
+        engine.recover_tree(tree)
+
+        boot_stage = "indexing"
+        with db_lock.write:
+            expiry_index.rebuild(tree)
+            name_index.rebuild(tree)
+            range_digest.rebuild(tree)
+            db = tree
+            ledger = EventLedger(engine.data_dir, snapshot_every=LEDGER_SNAPSHOT_EVERY)
+            ledger.open()
+            # Ledger events are not fsynced with each write: after a crash the
+            # recovered tree is the truth, and the ledger gets correcting events.
+            ledger.reconcile(tree.iter_items())
+            # A new ledger starts from a snapshot of the store it was added to.
+            if ledger.snapshot_due:
+                ledger.snapshot(tree.iter_items())
+
+        if WAL_GROUP_COMMIT:
+            engine.enable_group_commit(WAL_COMMIT_WINDOW_MS)
+        start_background_services()
+    except Exception as e:
+        boot_stage, boot_error = "failed", f"{type(e).__name__}: {e}"
+        print(f"CORE: Boot failed: {boot_error}")
+        return
+    boot_stage = "ready"
+    engine_ready.set()
+    print("CORE: Engine ready.")
+
+def start_engine(background=True):
+    """Boots the engine once. In the background by default; background=False
+    blocks until the engine is ready (tools, tests, benchmarks)."""
+    global _boot_thread
+    with _boot_lock:
+        if _boot_thread is None:
+            atexit.register(cleanup_before_exit)
+            _boot_thread = threading.Thread(target=boot_engine, name="engine-boot", daemon=True)
+            _boot_thread.start()
+    if not background:
+        _boot_thread.join()
+
+# --- INSTRUMENTATION ---
+REQUEST_SECONDS = metrics.Histogram(
+    "anchormed_http_request_seconds", "Request latency by route (streamed bodies: until the first byte).",
+    labelnames=("method", "route", "status")
+)
+VIEW_CACHE_LOOKUPS = metrics.Counter(
+    "anchormed_view_cache_total", "Full /api/view_all responses, by cache result (hit, miss).",
+    labelnames=("result",)
+)
+metrics.Gauge("anchormed_btree_keys", "Batches stored in the primary B-Tree.", fn=lambda: db.key_count)
+metrics.Gauge("anchormed_btree_nodes", "Nodes in the primary B-Tree.", fn=lambda: db.node_count)
+metrics.Gauge("anchormed_btree_height", "Levels in the primary B-Tree.", fn=lambda: db.height)
+metrics.Gauge("anchormed_engine_ready", "1 once recovery is done and the inventory is served.",
+              fn=lambda: int(engine_ready.is_set()))
+metrics.Gauge("anchormed_change_feed_seq", "Sequence number of the latest logged change.", fn=lambda: changes.seq)
+if BTREE_BACKEND == "paged":
+    metrics.Gauge("anchormed_buffer_pool", "Paged backend: buffer pool and page file counters.",
+                  fn=lambda: {(k,): v for k, v in db.page_stats().items()} if engine_ready.is_set() else None,
+                  labelnames=("stat",))
+metrics.Gauge("anchormed_ledger", "Event ledger: events, bytes and snapshots.",
+              fn=lambda: {(k,): v for k, v in ledger.stats().items()} if ledger is not None else None,
+              labelnames=("stat",))
 
 # --- GRACEFUL SHUTDOWN HOOK ---
 def cleanup_before_exit():
     print("\n--------------------------------------------------")
     print("CORE: Stopping Anchor Engine...")
+    metrics.profiler.stop()
+    engine.stop_background_checkpointer()
+    engine.disable_group_commit()
+    engine.close()
+    if ledger is not None:
+        ledger.close()
     print("WAL: All transactions are anchored to disk.")
     print("CORE: Shutdown Complete.")
     print("--------------------------------------------------")
 
-atexit.register(cleanup_before_exit)
-
 # --- 3. HELPER FUNCTIONS ---
 def validate_login(data):
     return (
@@ -47,8 +230,152 @@ def validate_login(data):
         data.get("password") == ADMIN_PASSWORD
     )
 
+def index_write(batch_id, old_details, new_details):
+    # Keep the secondary indexes in step with a write to the primary tree.
+    expiry_index.update(batch_id, old_details, new_details)
+    name_index.update(batch_id, old_details, new_details)
+    range_digest.update(batch_id, old_details, new_details)
+
+def request_operator():
+    # Who made a change, for the event ledger: the UI sends the logged-in user.
+    return request.headers.get("X-Operator") or ADMIN_USERNAME
+
+def is_empty(details):
+    try:
+        return int(details.get("qty") or 0) == 0
+    except (TypeError, ValueError):
+        return False
+
+def with_qty(details, qty, emptied_at=None):
+    """Copy of 'details' with a new quantity. A batch that runs empty is stamped
+    with 'emptied_at' (default: now; an older stamp is kept) so compaction can
+    purge it after the retention window. A restocked batch loses its stamp."""
+    updated = {**details, "qty": qty}
+    if is_empty(updated):
+        updated.setdefault("emptied_at", emptied_at or int(time.time()))
+    else:
+        updated.pop("emptied_at", None)
+    return updated
+
+def new_batch_details(data):
+    # The record /api/add stores for a request body (or one /api/batch operation).
+    return with_qty({
+        "name": data.get("med_name"),
+        "expiry": data.get("expiry")
+    }, data.get("qty"))
+
+def await_anchor(commit, label):
+    # Wait for the WAL fsync AFTER releasing db_lock, so concurrent writers
+    # share one group commit instead of queueing behind each other's fsync.
+    # The ledger needs no fsync of its own (see EventLedger.reconcile).
+    commit.wait()
+    print(f"WAL: Anchored {label} to disk.")
+    if ledger.snapshot_due:
+        threading.Thread(target=snapshot_ledger, name="ledger-snapshot", daemon=True).start()
+
+def snapshot_ledger():
+    # The read lock keeps writers out, so the snapshot matches the end of the ledger.
+    if not _ledger_snapshot_lock.acquire(blocking=False):
+        return
+    try:
+        with db_lock.read:
+            if ledger.snapshot_due:
+                ledger.snapshot(db.iter_items())
+    finally:
+        _ledger_snapshot_lock.release()
+
+@app.before_request
+def start_request_timer():
+    g.request_started = time.perf_counter()
+
+# Routes that work while the engine is still booting (they don't touch the tree).
+OPEN_ENDPOINTS = {"login", "readiness", "prometheus_metrics", "shutdown"}
+
+@app.before_request
+def require_ready_engine():
+    if engine_ready.is_set() or request.endpoint in OPEN_ENDPOINTS:
+        return None
+    return jsonify({
+        "success": False,
+        "message": "Engine is starting up, try again shortly",
+        "status": boot_stage,
+        "recovery": engine.progress.to_dict(),
+    }), 503, {"Retry-After": "1"}
+
+@app.after_request
+def observe_request(response):
+    started = g.get("request_started")
+    if started is not None:
+        route = request.url_rule.rule if request.url_rule else "unmatched"
+        REQUEST_SECONDS.observe(time.perf_counter() - started, request.method, route, response.status_code)
+    return response
+
+def inventory_etag():
+    # Identifies the inventory version: changes only when a write is logged.
+    return f"{changes.epoch}-{changes.seq}"
+
+# --- VIEW CACHE ---
+# The encoded full /api/view_all body (and its gzip, made on first demand), keyed
+# by the inventory version. Polling terminals and peer pulls get the same bytes
+# back until a write is logged, instead of a tree walk + JSON encode per request.
+# Replaced whole, so readers take it without a lock: (etag, body, gzip body or None).
+VIEW_GZIP_MIN_BYTES = 1024
+_view_cache = None
+_view_cache_lock = threading.Lock()
+
+def cached_inventory(accept_gzip):
+    """Returns (etag, body, gzipped) for the full inventory response. The gzip body
+    is a different representation, so it gets its own ETag (suffix "-gz")."""
+    global _view_cache
+    entry = _view_cache
+    if entry is None or entry[0] != inventory_etag():
+        # One thread re-encodes; the others wait for it and reuse its bytes.
+        with _view_cache_lock:
+            entry = _view_cache
+            with db_lock.read:
+                epoch, seq = changes.epoch, changes.seq
+                etag = inventory_etag()
+                stale = entry is None or entry[0] != etag
+                items = list(db.iter_items()) if stale else None
+            if items is not None:
+                # Stored details are never mutated in place, so encoding can run unlocked.
+                # epoch/seq say where in /api/changes a client picks up from this body.
+                body = app.json.dumps({
+                    "success": True,
+                    "epoch": epoch,
+                    "seq": seq,
+                    "inventory": [{"batch_id": batch_id, "details": details} for batch_id, details in items]
+                }, separators=(",", ":")).encode("utf-8")
+                entry = _view_cache = (etag, body, None)
+                VIEW_CACHE_LOOKUPS.inc("miss")
+            else:
+                VIEW_CACHE_LOOKUPS.inc("hit")
+    else:
+        VIEW_CACHE_LOOKUPS.inc("hit")
+
+    etag, body, compressed = entry
+    if not accept_gzip or len(body) < VIEW_GZIP_MIN_BYTES:
+        return etag, body, False
+    if compressed is None:
+        compressed = gzip.compress(body, compresslevel=6, mtime=0)
+        with _view_cache_lock:
+            if _view_cache is entry:
+                _view_cache = (etag, body, compressed)
+    return f"{etag}-gz", compressed, True
+
 # --- 4. API ROUTES ---
 
+@app.route("/api/ready", methods=["GET"])
+def readiness():
+    # 200 once the inventory is served; 503 (with recovery progress) until then.
+    ready = engine_ready.is_set()
+    return jsonify({
+        "success": ready,
+        "status": boot_stage,
+        "error": boot_error,
+        "recovery": engine.progress.to_dict(),
+    }), 200 if ready else 503
+
 @app.route("/api/login", methods=["POST"])
 def login():
     data = request.json
@@ -56,10 +383,198 @@ def login():
         return jsonify({"success": True, "message": "Login successful"}), 200
     return jsonify({"success": False, "message": "Invalid credentials"}), 401
 
+def stream_inventory(after=None):
+    """Yields the inventory as NDJSON, one batch per line, a chunk at a time.
+    Only the last key sent is kept between chunks: each chunk opens a fresh cursor
+    past it, so writes in between are fine."""
+    last = after
+    while True:
+        # Only hold the read lock while a chunk is gathered, never while it is sent.
+        with db_lock.read:
+            cursor = db.cursor()
+            if last is not None:
+                cursor.seek(last, inclusive=False)
+            page = cursor.take(VIEW_STREAM_CHUNK)
+        if not page:
+            return
+        last = page[-1][0]
+        yield "".join(
+            json.dumps({"batch_id": batch_id, "details": details}) + "\n"
+            for batch_id, details in page
+        )
+
 @app.route("/api/view_all", methods=["GET"])
 def view_all():
-    inventory = db.get_all_data() 
-    return jsonify({"success": True, "inventory": inventory}), 200
+    # ?after=<batch_id>&limit=N  -> one page, plus the cursor for the next one
+    # ?format=ndjson             -> the whole inventory streamed line by line
+    # (no parameters)            -> the whole inventory in one JSON response
+    after = request.args.get("after")
+
+    # Read the version BEFORE the data, so the tag is never newer than the body.
+    # The identity and gzip bodies carry different ETags; either is still current.
+    etag = inventory_etag()
+    for tag in (etag, f"{etag}-gz"):
+        if tag in request.if_none_match:
+            return Response(status=304, headers={"ETag": f'"{tag}"', "Vary": "Accept-Encoding"})
+
+    if request.args.get("format") == "ndjson":
+        return Response(stream_inventory(after), mimetype="application/x-ndjson"), 200
+
+    limit = request.args.get("limit")
+    if limit is None and after is None:
+        etag, body, gzipped = cached_inventory(request.accept_encodings["gzip"] > 0)
+        headers = {"ETag": f'"{etag}"', "Vary": "Accept-Encoding"}
+        if gzipped:
+            headers["Content-Encoding"] = "gzip"
+        return Response(body, mimetype="application/json", headers=headers), 200
+
+    try:
+        limit = int(limit) if limit is not None else VIEW_MAX_PAGE_SIZE
+    except ValueError:
+        return jsonify({"success": False, "message": "limit must be an integer"}), 400
+    if limit < 1:
+        return jsonify({"success": False, "message": "limit must be positive"}), 400
+    limit = min(limit, VIEW_MAX_PAGE_SIZE)
+
+    with db_lock.read:
+        etag = inventory_etag()
+        cursor = db.cursor()
+        if after is not None:
+            cursor.seek(after, inclusive=False)
+        # Read one extra record to know whether another page follows.
+        page = cursor.take(limit + 1)
+    has_more = len(page) > limit
+    page = page[:limit]
+    inventory = [{"batch_id": batch_id, "details": details} for batch_id, details in page]
+    return jsonify({
+        "success": True,
+        "inventory": inventory,
+        "next_after": page[-1][0] if has_more else None,
+    }), 200, {"ETag": f'"{etag}"'}
+
+@app.route("/api/changes", methods=["GET"])
+def list_changes():
+    # ?since=<seq>&epoch=<epoch>: the batches changed after 'seq', with their
+    # current details (null once a batch is purged). 'reset' means the client is too far behind (or the server
+    # restarted) and should refetch /api/view_all once.
+    try:
+        since = int(request.args.get("since", "0"))
+    except ValueError:
+        return jsonify({"success": False, "message": "since must be an integer"}), 400
+
+    epoch = request.args.get("epoch")
+    with db_lock.read:
+        current_seq = changes.seq
+        entries = None if epoch not in (None, changes.epoch) else changes.since(since)
+        if entries is None:
+            return jsonify({
+                "success": True, "reset": True,
+                "epoch": changes.epoch, "seq": current_seq, "changes": []
+            }), 200
+
+        changed = [
+            {"seq": seq, "batch_id": batch_id, "details": db.search(batch_id)}
+            for seq, batch_id in entries
+        ]
+    return jsonify({
+        "success": True, "reset": False,
+        "epoch": changes.epoch,
+        "seq": entries[-1][0] if entries else max(since, 0),
+        "changes": changed
+    }), 200
+
+@app.route("/api/expiring", methods=["GET"])
+def list_expiring():
+    # ?from=YYYY-MM&to=YYYY-MM  -> batches whose expiry falls in that (inclusive) range
+    # ?days=N                   -> from the start of this month to N days from today
+    # Zero-quantity (deleted) batches are left out.
+    start = request.args.get("from")
+    end = request.args.get("to")
+    days = request.args.get("days")
+    if days is not None:
+        try:
+            days = int(days)
+        except ValueError:
+            return jsonify({"success": False, "message": "days must be an integer"}), 400
+        today = date.today()
+        start = start or today.isoformat()[:7]
+        end = (today + timedelta(days=days)).isoformat()
+
+    results = []
+    with db_lock.read:
+        for expiry, batch_id in expiry_index.range(start, end):
+            details = db.search(batch_id)
+            if details and details.get("qty"):
+                results.append({"batch_id": batch_id, "details": details})
+    return jsonify({"success": True, "from": start, "to": end, "inventory": results}), 200
+
+@app.route("/api/stock", methods=["GET"])
+def stock_total():
+    # ?name=<medicine>: total quantity and batches held for one medicine
+    name = request.args.get("name", "")
+    if not name.strip():
+        return jsonify({"success": False, "message": "Medicine name required"}), 400
+
+    with db_lock.read:
+        stock = name_index.get(name)
+        stock = stock.to_dict() if stock is not None else None
+    if stock is None:
+        return jsonify({"success": False, "message": "Medicine not found"}), 404
+    return jsonify({"success": True, "stock": stock}), 200
+
+@app.route("/api/medicines", methods=["GET"])
+def search_medicines():
+    # ?prefix=<text>&limit=N: medicine names for autocomplete, with their totals
+    prefix = request.args.get("prefix", "")
+    try:
+        limit = min(int(request.args.get("limit", "10")), 100)
+    except ValueError:
+        return jsonify({"success": False, "message": "limit must be an integer"}), 400
+
+    with db_lock.read:
+        matches = [
+            {"name": stock.name, "qty": stock.qty, "batch_count": len(stock.batches)}
+            for stock in name_index.prefix(prefix, limit)
+        ]
+    return jsonify({"success": True, "medicines": matches}), 200
+
+# --- HISTORY (event ledger) ---
+def parse_as_of(value):
+    """UNIX seconds, an ISO datetime, or a date (meaning the end of that day)."""
+    try:
+        return float(value)
+    except ValueError:
+        pass
+    moment = datetime.fromisoformat(value)
+    if len(value) == 10:
+        return (moment + timedelta(days=1)).timestamp() - 1e-6
+    return moment.timestamp()
+
+@app.route("/api/history", methods=["GET"])
+def batch_history():
+    # ?batch_id=X[&limit=N]: the batch's events (add, restock, dispense, delete,
+    # purge) with timestamp and operator, oldest first
+    batch_id = request.args.get("batch_id")
+    if not batch_id:
+        return jsonify({"success": False, "message": "Batch ID required"}), 400
+    try:
+        limit = int(request.args["limit"]) if "limit" in request.args else None
+    except ValueError:
+        return jsonify({"success": False, "message": "limit must be an integer"}), 400
+    return jsonify({"success": True, "batch_id": batch_id,
+                    "events": ledger.history(batch_id, limit)}), 200
+
+@app.route("/api/inventory_at", methods=["GET"])
+def inventory_at():
+    # ?as_of=2026-03-31 (end of that day) | ISO datetime | UNIX seconds [&batch_id=X]:
+    # the inventory (or one batch) as it was then
+    try:
+        as_of = parse_as_of(request.args.get("as_of", ""))
+        state = ledger.state_at(as_of, request.args.get("batch_id"))
+    except ValueError as e:
+        return jsonify({"success": False, "message": str(e) or "as_of must be a date, datetime or timestamp"}), 400
+    inventory = [{"batch_id": batch_id, "details": details} for batch_id, details in sorted(state.items())]
+    return jsonify({"success": True, "as_of": as_of, "inventory": inventory}), 200
 
 @app.route("/api/add", methods=["POST"])
 def add_item():
@@ -69,18 +584,20 @@ def add_item():
     if not batch_id:
         return jsonify({"success": False, "message": "Batch ID required"}), 400
 
-    details = {
-        "name": data.get("med_name"),
-        "qty": data.get("qty"),
-        "expiry": data.get("expiry")
-    }
+    details = new_batch_details(data)
 
-    # 1. Insert into B-Tree (Memory)
-    db.insert(batch_id, details)
-    
-    # 2. Write to WAL (Disk) so it survives a crash!
-    wal_engine.log_transaction(batch_id, details)
-    
+    with db_lock.write:
+        old_details = db.search(batch_id)
+        # 1. Write to WAL (Disk) so it survives a crash! This fixes its place in the log.
+        commit = engine.submit_transactions([(batch_id, details)])
+
+        # 2. Insert into B-Tree (Memory)
+        db.insert(batch_id, details)
+        index_write(batch_id, old_details, details)
+        ledger.record(batch_id, old_details, details, request_operator())
+        changes.record([batch_id])
+
+    await_anchor(commit, f"'{batch_id}'")
     return jsonify({"success": True, "message": "Batch anchored successfully"}), 200
 
 @app.route("/api/update", methods=["POST"])
@@ -92,13 +609,23 @@ def update_item():
     if not batch_id or new_qty is None:
          return jsonify({"success": False, "message": "Missing data"}), 400
     
-    current_data = db.search(batch_id)
-    if current_data:
-        current_data["qty"] = new_qty
-        # Log the update to disk!
-        wal_engine.log_transaction(batch_id, current_data)
+    with db_lock.write:
+        current_data = db.search(batch_id)
+        if current_data:
+            # Copy-on-write: readers may still hold the old dict.
+            updated = with_qty(current_data, new_qty)
+            # Log the update to disk!
+            commit = engine.submit_transactions([(batch_id, updated)])
+            db.insert(batch_id, updated)
+            index_write(batch_id, current_data, updated)
+            ledger.record(batch_id, current_data, updated, request_operator())
+            changes.record([batch_id])
+        else:
+            commit = None
+
+    if commit is not None:
+        await_anchor(commit, f"'{batch_id}'")
         return jsonify({"success": True, "message": "Stock updated"}), 200
-    
     return jsonify({"success": False, "message": "Batch ID not found"}), 404
 
 @app.route("/api/delete", methods=["POST"])
@@ -109,15 +636,110 @@ def delete_item():
     if not batch_id:
          return jsonify({"success": False, "message": "Missing data"}), 400
     
-    current_data = db.search(batch_id)
-    if current_data:
-        current_data["qty"] = 0
-        # Log the soft-delete to disk!
-        wal_engine.log_transaction(batch_id, current_data)
+    with db_lock.write:
+        current_data = db.search(batch_id)
+        if current_data:
+            # Copy-on-write: readers may still hold the old dict.
+            deleted = with_qty(current_data, 0)
+            # Log the soft-delete to disk!
+            commit = engine.submit_transactions([(batch_id, deleted)])
+            db.insert(batch_id, deleted)
+            index_write(batch_id, current_data, deleted)
+            ledger.record(batch_id, current_data, deleted, request_operator(), deleted=True)
+            changes.record([batch_id])
+        else:
+            commit = None
+
+    if commit is not None:
+        await_anchor(commit, f"'{batch_id}'")
         return jsonify({"success": True, "message": "Record deleted"}), 200
-        
     return jsonify({"success": False, "message": "Batch ID not found"}), 404
 
+@app.route("/api/batch", methods=["POST"])
+def batch_write():
+    # {"operations": [{"op": "add", "batch_id", "med_name", "expiry", "qty"},
+    #                 {"op": "update", "batch_id", "new_qty"},
+    #                 {"op": "delete", "batch_id"}, ...]}
+    # Everything is applied in one write and made durable by ONE WAL frame.
+    operations = (request.json or {}).get("operations")
+    if not isinstance(operations, list) or not operations:
+        return jsonify({"success": False, "message": "No operations received"}), 400
+    if len(operations) > BATCH_MAX_OPERATIONS:
+        return jsonify({"success": False,
+                        "message": f"At most {BATCH_MAX_OPERATIONS} operations per batch"}), 413
+
+    results, applied = apply_operations(operations)
+    return jsonify({
+        "success": True,
+        "message": f"Applied {applied} records.",
+        "results": results
+    }), 200
+
+def plan_operation(op, current):
+    """What one /api/batch operation does to a batch whose details are 'current'
+    (None if it does not exist): returns (new details, None) or (None, (status, message))."""
+    kind = op.get("op")
+    if kind == "add":
+        return new_batch_details(op), None
+    if kind == "update":
+        if op.get("new_qty") is None:
+            return None, (400, "Missing data")
+        if not current:
+            return None, (404, "Batch ID not found")
+        return with_qty(current, op["new_qty"]), None
+    if kind == "delete":
+        if not current:
+            return None, (404, "Batch ID not found")
+        return with_qty(current, 0), None
+    return None, (400, f"Unknown op {kind!r}")
+
+def apply_operations(operations):
+    """Applies add/update/delete operations in sorted Batch ID order (several
+    operations on one batch run in request order) and logs all the changes as one
+    WAL frame. Returns the per-operation results, in request order, and how many
+    batches changed."""
+    results = [None] * len(operations)
+    keyed = []
+    for i, op in enumerate(operations):
+        batch_id = op.get("batch_id") if isinstance(op, dict) else None
+        if not batch_id or not isinstance(batch_id, str):
+            results[i] = {"batch_id": batch_id, "success": False, "status": 400,
+                          "message": "Batch ID required"}
+        else:
+            keyed.append((batch_id, i))
+    keyed.sort()
+
+    commit = None
+    operator = request_operator()
+    with db_lock.write:
+        staged = {}
+        # One ledger event per operation, so the history keeps each step.
+        events = []
+        for batch_id, i in keyed:
+            current = staged[batch_id] if batch_id in staged else db.search(batch_id)
+            details, error = plan_operation(operations[i], current)
+            if error:
+                status, message = error
+                results[i] = {"batch_id": batch_id, "success": False, "status": status, "message": message}
+                continue
+            events.append((batch_id, current, details, operations[i].get("op") == "delete"))
+            staged[batch_id] = details
+            results[i] = {"batch_id": batch_id, "success": True, "status": 200, "message": "OK"}
+
+        if staged:
+            # Copy-on-write as in the single routes; the tree sees the keys in order.
+            commit = engine.submit_transactions(staged.items())
+            changes.record(list(staged))
+            for batch_id, details in staged.items():
+                index_write(batch_id, db.search(batch_id), details)
+                db.insert(batch_id, details)
+            for batch_id, old_details, details, deleted in events:
+                ledger.record(batch_id, old_details, details, operator, deleted=deleted)
+
+    if commit is not None:
+        await_anchor(commit, f"batch of {len(staged)} records")
+    return results, len(staged)
+
 @app.route("/api/sync", methods=["POST"])
 def sync_inventory():
     data = request.json
@@ -126,41 +748,270 @@ def sync_inventory():
     if not incoming_inventory:
         return jsonify({"success": False, "message": "No data received"}), 400
 
-    sync_count = 0
+    sync_count = merge_inventory(incoming_inventory, f"peer:{request.remote_addr}")
+
+    return jsonify({
+        "success": True, 
+        "message": f"Merged {sync_count} records."
+    }), 200
+
+def merge_inventory(incoming_inventory, operator, adopt=False):
+    """Merges peer records into the local tree and returns how many changed.
+    'operator' names the peer in the event ledger. With 'adopt', every record
+    that differs is replaced by the peer's whole record (digest sync)."""
+    # Stage every change first, then log them all as ONE WAL frame (one fsync)
+    # before touching the tree memory.
+    with db_lock.write:
+        staged = {}
     
-    for item in incoming_inventory:
-        batch_id = item.get("batch_id")
-        details = item.get("details")
+        for item in incoming_inventory:
+            batch_id = item.get("batch_id")
+            details = item.get("details")
         
-        if not batch_id or not details:
-            continue
+            if not batch_id or not details:
+                continue
             
-        local_item = db.search(batch_id)
+            local_item = staged.get(batch_id) or db.search(batch_id)
+
+            if adopt:
+                # The digests differ, so take the peer's record as it is (name,
+                # expiry and emptied stamp too): afterwards the digests match and
+                # the next sync has nothing to fetch. Except an empty batch we
+                # don't hold (never had, or already purged): copying it would undo
+                # compaction. It keeps differing until the peer purges it too.
+                if not local_item and is_empty(details):
+                    continue
+                if local_item != details:
+                    staged[batch_id] = dict(details)
+                continue
         
-        if not local_item:
-            # NEW ITEM: Insert and log
+            if not local_item:
+                # NEW ITEM: Stage for insert (unless it is a dead batch we never held)
+                if not is_empty(details):
+                    staged[batch_id] = details
+            else:
+                # EXISTING ITEM: Overwrite if quantity differs. An emptied batch takes
+                # the peer's stamp, so both sides purge it at the same time.
+                if local_item["qty"] != details["qty"]:
+                    staged[batch_id] = with_qty(local_item, details["qty"], details.get("emptied_at"))
+
+        if not staged:
+            return 0
+        commit = engine.submit_transactions(staged.items())
+        changes.record(list(staged))
+        for batch_id, details in staged.items():
+            old_details = db.search(batch_id)
+            index_write(batch_id, old_details, details)
+            ledger.record(batch_id, old_details, details, operator)
             db.insert(batch_id, details)
-            wal_engine.log_transaction(batch_id, details)
-            sync_count += 1
-        else:
-            # EXISTING ITEM: Overwrite if quantity differs
-            if local_item["qty"] != details["qty"]:
-                local_item["qty"] = details["qty"]
-                wal_engine.log_transaction(batch_id, local_item)
-                sync_count += 1
+
+    await_anchor(commit, f"batch of {len(staged)} records")
+    return len(staged)
+
+# --- COMPACTION ---
+def is_purgeable(details, cutoff):
+    # Batches emptied before stamps existed have none, and count as long gone.
+    return is_empty(details) and details.get("emptied_at", 0) <= cutoff
+
+def compact_inventory(retention_s):
+    """Hard-deletes the batches that have been empty for longer than 'retention_s'
+    seconds, and returns how many were purged."""
+    cutoff = time.time() - retention_s
+    with db_lock.read:
+        candidates = [batch_id for batch_id, details in db.iter_items() if is_purgeable(details, cutoff)]
+    if not candidates:
+        return 0
+
+    with db_lock.write:
+        # Re-check under the write lock: a batch may have been restocked since the scan.
+        purge = [(batch_id, db.search(batch_id)) for batch_id in candidates]
+        purge = [(batch_id, details) for batch_id, details in purge
+                 if details is not None and is_purgeable(details, cutoff)]
+        if not purge:
+            return 0
+        commit = engine.submit_transactions((batch_id, None) for batch_id, _ in purge)
+        changes.record([batch_id for batch_id, _ in purge])
+        for batch_id, details in purge:
+            db.delete(batch_id)
+            index_write(batch_id, details, None)
+            ledger.record(batch_id, details, None, "compaction")
+
+    await_anchor(commit, f"purge of {len(purge)} empty batches")
+    return len(purge)
+
+@app.route("/api/compact", methods=["POST"])
+def compact():
+    # {"retention_days": N} (optional): purge batches empty for more than N days
+    retention_days = (request.json or {}).get("retention_days", TOMBSTONE_RETENTION_DAYS)
+    try:
+        retention_s = float(retention_days) * 86400
+    except (TypeError, ValueError):
+        return jsonify({"success": False, "message": "retention_days must be a number"}), 400
+    if retention_s < 0:
+        return jsonify({"success": False, "message": "retention_days must not be negative"}), 400
+
+    purged = compact_inventory(retention_s)
+    return jsonify({"success": True, "message": f"Purged {purged} empty batches."}), 200
+
+# --- P2P DIGEST SYNC ---
+@app.route("/api/digest", methods=["POST"])
+def describe_digest():
+    # {"prefixes": ["", "a", "a3", ...]}: digests of those buckets' children,
+    # or per-record digests for leaf buckets. One round trip per tree level.
+    prefixes = (request.json or {}).get("prefixes", [""])
+    try:
+        with db_lock.read:
+            digests = {prefix: range_digest.describe(prefix) for prefix in prefixes}
+    except ValueError as e:
+        return jsonify({"success": False, "message": str(e)}), 400
+    return jsonify({"success": True, "depth": range_digest.depth, "digests": digests}), 200
+
+@app.route("/api/batches", methods=["POST"])
+def fetch_batches():
+    # {"batch_ids": [...]}: the details of just those batches
+    batch_ids = (request.json or {}).get("batch_ids", [])
+    inventory = []
+    with db_lock.read:
+        for batch_id in batch_ids:
+            details = db.search(batch_id)
+            if details is not None:
+                inventory.append({"batch_id": batch_id, "details": details})
+    return jsonify({"success": True, "inventory": inventory}), 200
+
+def peer_address(target_ip):
+    host = target_ip.strip()
+    if ":" not in host:
+        host = f"{host}:{PEER_PORT}"
+    return host
+
+def is_lan_address(host):
+    # Literal IPs only: a hostname could resolve anywhere.
+    try:
+        ip = ipaddress.ip_address(host.strip("[]"))
+    except ValueError:
+        return False
+    return ip.is_private and not (ip.is_loopback or ip.is_link_local or ip.is_unspecified)
+
+def peer_refusal(address):
+    """Why /api/sync_peer may not pull from 'address' (host:port), or None if it may."""
+    if PEER_HOSTS:
+        if address in {peer_address(host) for host in PEER_HOSTS}:
+            return None
+        return (f"{address} is not a configured peer. Add it to PEER_HOSTS "
+                f"(host[:port], comma-separated) in the server's .env file and restart.")
+    host, _, port = address.rpartition(":")
+    if port == str(PEER_PORT) and is_lan_address(host):
+        return None
+    return (f"{address} is not a local network address on port {PEER_PORT}. To sync with "
+            f"other peers, list them in PEER_HOSTS in the server's .env file and restart.")
+
+def diff_with_peer(peer_url):
+    """Walks the peer's digest tree level by level and returns the Batch IDs
+    whose record differs from (or is missing in) the local inventory."""
+    wanted = []
+    frontier = [""]
+    while frontier:
+        res = requests.post(f"{peer_url}/digest", json={"prefixes": frontier}, timeout=PEER_TIMEOUT_S)
+        res.raise_for_status()
+        remote = res.json()
+        if remote.get("depth") != range_digest.depth:
+            raise ValueError("Peer uses a different digest depth")
+
+        next_frontier = []
+        for prefix in frontier:
+            theirs = remote["digests"][prefix]
+            with db_lock.read:
+                ours = range_digest.describe(prefix)
+            if "children" in theirs:
+                next_frontier.extend(
+                    prefix + child for child, digest in theirs["children"].items()
+                    if ours["children"].get(child) != digest
+                )
+            else:
+                wanted.extend(
+                    batch_id for batch_id, digest in theirs["records"].items()
+                    if ours["records"].get(batch_id) != digest
+                )
+        frontier = next_frontier
+    return wanted
+
+@app.route("/api/sync_peer", methods=["POST"])
+def sync_with_peer():
+    # {"target_ip": "192.168.1.20"}: pull only the batches that differ on the peer
+    target_ip = (request.json or {}).get("target_ip", "")
+    if not isinstance(target_ip, str) or not target_ip.strip():
+        return jsonify({"success": False, "message": "Target IP required"}), 400
+    address = peer_address(target_ip)
+    refusal = peer_refusal(address)
+    if refusal is not None:
+        return jsonify({"success": False, "message": refusal}), 403
+    peer_url = f"http://{address}/api"
+    operator = f"peer:{address}"
+
+    try:
+        try:
+            wanted = diff_with_peer(peer_url)
+        except requests.HTTPError:
+            # Older peer without digest support: fall back to a full pull.
+            res = requests.get(f"{peer_url}/view_all", timeout=PEER_TIMEOUT_S)
+            res.raise_for_status()
+            sync_count = merge_inventory(res.json().get("inventory", []), operator)
+            return jsonify({"success": True, "message": f"Merged {sync_count} records."}), 200
+
+        sync_count = 0
+        for start in range(0, len(wanted), PEER_FETCH_CHUNK):
+            res = requests.post(
+                f"{peer_url}/batches",
+                json={"batch_ids": wanted[start:start + PEER_FETCH_CHUNK]},
+                timeout=PEER_TIMEOUT_S
+            )
+            res.raise_for_status()
+            sync_count += merge_inventory(res.json().get("inventory", []), operator, adopt=True)
+    except (requests.RequestException, ValueError, KeyError) as e:
+        return jsonify({"success": False, "message": f"Peer sync failed: {e}"}), 502
 
     return jsonify({
-        "success": True, 
-        "message": f"Merged {sync_count} records."
+        "success": True,
+        "message": f"Merged {sync_count} records ({len(wanted)} differed)."
     }), 200
 
+# --- INSTRUMENTATION ROUTES ---
+@app.route("/api/metrics", methods=["GET"])
+def prometheus_metrics():
+    # Prometheus text exposition: point a scrape job at this URL.
+    return Response(metrics.render(), mimetype="text/plain; version=0.0.4")
+
+@app.route("/api/profiler", methods=["GET", "POST"])
+def sampling_profiler():
+    # POST {"enabled": true, "interval_ms": 10} starts sampling (clearing old samples),
+    # POST {"enabled": false} stops it. GET returns the stacks in collapsed format,
+    # ready for flamegraph.pl or speedscope.
+    if not PROFILER_ENABLED:
+        return jsonify({"success": False, "message": "Profiler is disabled (set PROFILER_ENABLED=1)"}), 404
+    if request.method == "GET":
+        return Response(metrics.profiler.collapsed(), mimetype="text/plain")
+
+    data = request.json or {}
+    if data.get("enabled"):
+        try:
+            interval_ms = float(data.get("interval_ms", 10))
+        except (TypeError, ValueError):
+            return jsonify({"success": False, "message": "interval_ms must be a number"}), 400
+        metrics.profiler.start(interval_ms / 1000)
+        return jsonify({"success": True, "message": f"Profiler sampling every {metrics.profiler.interval * 1000:g} ms"}), 200
+    metrics.profiler.stop()
+    return jsonify({"success": True, "message": f"Profiler stopped after {metrics.profiler.samples} samples"}), 200
+
 # --- SHUTDOWN ROUTE ---
 def shutdown_server():
     print("CORE: Shutdown sequence initiated...")
     time.sleep(1) 
     
-    print("CORE: Taking Snapshot before shutdown....")
-    wal_engine.create_checkpoint(db)
+    engine.stop_background_checkpointer()
+    # A half-recovered tree must not be snapshotted; the files on disk are intact.
+    if engine_ready.is_set():
+        print("CORE: Taking Snapshot before shutdown....")
+        engine.create_checkpoint(db, db_lock.read)
     os.kill(os.getpid(), signal.SIGINT)
 
 @app.route("/api/shutdown", methods=["POST"])
@@ -168,7 +1019,49 @@ def shutdown():
     threading.Thread(target=shutdown_server).start()
     return jsonify({"success": True, "message": "Server shutting down..."}), 200
 
+# --- BACKGROUND SERVICES ---
+def start_background_services():
+    # Runs on the boot thread once the tree is recovered.
+    if AUTO_CHECKPOINT:
+        engine.start_background_checkpointer(
+            db, db_lock.read,
+            max_bytes=CHECKPOINT_MAX_WAL_BYTES,
+            max_records=CHECKPOINT_MAX_WAL_RECORDS,
+            max_age=CHECKPOINT_MAX_AGE_S,
+        )
+
+def serve_production(host, port):
+    """Boots the engine and serves the routes on waitress until interrupted."""
+    from waitress import serve
+    start_engine()
+    print(f"CORE: Production server, {SERVER_THREADS} threads, "
+          f"up to {SERVER_CONNECTION_LIMIT} connections.")
+    serve(app, host=host, port=port, threads=SERVER_THREADS,
+          connection_limit=SERVER_CONNECTION_LIMIT, backlog=SERVER_BACKLOG,
+          channel_timeout=SERVER_KEEPALIVE_S, ident="AnchorMed")
 
 if __name__ == "__main__":
+    # Recovery may decode the WAL in worker processes; a frozen Windows build needs this.
+    multiprocessing.freeze_support()
+    parser = argparse.ArgumentParser(description="AnchorMed inventory server")
+    parser.add_argument("--data-dir", help=f"data directory (default: ${wal_engine.DATA_DIR_ENV} "
+                                           "or ~/Documents/AnchorMedData)")
+    parser.add_argument("--production", action="store_true",
+                        help="serve on waitress (pooled threads, keep-alive) instead of the debug server")
+    parser.add_argument("--port", type=int, default=5000)
+    args = parser.parse_args()
+    if args.data_dir:
+        # Also exported, so the reloader's serving child picks up the same directory.
+        os.environ[wal_engine.DATA_DIR_ENV] = args.data_dir
+        engine = wal_engine.configure(args.data_dir, WAL_FORMAT, segment_bytes=WAL_SEGMENT_BYTES,
+                                      replay_workers=WAL_REPLAY_WORKERS)
+
     # host="0.0.0.0" is required for other computers to talk to this computer
-    app.run(host="0.0.0.0", debug=True, port=5000)
+    if args.production:
+        serve_production("0.0.0.0", args.port)
+    else:
+        # debug=True runs this file twice (reloader parent + serving child). Only the
+        # serving child may recover and checkpoint; the idle parent never opens the store.
+        if os.environ.get("WERKZEUG_RUN_MAIN") == "true":
+            start_engine()
+        app.run(host="0.0.0.0", debug=True, port=args.port)
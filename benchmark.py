@@ -0,0 +1,345 @@
+import os
+import sys
+import tempfile
+
+# Point the engine at a scratch data directory BEFORE importing it: a benchmark
+# run must never read or overwrite the real clinic database.
+BENCH_HOME = tempfile.mkdtemp(prefix="anchormed-bench-")
+os.environ["ANCHORMED_DATA_DIR"] = BENCH_HOME
+os.environ["AUTO_CHECKPOINT"] = "0"
+
+import argparse
+import contextlib
+import io
+import json
+import platform
+import random
+import shutil
+import statistics
+import subprocess
+import threading
+import time
+import tracemalloc
+from datetime import datetime, timezone
+
+from btree_logic import BTree
+import wal_engine
+
+QUICK_SIZES = [1_000, 10_000]
+FULL_SIZES = [1_000, 10_000, 100_000]
+DEGREES = [3, 16, 64]
+
+
+def quiet():
+    """The engine logs every step with print(); keep the benchmark output readable."""
+    return contextlib.redirect_stdout(io.StringIO())
+
+
+def fresh_data_dir():
+    """Empties the scratch data directory (WAL, checkpoints, page file)."""
+    wal_engine.default_engine().close()
+    for name in os.listdir(wal_engine.DATA_DIR):
+        os.remove(os.path.join(wal_engine.DATA_DIR, name))
+
+
+def wal_log_bytes():
+    """Total size of the WAL segments on disk."""
+    return sum(os.path.getsize(path) for _, path in wal_engine.wal_segments())
+
+
+def make_records(n, seed=42):
+    """n inventory records with random (but reproducible) Batch IDs."""
+    rng = random.Random(seed)
+    ids = rng.sample(range(n * 10), n)
+    return [
+        (f"BATCH-{i:08d}", {"name": f"Medicine-{i % 500}", "qty": rng.randint(0, 500),
+                            "expiry": f"202{rng.randint(6, 9)}-{rng.randint(1, 12):02d}"})
+        for i in ids
+    ]
+
+
+def percentiles(samples):
+    samples = sorted(samples)
+    pick = lambda q: samples[min(len(samples) - 1, int(q * len(samples)))]
+    return {
+        "mean_ms": round(statistics.fmean(samples) * 1000, 3),
+        "p50_ms": round(pick(0.50) * 1000, 3),
+        "p95_ms": round(pick(0.95) * 1000, 3),
+        "max_ms": round(samples[-1] * 1000, 3),
+    }
+
+
+def timed(fn):
+    start = time.perf_counter()
+    result = fn()
+    return time.perf_counter() - start, result
+
+
+# --- 1. B-TREE ---
+def bench_btree(sizes, degrees):
+    results = []
+    for n in sizes:
+        records = make_records(n)
+        lookups = [k for k, _ in records]
+        random.Random(7).shuffle(lookups)
+        for t in degrees:
+            tree = BTree(t=t)
+            insert_s, _ = timed(lambda: [tree.insert(k, v) for k, v in records])
+            search_s, _ = timed(lambda: [tree.search(k) for k in lookups])
+            miss_s, _ = timed(lambda: [tree.search(k + "-x") for k in lookups])
+            bulk_s, _ = timed(lambda: BTree(t=t).bulk_load(sorted(records)))
+            results.append({
+                "name": "btree", "params": {"n": n, "t": t},
+                "metrics": {
+                    "insert_ops_s": round(n / insert_s),
+                    "search_hit_ops_s": round(n / search_s),
+                    "search_miss_ops_s": round(n / miss_s),
+                    "bulk_load_s": round(bulk_s, 4),
+                }
+            })
+            print(f"  btree n={n:>7} t={t:>3}: {n / insert_s:>10,.0f} inserts/s, {n / search_s:>10,.0f} searches/s")
+    return results
+
+
+# --- 2. WAL ---
+def bench_wal(ops, threads):
+    results = []
+    payload = {"name": "Paracetamol 500mg", "qty": 120, "expiry": "2027-03"}
+    for fmt in ("json", "binary"):
+        for group in (False, True):
+            for workers in sorted({1, *threads}):
+                fresh_data_dir()
+                wal_engine.set_wal_format(fmt)
+                if group:
+                    with quiet():
+                        wal_engine.enable_group_commit()
+                per_worker = ops // workers
+
+                def writer(w):
+                    for i in range(per_worker):
+                        wal_engine.log_transaction(f"W{w}-{i:06d}", payload)
+
+                def run():
+                    pool = [threading.Thread(target=writer, args=(w,)) for w in range(workers)]
+                    for th in pool:
+                        th.start()
+                    for th in pool:
+                        th.join()
+
+                with quiet():
+                    elapsed, _ = timed(run)
+                    wal_engine.disable_group_commit()
+                total = per_worker * workers
+                results.append({
+                    "name": "wal.log_transaction",
+                    "params": {"format": fmt, "group_commit": group, "threads": workers},
+                    "metrics": {
+                        "ops_s": round(total / elapsed, 1),
+                        "bytes_per_record": round(wal_log_bytes() / total, 1),
+                    }
+                })
+                print(f"  wal {fmt:>6} group={str(group):>5} threads={workers:>2}: {total / elapsed:>9,.1f} ops/s")
+    # Group commit against one fsync per record, with the same writers.
+    ops_s = {(r["params"]["format"], r["params"]["group_commit"], r["params"]["threads"]): r["metrics"]["ops_s"]
+             for r in results}
+    for fmt, group, workers in ops_s:
+        if group:
+            gain = ops_s[fmt, True, workers] / ops_s[fmt, False, workers]
+            print(f"  wal {fmt:>6} group commit vs fsync per record, threads={workers:>2}: {gain:.2f}x")
+    wal_engine.set_wal_format("json")
+    return results
+
+
+# --- 3. RECOVERY + CHECKPOINT ---
+def build_store(records, wal_records, degree):
+    """Writes a checkpoint of 'records' plus 'wal_records' WAL entries on top."""
+    fresh_data_dir()
+    tree = BTree(t=degree)
+    tree.bulk_load(sorted(records))
+    with quiet():
+        wal_engine.recover_tree(BTree(t=degree))  # resets the engine's checkpoint state
+        wal_engine.create_checkpoint(tree, full=True)
+        tail = make_records(wal_records, seed=99)
+        for start in range(0, len(tail), 1000):
+            wal_engine.log_transactions(tail[start:start + 1000])
+    return tree
+
+
+def bench_recovery(sizes, degree):
+    results = []
+    for n in sizes:
+        for wal_n in sorted({0, n // 10}):
+            build_store(make_records(n), wal_n, degree)
+            checkpoint_bytes = os.path.getsize(wal_engine.CHECKPOINT_FILE)
+            wal_bytes = wal_log_bytes()
+            with quiet():
+                elapsed, _ = timed(lambda: wal_engine.recover_tree(BTree(t=degree)))
+            results.append({
+                "name": "recover_tree",
+                "params": {"checkpoint_records": n, "wal_records": wal_n, "t": degree},
+                "metrics": {"seconds": round(elapsed, 4),
+                            "checkpoint_bytes": checkpoint_bytes, "wal_bytes": wal_bytes}
+            })
+            print(f"  recover checkpoint={n:>7} wal={wal_n:>6}: {elapsed:.3f}s")
+    return results
+
+
+def bench_checkpoint(sizes, degree):
+    results = []
+    for n in sizes:
+        for kind in ("full", "delta"):
+            tree = build_store(make_records(n), 0, degree)
+            if kind == "delta":
+                # A typical quiet period: 1% of the batches changed since the last snapshot.
+                for k, v in make_records(n)[: max(1, n // 100)]:
+                    tree.insert(k, {**v, "qty": 0})
+            dirty = set(tree.dirty)
+            with quiet():
+                elapsed, _ = timed(lambda: wal_engine.create_checkpoint(tree, full=(kind == "full")))
+                # Measure memory on a second, identical run (tracemalloc slows the timing run).
+                tree.mark_dirty(dirty)
+                wal_engine.recover_tree(BTree(t=degree))
+                tracemalloc.start()
+                wal_engine.create_checkpoint(tree, full=(kind == "full"))
+                _, peak = tracemalloc.get_traced_memory()
+                tracemalloc.stop()
+            results.append({
+                "name": "create_checkpoint",
+                "params": {"records": n, "kind": kind, "t": degree},
+                "metrics": {"seconds": round(elapsed, 4), "peak_mem_kib": round(peak / 1024, 1)}
+            })
+            print(f"  checkpoint {kind:>5} n={n:>7}: {elapsed:.3f}s, peak {peak / 1024:,.0f} KiB")
+    return results
+
+
+# --- 4. HTTP (Flask test client) ---
+def bench_http(n, repeats):
+    with quiet():
+        fresh_data_dir()
+        import app as anchor_app
+        anchor_app.start_engine(background=False)
+    client = anchor_app.app.test_client()
+    records = make_records(n)
+
+    sync_times = []
+    with quiet():
+        for start in range(0, n, 100):
+            chunk = [{"batch_id": k, "details": v} for k, v in records[start:start + 100]]
+            elapsed, res = timed(lambda: client.post("/api/sync", json={"inventory": chunk}))
+            assert res.status_code == 200, res.status_code
+            sync_times.append(elapsed)
+
+    results = [{"name": "http.sync", "params": {"records": n, "batch": 100},
+                "metrics": percentiles(sync_times)}]
+    print(f"  POST /api/sync (100 records): p50 {results[-1]['metrics']['p50_ms']} ms")
+
+    # Supplier delivery: one request per batch vs one /api/batch per 100 operations.
+    delivery = make_records(min(n, 1000), seed=7)
+    ops = [{"op": "add", "batch_id": k + "-D", "med_name": v["name"], "expiry": v["expiry"], "qty": v["qty"]}
+           for k, v in delivery]
+    with quiet():
+        single_s, _ = timed(lambda: [client.post("/api/add", json=op) for op in ops])
+        for op in ops:
+            op["batch_id"] += "B"
+        batch_s, _ = timed(lambda: [client.post("/api/batch", json={"operations": ops[i:i + 100]})
+                                    for i in range(0, len(ops), 100)])
+    for mode, elapsed in (("per_request", single_s), ("batch_100", batch_s)):
+        results.append({"name": "http.add", "params": {"records": len(ops), "mode": mode},
+                        "metrics": {"ops_s": round(len(ops) / elapsed, 1)}})
+        print(f"  add {mode:>11}: {len(ops) / elapsed:>9,.1f} ops/s")
+
+    cases = [
+        ("full", "/api/view_all", {}),
+        ("full_gzip", "/api/view_all", {"Accept-Encoding": "gzip"}),
+        ("page", "/api/view_all?limit=500", {}),
+        ("ndjson", "/api/view_all?format=ndjson", {}),
+    ]
+    for label, url, headers in cases:
+        samples = []
+        for _ in range(repeats):
+            elapsed, res = timed(lambda: client.get(url, headers=headers).get_data())
+            samples.append(elapsed)
+        results.append({"name": "http.view_all", "params": {"records": n, "mode": label},
+                        "metrics": {**percentiles(samples), "bytes": len(res)}})
+        print(f"  GET {url} ({label}): p50 {results[-1]['metrics']['p50_ms']} ms, {len(res):,} bytes")
+    return results
+
+
+# --- REPORTING ---
+def git_commit():
+    try:
+        out = subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True,
+                             text=True, cwd=os.path.dirname(os.path.abspath(__file__)))
+        return out.stdout.strip() or None
+    except OSError:
+        return None
+
+
+def compare(old_path, results):
+    """Prints each metric's change against an earlier results file."""
+    with open(old_path) as f:
+        old = {(r["name"], json.dumps(r["params"], sort_keys=True)): r["metrics"] for r in json.load(f)["results"]}
+    print(f"\n--- 📈 CHANGE VS {old_path} ---")
+    for r in results:
+        before = old.get((r["name"], json.dumps(r["params"], sort_keys=True)))
+        if not before:
+            continue
+        for metric, value in r["metrics"].items():
+            if before.get(metric):
+                change = (value - before[metric]) / before[metric] * 100
+                print(f"{r['name']:<20} {json.dumps(r['params'], sort_keys=True):<60} {metric:<18} {change:+7.1f}%")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="AnchorMed engine benchmarks")
+    parser.add_argument("--quick", action="store_true", help="smaller datasets, for a fast smoke run")
+    parser.add_argument("--output", default="bench_results.json", help="where to write the JSON results")
+    parser.add_argument("--compare", help="an earlier results file to diff against")
+    parser.add_argument("--only", nargs="+", choices=["btree", "wal", "recovery", "checkpoint", "http"],
+                        help="run only these groups")
+    args = parser.parse_args()
+
+    sizes = QUICK_SIZES if args.quick else FULL_SIZES
+    groups = set(args.only or ["btree", "wal", "recovery", "checkpoint", "http"])
+    results = []
+    print("=== ⏱️  ANCHOR-MED BENCHMARK SUITE ===")
+    print(f"Scratch data directory: {wal_engine.DATA_DIR}")
+    try:
+        if "btree" in groups:
+            print("\n[1] B-Tree insert / search")
+            results += bench_btree(sizes, DEGREES)
+        if "wal" in groups:
+            print("\n[2] WAL append (fsync per commit)")
+            results += bench_wal(ops=400 if args.quick else 2000, threads=[8, 32])
+        if "recovery" in groups:
+            print("\n[3] Recovery")
+            results += bench_recovery(sizes, degree=16)
+        if "checkpoint" in groups:
+            print("\n[4] Checkpoint")
+            results += bench_checkpoint(sizes, degree=16)
+        if "http" in groups:
+            print("\n[5] HTTP via Flask test client")
+            results += bench_http(sizes[-1], repeats=5 if args.quick else 20)
+    finally:
+        shutil.rmtree(BENCH_HOME, ignore_errors=True)
+
+    report = {
+        "meta": {
+            "commit": git_commit(),
+            "timestamp": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "quick": args.quick,
+        },
+        "results": results,
+    }
+    with open(args.output, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"\n✅ {len(results)} results written to {args.output}")
+
+    if args.compare:
+        compare(args.compare, results)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,4 +1,6 @@
-from typing import Any
+from bisect import bisect_left, bisect_right
+from itertools import islice
+from typing import Any, Iterable, Iterator
 
 class BTreeNode:
     """
@@ -12,13 +14,102 @@ class BTreeNode:
         keys (list): Sorted list of keys (e.g., Batch IDs) stored in this node.
         values (list): List of values (e.g., Medicine Details) corresponding to the keys.
         children (list): List of BTreeNode objects representing the children of this node.
+
+    Nodes use __slots__ so a large tree (high 't', many nodes) does not pay for a
+    per-instance __dict__. Keys and values are kept as parallel lists, which lets
+    lookups run bisect directly over 'keys'.
     """
+    __slots__ = ("leaf", "keys", "values", "children")
+
     def __init__(self, leaf: bool = False) -> None:
         self.leaf: bool = leaf
         self.keys: list[Any] = []
         self.values: list[Any] = []
         self.children: list['BTreeNode'] = []
 
+class BTreeCursor:
+    """
+    A seekable, forward-only position inside a BTree, for streaming and pagination.
+    
+    The cursor keeps an explicit stack of (node, next key index) pairs instead of
+    recursing, so it can be paused between records and resumed later, or moved
+    anywhere with seek() in O(log n).
+    If the tree is modified, seek() again before reading on.
+
+    Attributes:
+        tree (BTree): The tree being walked.
+    """
+    __slots__ = ("tree", "_stack")
+
+    def __init__(self, tree: 'BTree', start: Any = None) -> None:
+        """
+        Args:
+            tree (BTree): The tree to walk.
+            start: Position the cursor at the first key >= start (default: first key).
+        """
+        self.tree: 'BTree' = tree
+        self._stack: list[tuple[BTreeNode, int]] = []
+        self.seek(start)
+
+    def seek(self, start: Any = None, inclusive: bool = True) -> None:
+        """
+        Moves the cursor to the first key >= start (> start if not inclusive).
+
+        Args:
+            start: The key to seek to. None means the very first key.
+            inclusive (bool): Whether a key equal to 'start' is included.
+        """
+        self._stack = []
+        node: BTreeNode = self.tree.root
+        # Descend to the first matching key, remembering where to resume in each node.
+        while True:
+            if start is None:
+                i: int = 0
+            elif inclusive:
+                i = bisect_left(node.keys, start)
+            else:
+                i = bisect_right(node.keys, start)
+            self._stack.append((node, i))
+            if node.leaf or (not inclusive and i > 0 and node.keys[i - 1] == start):
+                # An exact match in an internal node: everything in children[i] is > start.
+                if not node.leaf:
+                    self._push_leftmost(self.tree._child(node, i))
+                break
+            node = self.tree._child(node, i)
+
+    def _push_leftmost(self, node: BTreeNode) -> None:
+        """Pushes the leftmost path of the subtree rooted at 'node'."""
+        while True:
+            self._stack.append((node, 0))
+            if node.leaf:
+                break
+            node = self.tree._child(node, 0)
+
+    def __iter__(self) -> 'BTreeCursor':
+        return self
+
+    def __next__(self) -> tuple[Any, Any]:
+        stack: list[tuple[BTreeNode, int]] = self._stack
+        while stack:
+            node, i = stack.pop()
+            if i >= len(node.keys):
+                continue
+            stack.append((node, i + 1))
+            if not node.leaf:
+                # Next comes the leftmost path of the subtree right of key i.
+                self._push_leftmost(self.tree._child(node, i + 1))
+            return node.keys[i], node.values[i]
+        raise StopIteration
+
+    def take(self, n: int) -> list[tuple[Any, Any]]:
+        """
+        Reads up to 'n' records from the current position (e.g. one page).
+
+        Returns:
+            list: Up to n (key, value) pairs in key order.
+        """
+        return list(islice(self, n))
+
 class BTree:
     """
     A B-Tree data structure implementation for storing key-value pairs.
@@ -32,6 +123,18 @@ class BTree:
                  - Every node (except root) must have at least t-1 keys.
                  - Every node can have at most 2*t - 1 keys.
         root (BTreeNode): The root node of the B-Tree.
+        dirty (set): Keys written since the last snapshot (see take_dirty), which
+                     lets a checkpoint persist only what changed.
+        key_count (int): Number of keys stored.
+        node_count (int): Number of nodes in the tree.
+        height (int): Number of levels (1 for a lone root leaf).
+                      The three counters are kept up to date by every operation,
+                      so reading them costs nothing.
+
+    Nodes are reached through a few storage hooks (_child, _ref, _new_node, _touch,
+    _free_node).
+    Here they link nodes directly in memory; a storage backend such as
+    paged_btree.PagedBTree overrides them to keep nodes in pages on disk.
     """
     def __init__(self, t: int) -> None:
         """
@@ -39,9 +142,37 @@ class BTree:
 
         Args:
             t (int): The minimum degree 't'. A higher 't' results in a flatter tree.
+
+        Raises:
+            ValueError: If t is smaller than 2 (a B-Tree node must be able to split).
         """
+        if t < 2:
+            raise ValueError(f"B-Tree minimum degree must be at least 2, got {t}")
         self.root: BTreeNode = BTreeNode(True)
         self.t: int = t
+        self.dirty: set[Any] = set()
+        self.key_count: int = 0
+        self.node_count: int = 1
+        self.height: int = 1
+
+    # --- Node storage hooks ---
+    def _child(self, node: BTreeNode, i: int) -> BTreeNode:
+        """Returns the i-th child of 'node'."""
+        return node.children[i]
+
+    def _ref(self, node: BTreeNode) -> Any:
+        """Returns what a parent stores in 'children' to point at 'node'."""
+        return node
+
+    def _new_node(self, leaf: bool = False) -> BTreeNode:
+        """Creates an empty node that belongs to this tree."""
+        return BTreeNode(leaf)
+
+    def _touch(self, node: BTreeNode) -> None:
+        """Records that 'node' was modified. Call it after the change is made."""
+
+    def _free_node(self, node: BTreeNode) -> None:
+        """Releases a node that is no longer part of the tree (after a merge)."""
 
     def insert(self, k: Any, v: Any) -> None:
         """
@@ -55,13 +186,16 @@ class BTree:
             k: The key to insert (must be comparable, e.g., integer or string).
             v: The value associated with the key.
         """
+        self.dirty.add(k)
         root: BTreeNode = self.root
         # Check if the root is full (contains 2*t - 1 keys)
         if len(root.keys) == (2 * self.t) - 1:
-            temp: BTreeNode = BTreeNode()
+            temp: BTreeNode = self._new_node()
             self.root = temp
+            self.node_count += 1
+            self.height += 1
             # Make the old root a child of the new root
-            temp.children.insert(0, root)
+            temp.children.insert(0, self._ref(root))
             # Split the old root
             self.split_child(temp, 0)
             # Insert the new key into the appropriate child of the new root
@@ -81,51 +215,40 @@ class BTree:
             k: The key to insert.
             v: The value to insert.
         """
-        i: int = len(x.keys) - 1
-        
-        # --- NEW LOGIC: Check for Duplicates / Update Existing ---
-        # Scan to see if 'k' is already in this node.
-        # If found, update the value and exit, ensuring unique keys.
-        for idx, key in enumerate(x.keys):
-            if key == k:
-                x.values[idx] = v # UPDATE the existing value
-                return 
-        # ---------------------------------------------------------
+        # Binary search for the first key >= k (keys are always sorted).
+        i: int = bisect_left(x.keys, k)
+
+        # --- Duplicate Check / Update Existing ---
+        # If 'k' is already in this node, update the value and exit, ensuring unique keys.
+        if i < len(x.keys) and x.keys[i] == k:
+            x.values[i] = v # UPDATE the existing value
+            self._touch(x)
+            return
+        # -----------------------------------------
 
         if x.leaf:
-            # If x is a leaf, we find the correct position and insert the key/value directly.
-            x.keys.append(None)
-            x.values.append(None)
-            
-            # Shift keys/values greater than k to the right
-            while i >= 0 and k < x.keys[i]:
-                x.keys[i + 1] = x.keys[i]
-                x.values[i + 1] = x.values[i]
-                i -= 1
-            
-            # Insert the new key/value at the correct position
-            x.keys[i + 1] = k
-            x.values[i + 1] = v
+            # If x is a leaf, 'i' is already the correct position for the new key/value.
+            x.keys.insert(i, k)
+            x.values.insert(i, v)
+            self._touch(x)
+            self.key_count += 1
         else:
-            # If x is not a leaf, find the child that should contain the key.
-            while i >= 0 and k < x.keys[i]:
-                i -= 1
-            i += 1
-            
+            # If x is not a leaf, 'i' is the index of the child that should contain the key.
             # If the found child is full, split it before descending.
-            if len(x.children[i].keys) == (2 * self.t) - 1:
+            if len(self._child(x, i).keys) == (2 * self.t) - 1:
                 self.split_child(x, i)
                 
                 # CRITICAL FIX: Check the key that just bubbled up!
                 if k == x.keys[i]:
                     x.values[i] = v  # after finding it, just update the value and exit
+                    self._touch(x)
                     return 
                 
                 if k > x.keys[i]:
                     i += 1
             
             # Recurse into the appropriate child
-            self.insert_non_full(x.children[i], k, v)
+            self.insert_non_full(self._child(x, i), k, v)
 
             
     def split_child(self, x: BTreeNode, i: int) -> None:
@@ -140,8 +263,8 @@ class BTree:
             i (int): The index of the child in x.children that is full and needs splitting.
         """
         t: int = self.t
-        y: BTreeNode = x.children[i] # The full child node
-        z: BTreeNode = BTreeNode(y.leaf) # The new node to hold the second half of y's keys
+        y: BTreeNode = self._child(x, i) # The full child node
+        z: BTreeNode = self._new_node(y.leaf) # The new node to hold the second half of y's keys
         
         # 1. Save the median data BEFORE truncating y
         # The key at index t-1 is the median (since indices are 0-based and length is 2t-1)
@@ -166,10 +289,270 @@ class BTree:
             
         # 4. Link everything to parent x
         # Insert z as a child of x immediately after y
-        x.children.insert(i + 1, z)
+        x.children.insert(i + 1, self._ref(z))
         # Move the median key and value up into x
         x.keys.insert(i, median_key)
         x.values.insert(i, median_val)
+        for node in (y, z, x):
+            self._touch(node)
+        self.node_count += 1
+
+    def delete(self, k: Any) -> bool:
+        """
+        Removes a key (and its value) from the B-Tree.
+        
+        Works top-down in a single pass, like insert: before descending into a child
+        that holds only t-1 keys, the child is topped up by borrowing a key from a
+        sibling (a rotation through the parent) or by merging it with a sibling.
+        The key is therefore always removed from a node that stays at or above the
+        minimum. If the root is left without keys, the tree height shrinks by one.
+
+        Args:
+            k: The key to remove.
+
+        Returns:
+            bool: True if the key was found and removed, False if it was not present.
+        """
+        found: bool = self._delete_from(self.root, k)
+        root: BTreeNode = self.root
+        if not root.keys and not root.leaf:
+            # The root's last key moved down into a merge: its only child takes over.
+            self.root = self._child(root, 0)
+            self._free_node(root)
+            self.node_count -= 1
+            self.height -= 1
+        if found:
+            self.dirty.add(k)
+            self.key_count -= 1
+        return found
+
+    def _delete_from(self, x: BTreeNode, k: Any) -> bool:
+        """
+        Helper method to delete 'k' from the subtree rooted at 'x'.
+        'x' is the root or holds at least t keys, so it can give one up.
+        """
+        t: int = self.t
+        while True:
+            i: int = bisect_left(x.keys, k)
+
+            if i < len(x.keys) and x.keys[i] == k:
+                # Case 1: the key is in a leaf - just remove it.
+                if x.leaf:
+                    del x.keys[i]
+                    del x.values[i]
+                    self._touch(x)
+                    return True
+
+                # Case 2a: the left child can spare a key - replace k with its
+                # predecessor, then delete the predecessor from that subtree.
+                left: BTreeNode = self._child(x, i)
+                if len(left.keys) >= t:
+                    x.keys[i], x.values[i] = self._edge_item(left, last=True)
+                    self._touch(x)
+                    x, k = left, x.keys[i]
+                    continue
+
+                # Case 2b: same with the successor from the right child.
+                right: BTreeNode = self._child(x, i + 1)
+                if len(right.keys) >= t:
+                    x.keys[i], x.values[i] = self._edge_item(right, last=False)
+                    self._touch(x)
+                    x, k = right, x.keys[i]
+                    continue
+
+                # Case 2c: both children are minimal - merge them around k and
+                # delete k from the merged node.
+                x = self._merge_children(x, i)
+                continue
+
+            # Case 3: the key is not in this node; it can only be below children[i].
+            if x.leaf:
+                return False
+            x = self._ensure_spare_key(x, i)
+
+    def _edge_item(self, x: BTreeNode, last: bool) -> tuple[Any, Any]:
+        """Returns the largest (last=True) or smallest key-value pair under 'x'."""
+        while not x.leaf:
+            x = self._child(x, len(x.children) - 1 if last else 0)
+        j: int = -1 if last else 0
+        return x.keys[j], x.values[j]
+
+    def _ensure_spare_key(self, x: BTreeNode, i: int) -> BTreeNode:
+        """
+        Makes sure x.children[i] holds at least t keys before the delete descends
+        into it, and returns the node to descend into.
+        """
+        t: int = self.t
+        child: BTreeNode = self._child(x, i)
+        if len(child.keys) >= t:
+            return child
+
+        # Borrow from the left sibling: the separator comes down to the front of
+        # the child, and the sibling's last key goes up to replace it.
+        if i > 0:
+            left: BTreeNode = self._child(x, i - 1)
+            if len(left.keys) >= t:
+                child.keys.insert(0, x.keys[i - 1])
+                child.values.insert(0, x.values[i - 1])
+                x.keys[i - 1] = left.keys.pop()
+                x.values[i - 1] = left.values.pop()
+                if not child.leaf:
+                    child.children.insert(0, left.children.pop())
+                for node in (left, child, x):
+                    self._touch(node)
+                return child
+
+        # Borrow from the right sibling (the mirror image).
+        if i < len(x.children) - 1:
+            right: BTreeNode = self._child(x, i + 1)
+            if len(right.keys) >= t:
+                child.keys.append(x.keys[i])
+                child.values.append(x.values[i])
+                x.keys[i] = right.keys.pop(0)
+                x.values[i] = right.values.pop(0)
+                if not child.leaf:
+                    child.children.append(right.children.pop(0))
+                for node in (right, child, x):
+                    self._touch(node)
+                return child
+            # Both siblings are minimal too: merge with the right one...
+            return self._merge_children(x, i)
+
+        # ...or, for the last child, with the left one.
+        return self._merge_children(x, i - 1)
+
+    def _merge_children(self, x: BTreeNode, i: int) -> BTreeNode:
+        """
+        Merges x.children[i + 1] and the separator x.keys[i] into x.children[i].
+        Both children hold t-1 keys, so the result holds exactly 2t-1.
+
+        Returns:
+            BTreeNode: The merged node.
+        """
+        left: BTreeNode = self._child(x, i)
+        right: BTreeNode = self._child(x, i + 1)
+        left.keys.append(x.keys.pop(i))
+        left.values.append(x.values.pop(i))
+        left.keys.extend(right.keys)
+        left.values.extend(right.values)
+        if not left.leaf:
+            left.children.extend(right.children)
+        x.children.pop(i + 1)
+        self._touch(left)
+        self._touch(x)
+        self._free_node(right)
+        self.node_count -= 1
+        return left
+
+    def bulk_load(self, items: Iterable[tuple[Any, Any]]) -> int:
+        """
+        Rebuilds the tree bottom-up from key-value pairs already sorted by key.
+        
+        Instead of N top-down inserts (each one splitting nodes on the way down),
+        the pairs are packed into leaves that are as full as possible, and each
+        internal level is then built from the level below it. The whole build
+        is O(n). Any existing contents of the tree are replaced.
+
+        Args:
+            items: An iterable of (key, value) pairs in ascending key order.
+                   If a key repeats, the last value wins (same as insert).
+
+        Returns:
+            int: The number of unique keys loaded into the tree.
+
+        Raises:
+            ValueError: If the keys are not in ascending order.
+        """
+        keys: list[Any] = []
+        values: list[Any] = []
+        for k, v in items:
+            if keys and k == keys[-1]:
+                values[-1] = v # Duplicate key: keep the latest value
+                continue
+            if keys and k < keys[-1]:
+                raise ValueError(f"bulk_load requires sorted keys: {k!r} came after {keys[-1]!r}")
+            keys.append(k)
+            values.append(v)
+
+        n: int = len(keys)
+        max_keys: int = (2 * self.t) - 1
+
+        # 1. Build the leaf level.
+        # Every leaf except the last is followed by one separator that moves up a level,
+        # so each leaf "consumes" up to 2t entries. Spreading the remaining keys evenly
+        # keeps every leaf between t-1 and 2t-1 keys.
+        leaf_count: int = max(1, -(-(n + 1) // (max_keys + 1)))
+        leaf_keys_total: int = n - (leaf_count - 1)
+        level: list[BTreeNode] = []
+        height: int = 1
+        sep_keys: list[Any] = []
+        sep_values: list[Any] = []
+        pos: int = 0
+        for j in range(leaf_count):
+            size: int = leaf_keys_total // leaf_count + (1 if j < leaf_keys_total % leaf_count else 0)
+            leaf: BTreeNode = self._new_node(True)
+            leaf.keys = keys[pos:pos + size]
+            leaf.values = values[pos:pos + size]
+            self._touch(leaf)
+            level.append(leaf)
+            pos += size
+            if j < leaf_count - 1:
+                sep_keys.append(keys[pos])
+                sep_values.append(values[pos])
+                pos += 1
+
+        node_count: int = len(level)
+
+        # 2. Build internal levels until a single root remains.
+        # Each parent takes between t and 2t children; the separators between its
+        # children become its keys and the separators between parents move up again.
+        while len(level) > 1:
+            parent_count: int = -(-len(level) // (max_keys + 1))
+            parents: list[BTreeNode] = []
+            up_keys: list[Any] = []
+            up_values: list[Any] = []
+            pos = 0
+            for j in range(parent_count):
+                size = len(level) // parent_count + (1 if j < len(level) % parent_count else 0)
+                parent: BTreeNode = self._new_node(False)
+                parent.children = [self._ref(child) for child in level[pos:pos + size]]
+                parent.keys = sep_keys[pos:pos + size - 1]
+                parent.values = sep_values[pos:pos + size - 1]
+                self._touch(parent)
+                parents.append(parent)
+                pos += size
+                if j < parent_count - 1:
+                    up_keys.append(sep_keys[pos - 1])
+                    up_values.append(sep_values[pos - 1])
+            level, sep_keys, sep_values = parents, up_keys, up_values
+            node_count += len(parents)
+            height += 1
+
+        self.root = level[0]
+        self.key_count, self.node_count, self.height = n, node_count, height
+        self.dirty = set() # The loaded data came from a snapshot, so nothing is dirty yet
+        return n
+
+    def take_dirty(self) -> set[Any]:
+        """
+        Returns the keys written since the last call and starts a fresh dirty set.
+
+        Returns:
+            set: Keys inserted or updated since the previous snapshot.
+        """
+        dirty: set[Any] = self.dirty
+        self.dirty = set()
+        return dirty
+
+    def mark_dirty(self, keys: Iterable[Any]) -> None:
+        """
+        Flags keys as changed, e.g. a value edited in place, or keys handed back
+        after a snapshot that failed to persist.
+
+        Args:
+            keys: The keys to flag.
+        """
+        self.dirty.update(keys)
 
     def search(self, k: Any, x: BTreeNode | None = None) -> Any | None:
         """
@@ -184,56 +567,74 @@ class BTree:
         """
         if x is None: 
             x = self.root
-        i: int = 0
-        
-        # Find the first key greater than or equal to k
-        while i < len(x.keys) and k > x.keys[i]:
-            i += 1
-            
-        # If the found key is equal to k, return the value
-        if i < len(x.keys) and k == x.keys[i]:
-            return x.values[i]
-        
-        # If key is not found and this is a leaf node, the key doesn't exist
-        if x.leaf:
-            return None
-        
-        # Recurse into the appropriate child
-        return self.search(k, x.children[i])
+
+        # Walk down iteratively, using binary search inside each node.
+        while True:
+            # Find the first key greater than or equal to k
+            i: int = bisect_left(x.keys, k)
+
+            # If the found key is equal to k, return the value
+            if i < len(x.keys) and x.keys[i] == k:
+                return x.values[i]
+
+            # If key is not found and this is a leaf node, the key doesn't exist
+            if x.leaf:
+                return None
+
+            # Descend into the appropriate child
+            x = self._child(x, i)
     
+    def cursor(self, start: Any = None) -> BTreeCursor:
+        """
+        Opens a seekable cursor at the first key >= start.
+
+        Args:
+            start: Where to position the cursor (default: the first key).
+
+        Returns:
+            BTreeCursor: A forward cursor over (key, value) pairs.
+        """
+        return BTreeCursor(self, start)
+
+    def iter_items(self, start: Any = None, end: Any = None) -> Iterator[tuple[Any, Any]]:
+        """
+        Lazily yields (key, value) pairs in key order, without building a list.
+
+        Args:
+            start: If given, iteration begins at the first key >= start.
+            end: If given, iteration stops before the first key >= end.
+
+        Yields:
+            tuple: (key, value) pairs in ascending key order.
+        """
+        for k, v in BTreeCursor(self, start):
+            if end is not None and k >= end:
+                return
+            yield k, v
+
+    def iter_prefix(self, prefix: str) -> Iterator[tuple[Any, Any]]:
+        """
+        Lazily yields the (key, value) pairs whose string key starts with 'prefix'.
+
+        Args:
+            prefix (str): The Batch ID prefix to scan, e.g. "AMX-2026".
+
+        Yields:
+            tuple: Matching (key, value) pairs in ascending key order.
+        """
+        for k, v in BTreeCursor(self, prefix):
+            if not k.startswith(prefix):
+                return
+            yield k, v
+
     def get_all_data(self) -> list[dict[str, Any]]:
         """
         Retrieves all key-value pairs stored in the tree.
         
+        Prefer iter_items() / cursor() when the caller can consume records lazily.
+
         Returns:
             list: A list of dictionaries, where each dict contains 'batch_id' and 'details'.
                   The list is sorted by batch_id (in-order traversal).
         """
-        results: list[dict[str, Any]] = []
-        self._traverse_node(self.root, results)
-        return results
-
-    def _traverse_node(self, node: BTreeNode | None, results: list[dict[str, Any]]) -> None:
-        """
-        Helper method to perform an in-order traversal of the tree.
-        
-        Args:
-            node (BTreeNode): The current node being traversed.
-            results (list): The list to append found data to.
-        """
-        if node:
-            # Iterate through keys and interleave child traversals
-            for i in range(len(node.keys)):
-                # 1. Traverse left child (if not leaf)
-                if not node.leaf:
-                    self._traverse_node(node.children[i], results)
-                
-                # 2. Process current key (Batch ID) + Value (Medicine Data)
-                results.append({
-                    "batch_id": node.keys[i],
-                    "details": node.values[i]
-                })
-            
-            # 3. Traverse the last remaining child (rightmost)
-            if not node.leaf:
-                self._traverse_node(node.children[len(node.keys)], results)
+        return [{"batch_id": k, "details": v} for k, v in self.iter_items()]
@@ -0,0 +1,76 @@
+import threading
+import uuid
+from collections import deque
+from typing import Any
+
+class ChangeFeed:
+    """
+    A bounded, in-memory feed of which batches changed, in commit order.
+    
+    Every WAL-logged mutation gets the next sequence number. Clients remember the
+    last sequence they saw and ask for everything after it, instead of refetching
+    the whole inventory. The feed only keeps the most recent 'capacity' entries;
+    a client that fell further behind (or talks to a restarted server, which has
+    a new epoch) is told to reset and do one full fetch.
+
+    Attributes:
+        epoch (str): Random id of this feed instance. Sequence numbers are only
+                     comparable within one epoch (they restart with the server).
+        capacity (int): How many changes are retained.
+    """
+    def __init__(self, capacity: int = 10000) -> None:
+        """
+        Args:
+            capacity (int): The number of most recent changes to keep.
+        """
+        self.epoch: str = uuid.uuid4().hex[:12]
+        self.capacity: int = capacity
+        self._entries: deque[tuple[int, Any]] = deque(maxlen=capacity)
+        self._seq: int = 0
+        self._lock: threading.Lock = threading.Lock()
+
+    @property
+    def seq(self) -> int:
+        """The sequence number of the latest change (0 if nothing changed yet)."""
+        return self._seq
+
+    def record(self, keys: list[Any]) -> int:
+        """
+        Appends one change per key, in order.
+
+        Args:
+            keys (list): The Batch IDs that were just logged to the WAL.
+
+        Returns:
+            int: The sequence number of the last appended change.
+        """
+        with self._lock:
+            for key in keys:
+                self._seq += 1
+                self._entries.append((self._seq, key))
+            return self._seq
+
+    def since(self, seq: int) -> list[tuple[int, Any]] | None:
+        """
+        Returns the changes after 'seq', keeping only the newest entry per key.
+
+        Args:
+            seq (int): The last sequence number the client has seen.
+
+        Returns:
+            list: (seq, key) pairs in sequence order, or None when 'seq' is not
+                  covered by the retained window and the client must reset.
+        """
+        with self._lock:
+            if seq > self._seq or seq < 0:
+                return None
+            if seq == self._seq:
+                return []
+            oldest: int = self._entries[0][0] if self._entries else self._seq + 1
+            if seq < oldest - 1:
+                return None
+            latest: dict[Any, int] = {}
+            for entry_seq, key in self._entries:
+                if entry_seq > seq:
+                    latest[key] = entry_seq
+        return sorted((entry_seq, key) for key, entry_seq in latest.items())
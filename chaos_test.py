@@ -4,7 +4,7 @@ import time
 import random
 import multiprocessing
 from btree_logic import BTree
-from wal_engine import log_transaction, recover_tree,WAL_FILE,CHECKPOINT_FILE
+from wal_engine import log_transaction, recover_tree, wal_segments, CHECKPOINT_FILE
 
 
 def chaos_worker():
@@ -57,9 +57,9 @@ def verify_recovery():
     
     # Check how many transactions were actually written to the WAL file
     wal_count = 0
-    if os.path.exists(WAL_FILE):
-        with open(WAL_FILE, 'r') as f:
-            wal_count = sum(1 for line in f if line.strip())
+    for _, path in wal_segments():
+        with open(path, 'r') as f:
+            wal_count += sum(1 for line in f if line.strip())
             
     # THE MOMENT OF TRUTH
     print(f"\n--- 📊 CHAOS TEST RESULTS ---")
@@ -75,8 +75,8 @@ if __name__ == '__main__':
     print("=== ANCHOR-MED AUTOMATED CHAOS TEST SUITE ===")
     
     # 1. Wipe old test files to ensure a clean slate
-    if os.path.exists(WAL_FILE):
-        os.remove(WAL_FILE)
+    for _, path in wal_segments():
+        os.remove(path)
     if os.path.exists(CHECKPOINT_FILE):
         os.remove(CHECKPOINT_FILE)
         
@@ -21,7 +21,8 @@ function startBackend() {
   // 2. CRITICAL: FORCE THE CWD
   // Lock the working directory to wherever the executable lives
   const workingDir = path.dirname(backendPath);
-  backendProcess = spawn(backendPath, [], { cwd: workingDir });
+  // --production: the pooled waitress server, not Flask's debug server
+  backendProcess = spawn(backendPath, ['--production'], { cwd: workingDir });
 
   backendProcess.stdout.on('data', (data) => console.log(`[Python] ${data}`));
   backendProcess.stderr.on('data', (data) => console.error(`[Python ERR] ${data}`));
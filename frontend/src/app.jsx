@@ -1,4 +1,4 @@
-import React, { useState, useEffect } from "react";
+import React, { useState, useEffect, useRef } from "react";
 import { motion, AnimatePresence } from "framer-motion";
 import { 
   AlertCircle, Package, RefreshCw, Search, Plus, Trash2, 
@@ -40,6 +40,11 @@ function App() {
   const [stats, setStats] = useState({ total: 0, lowStock: 0, expiringSoon: 0 });
   const [status, setStatus] = useState({ type: "ready", message: "System Ready" });
   const [loading, setLoading] = useState(false);
+
+  // Every batch received so far, and the /api/changes position ({ epoch, seq }) it
+  // reflects. Refs, so a refresh started from an older render still builds on the latest.
+  const batches = useRef(new Map());
+  const feed = useRef(null);
   
   // --- FORMS ---
   const [showAddModal, setShowAddModal] = useState(false);
@@ -112,28 +117,66 @@ function App() {
     }
   };
 
+  const showInventory = () => {
+    // 👇 THE FIX: Strip out deleted (0 qty) items immediately
+    const activeInventory = [...batches.current.values()]
+      .filter(i => parseInt(i.details.qty) > 0)
+      .sort((a, b) => (a.batch_id < b.batch_id ? -1 : a.batch_id > b.batch_id ? 1 : 0));
+
+    setInventory(activeInventory);
+
+    // Calculate stats based ONLY on active inventory
+    const total = activeInventory.length;
+    const low = activeInventory.filter(i => parseInt(i.details.qty) < 20).length;
+    const expiring = activeInventory.filter(i => {
+      const status = checkExpiry(i.details.expiry);
+      return status === "expiring" || status === "expired";
+    }).length;
+
+    setStats({ total, lowStock: low, expiringSoon: expiring });
+    setStatus({ type: "success", message: "Inventory synced" });
+  };
+
+  // Applies only the batches changed since the last refresh. Returns false when the
+  // server can't say (first load, feed overrun, or a restart): then fetch everything.
+  const applyChanges = async () => {
+    if (!feed.current) return false;
+    const { epoch, seq } = feed.current;
+    const res = await fetch(`${CONFIG.API_BASE_URL}/changes?since=${seq}&epoch=${epoch}`);
+    const data = await res.json();
+    if (!data.success || data.reset) return false;
+
+    // A slower, older refresh must not undo a newer one.
+    if (feed.current && data.epoch === feed.current.epoch && data.seq < feed.current.seq) return true;
+    data.changes.forEach(c => {
+      if (c.details) batches.current.set(c.batch_id, { batch_id: c.batch_id, details: c.details });
+      else batches.current.delete(c.batch_id); // Purged by a compaction
+    });
+    feed.current = { epoch: data.epoch, seq: data.seq };
+    showInventory();
+    return true;
+  };
+
   const fetchInventory = async () => {
     setLoading(true);
     try {
+      if (await applyChanges()) return;
+
       const res = await fetch(`${CONFIG.API_BASE_URL}/view_all`);
       const data = await res.json();
+
+      // 503: the engine is still recovering the inventory. Show progress and retry.
+      if (res.status === 503) {
+        const loaded = data.recovery ? data.recovery.records : 0;
+        setStatus({ type: "info", message: `Loading inventory... (${loaded} records recovered)` });
+        setTimeout(fetchInventory, 1000);
+        return;
+      }
       
       if (data.success) {
-        // 👇 THE FIX: Strip out deleted (0 qty) items immediately
-        const activeInventory = data.inventory.filter(i => parseInt(i.details.qty) > 0);
-        
-        setInventory(activeInventory);
-        
-        // Calculate stats based ONLY on active inventory
-        const total = activeInventory.length;
-        const low = activeInventory.filter(i => parseInt(i.details.qty) < 20).length;
-        const expiring = activeInventory.filter(i => {
-          const status = checkExpiry(i.details.expiry);
-          return status === "expiring" || status === "expired";
-        }).length;
-        
-        setStats({ total, lowStock: low, expiringSoon: expiring });
-        setStatus({ type: "success", message: "Inventory synced" });
+        batches.current = new Map(data.inventory.map(i => [i.batch_id, i]));
+        feed.current = { epoch: data.epoch, seq: data.seq };
+        showInventory();
       }
     } catch (e) { 
       setStatus({ type: "error", message: "Failed to fetch inventory" });
@@ -167,14 +210,14 @@ function App() {
     try {
       const res = await fetch(`${CONFIG.API_BASE_URL}${endpoint}`, {
         method: "POST", 
-        headers: { "Content-Type": "application/json" }, 
+        headers: { "Content-Type": "application/json", "X-Operator": username }, 
         body: JSON.stringify(payload)
       });
       const data = await res.json();
       
       if (data.success) {
         setStatus({ type: "success", message: data.message });
-        await fetchInventory(); // Refresh the UI
+        await fetchInventory(); // Refresh the UI (just the changed batches)
         
         // Clear the form if it was a new addition
         if(!isUpdate) {
@@ -205,30 +248,22 @@ function App() {
     setStatus({ type: "info", message: `Pulling from ${targetIp}...` });
     
     try {
-      // STEP 1: Reach across the network to grab the other computer's data
-      const pullRes = await fetch(`http://${targetIp}:5000/api/view_all`);
-      if (!pullRes.ok) throw new Error("Could not reach Target");
-      const targetData = await pullRes.json();
+      // Let YOUR local backend compare digests with the other computer and
+      // pull + anchor only the batches that differ
+      const syncRes = await fetch(`${CONFIG.API_BASE_URL}/sync_peer`, {
+        method: "POST", 
+        headers: { "Content-Type": "application/json" }, 
+        body: JSON.stringify({ target_ip: targetIp })
+      });
       
-      if (targetData.success && targetData.inventory) {
-        setStatus({ type: "info", message: "Merging records locally..." });
-        
-        // STEP 2: Send that data to YOUR local backend to merge and anchor
-        const pushRes = await fetch(`${CONFIG.API_BASE_URL}/sync`, {
-          method: "POST", 
-          headers: { "Content-Type": "application/json" }, 
-          body: JSON.stringify({ inventory: targetData.inventory })
-        });
-        
-        const syncResult = await pushRes.json();
-        
-        setStatus({ 
-          type: syncResult.success ? "success" : "error", 
-          message: syncResult.success ? syncResult.message : "Merge failed" 
-        });
-        
-        if (syncResult.success) await fetchInventory(); // Refresh UI
-      }
+      const syncResult = await syncRes.json();
+      
+      setStatus({ 
+        type: syncResult.success ? "success" : "error", 
+        message: syncResult.success ? syncResult.message : (syncResult.message || "Could not reach Target")
+      });
+      
+      if (syncResult.success) await fetchInventory(); // Refresh UI
     } catch (e) { 
       setStatus({ type: "error", message: "Network error. Is their app open?" });
     } finally {
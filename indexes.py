@@ -0,0 +1,317 @@
+import hashlib
+import json
+from itertools import islice
+from typing import Any, Iterator
+
+from btree_logic import BTree
+
+class ExpiryIndex:
+    """
+    Secondary index over the inventory, ordered by (expiry, batch_id).
+    
+    A supplementary B-Tree kept alongside the primary one, so "what expires
+    between X and Y" is a range scan, O(log n + k), instead of a walk over every
+    batch. Expiry strings ("YYYY-MM" from the UI) sort chronologically as text.
+
+    When a batch's expiry changes (or the batch is deleted), its old entry is
+    removed from the index tree.
+
+    Attributes:
+        tree (BTree): The index tree; keys are (expiry, batch_id), values True.
+    """
+    def __init__(self, t: int = 3) -> None:
+        """
+        Args:
+            t (int): Minimum degree of the index B-Tree.
+        """
+        self.t: int = t
+        self.tree: BTree = BTree(t)
+
+    @staticmethod
+    def _expiry_of(details: Any) -> str | None:
+        if not isinstance(details, dict):
+            return None
+        expiry: Any = details.get("expiry")
+        return expiry if isinstance(expiry, str) and expiry else None
+
+    def rebuild(self, primary: BTree) -> int:
+        """
+        Rebuilds the index from the primary tree in one sorted bulk load.
+
+        Args:
+            primary (BTree): The inventory tree (batch_id -> details).
+
+        Returns:
+            int: The number of indexed batches.
+        """
+        entries: list[tuple[str, Any]] = []
+        for batch_id, details in primary.iter_items():
+            expiry: str | None = self._expiry_of(details)
+            if expiry is not None:
+                entries.append((expiry, batch_id))
+        entries.sort()
+        self.tree = BTree(self.t)
+        return self.tree.bulk_load((entry, True) for entry in entries)
+
+    def update(self, batch_id: Any, old_details: Any, new_details: Any) -> None:
+        """
+        Moves a batch's entry after a write.
+
+        Args:
+            batch_id: The batch that was written.
+            old_details: Its details before the write (None if it is new).
+            new_details: Its details after the write (None if it was deleted).
+        """
+        old: str | None = self._expiry_of(old_details)
+        new: str | None = self._expiry_of(new_details)
+        if old == new:
+            return
+        if old is not None:
+            self.tree.delete((old, batch_id))
+        if new is not None:
+            self.tree.insert((new, batch_id), True)
+
+    def range(self, start: str | None = None, end: str | None = None) -> Iterator[tuple[str, Any]]:
+        """
+        Lazily yields (expiry, batch_id) for batches with start <= expiry <= end.
+
+        Args:
+            start (str, optional): Earliest expiry to include (e.g. "2026-10").
+            end (str, optional): Latest expiry to include. A prefix such as "2026-12"
+                                 also admits longer dates within it ("2026-12-31").
+
+        Yields:
+            tuple: (expiry, batch_id) pairs ordered by expiry, then batch_id.
+        """
+        for (expiry, batch_id), _ in self.tree.iter_items(None if start is None else (start,)):
+            if end is not None and expiry > end and not expiry.startswith(end):
+                return
+            yield expiry, batch_id
+
+class MedicineStock:
+    """
+    Running totals for one medicine across all of its batches.
+
+    Attributes:
+        name (str): Display name, as first seen for this medicine.
+        batches (set): Batch IDs currently filed under this medicine.
+        qty (int): Sum of 'qty' over those batches.
+    """
+    __slots__ = ("name", "batches", "qty")
+
+    def __init__(self, name: str) -> None:
+        self.name: str = name
+        self.batches: set[Any] = set()
+        self.qty: int = 0
+
+    def to_dict(self) -> dict[str, Any]:
+        return {"name": self.name, "qty": self.qty, "batches": sorted(self.batches)}
+
+class NameIndex:
+    """
+    Aggregate index over the inventory, keyed by medicine name.
+    
+    Each medicine maps to a MedicineStock holding its batch set and a running qty
+    total, updated incrementally on every write, so "how much amoxicillin do we
+    hold" is one O(log n) lookup. Names are matched case-insensitively and are
+    kept in a B-Tree, so prefix search (UI autocomplete) is a short range scan.
+
+    Attributes:
+        tree (BTree): Normalised name -> MedicineStock.
+    """
+    def __init__(self, t: int = 3) -> None:
+        """
+        Args:
+            t (int): Minimum degree of the index B-Tree.
+        """
+        self.t: int = t
+        self.tree: BTree = BTree(t)
+
+    @staticmethod
+    def normalise(name: str) -> str:
+        return name.strip().casefold()
+
+    @staticmethod
+    def _name_of(details: Any) -> str | None:
+        if not isinstance(details, dict):
+            return None
+        name: Any = details.get("name")
+        return name.strip() if isinstance(name, str) and name.strip() else None
+
+    @staticmethod
+    def _qty_of(details: Any) -> int:
+        try:
+            return int(details.get("qty") or 0)
+        except (TypeError, ValueError):
+            return 0
+
+    def rebuild(self, primary: BTree) -> int:
+        """
+        Rebuilds every aggregate from the primary tree.
+
+        Args:
+            primary (BTree): The inventory tree (batch_id -> details).
+
+        Returns:
+            int: The number of distinct medicines.
+        """
+        stocks: dict[str, MedicineStock] = {}
+        for batch_id, details in primary.iter_items():
+            name: str | None = self._name_of(details)
+            if name is None:
+                continue
+            stock: MedicineStock = stocks.setdefault(self.normalise(name), MedicineStock(name))
+            stock.batches.add(batch_id)
+            stock.qty += self._qty_of(details)
+        self.tree = BTree(self.t)
+        return self.tree.bulk_load(sorted(stocks.items()))
+
+    def update(self, batch_id: Any, old_details: Any, new_details: Any) -> None:
+        """
+        Applies one write to the aggregates: takes the old version of the batch out
+        and puts the new one in.
+
+        Args:
+            batch_id: The batch that was written.
+            old_details: Its details before the write (None if it is new).
+            new_details: Its details after the write (None if it was deleted).
+        """
+        old: str | None = self._name_of(old_details)
+        new: str | None = self._name_of(new_details)
+        if old is not None:
+            key: str = self.normalise(old)
+            stock: MedicineStock | None = self.tree.search(key)
+            if stock is not None and batch_id in stock.batches:
+                stock.batches.discard(batch_id)
+                stock.qty -= self._qty_of(old_details)
+                if not stock.batches and (new is None or self.normalise(new) != key):
+                    self.tree.delete(key) # Last batch of this medicine is gone
+
+        if new is not None:
+            key = self.normalise(new)
+            stock = self.tree.search(key)
+            if stock is None:
+                stock = MedicineStock(new)
+                self.tree.insert(key, stock)
+            stock.batches.add(batch_id)
+            stock.qty += self._qty_of(new_details)
+
+    def get(self, name: str) -> MedicineStock | None:
+        """
+        Looks up one medicine's totals (case-insensitive).
+
+        Returns:
+            MedicineStock: The aggregate, or None if no batch carries that name.
+        """
+        stock: MedicineStock | None = self.tree.search(self.normalise(name))
+        return stock if stock is not None and stock.batches else None
+
+    def prefix(self, prefix: str, limit: int = 10) -> list[MedicineStock]:
+        """
+        Returns up to 'limit' medicines whose name starts with 'prefix', A-Z.
+        """
+        stocks: Iterator[MedicineStock] = (
+            stock for _, stock in self.tree.iter_prefix(self.normalise(prefix)) if stock.batches
+        )
+        return list(islice(stocks, limit))
+
+class RangeDigest:
+    """
+    Hierarchical (Merkle-style) digest of the inventory for peer-to-peer sync.
+    
+    Every batch lands in a fixed bucket chosen by the hash of its Batch ID, so two
+    clinics bucket the same batch identically no matter how their B-Trees are
+    shaped. Buckets form a tree with 16 children per level ('depth' hex digits of
+    the ID hash address a leaf). A bucket's digest is the XOR of the 64-bit record
+    digests below it, so a write updates one bucket per level in O(depth).
+
+    Two peers compare root digests, descend only into buckets that differ, and
+    finally exchange per-record digests of the differing leaves - a few round
+    trips, after which only divergent batches are transferred.
+
+    Attributes:
+        depth (int): Number of levels below the root (leaf buckets = 16 ** depth).
+        levels (list): levels[d][i] is the digest of bucket i at depth d.
+        leaves (list): Per leaf bucket, batch_id -> record digest.
+    """
+    FANOUT: int = 16
+
+    def __init__(self, depth: int = 3) -> None:
+        """
+        Args:
+            depth (int): Levels below the root; 3 gives 4096 leaf buckets.
+        """
+        self.depth: int = depth
+        self.levels: list[list[int]] = [[0] * (self.FANOUT ** d) for d in range(depth + 1)]
+        self.leaves: list[dict[Any, int]] = [{} for _ in range(self.FANOUT ** depth)]
+
+    def bucket_of(self, batch_id: Any) -> int:
+        """Returns the leaf bucket index of a Batch ID."""
+        h: bytes = hashlib.blake2b(str(batch_id).encode("utf-8"), digest_size=8).digest()
+        return int.from_bytes(h, "big") >> (64 - 4 * self.depth)
+
+    @staticmethod
+    def record_digest(batch_id: Any, details: Any) -> int:
+        """64-bit digest of one record; equal records hash equally on every peer."""
+        payload: str = json.dumps([batch_id, details], sort_keys=True, separators=(",", ":"))
+        return int.from_bytes(hashlib.blake2b(payload.encode("utf-8"), digest_size=8).digest(), "big")
+
+    def _toggle(self, leaf: int, digest: int) -> None:
+        # XOR the record digest into its bucket on every level (adding and removing are the same).
+        for d in range(self.depth, -1, -1):
+            self.levels[d][leaf >> (4 * (self.depth - d))] ^= digest
+
+    def rebuild(self, primary: BTree) -> int:
+        """
+        Recomputes every digest from the primary tree.
+
+        Returns:
+            int: The number of records digested.
+        """
+        self.levels = [[0] * len(level) for level in self.levels]
+        self.leaves = [{} for _ in self.leaves]
+        count: int = 0
+        for batch_id, details in primary.iter_items():
+            self.update(batch_id, None, details)
+            count += 1
+        return count
+
+    def update(self, batch_id: Any, old_details: Any, new_details: Any) -> None:
+        """
+        Swaps a batch's old record digest for the new one.
+
+        Args:
+            batch_id: The batch that was written.
+            old_details: Its details before the write. Not needed (the stored digest
+                         is what gets removed) but accepted like the other indexes.
+            new_details: Its details after the write (None if it is gone).
+        """
+        leaf: int = self.bucket_of(batch_id)
+        records: dict[Any, int] = self.leaves[leaf]
+        old: int | None = records.pop(batch_id, None)
+        if old is not None:
+            self._toggle(leaf, old)
+        if new_details is not None:
+            new: int = self.record_digest(batch_id, new_details)
+            records[batch_id] = new
+            self._toggle(leaf, new)
+
+    def describe(self, prefix: str) -> dict[str, Any]:
+        """
+        Describes one bucket, addressed by a hex path from the root ("" is the root).
+
+        Returns:
+            dict: {"children": {hex digit: digest}} for inner buckets, or
+                  {"records": {batch_id: digest}} for leaf buckets (digests as hex).
+
+        Raises:
+            ValueError: If 'prefix' is not a hex path of at most 'depth' digits.
+        """
+        if len(prefix) > self.depth or any(c not in "0123456789abcdef" for c in prefix):
+            raise ValueError(f"Invalid bucket path {prefix!r}")
+        index: int = int(prefix, 16) if prefix else 0
+        if len(prefix) == self.depth:
+            return {"records": {k: f"{v:016x}" for k, v in self.leaves[index].items()}}
+        level: list[int] = self.levels[len(prefix) + 1]
+        first: int = index * self.FANOUT
+        return {"children": {f"{i:x}": f"{level[first + i]:016x}" for i in range(self.FANOUT)}}
@@ -0,0 +1,623 @@
+import json
+import math
+import os
+import struct
+import threading
+import time
+import zlib
+from array import array
+from bisect import bisect_left, bisect_right
+from typing import Any, BinaryIO, Iterable
+
+LEDGER_NAME: str = "events.ledger"
+SNAPSHOTS_NAME: str = "events.snapshots"
+
+# --- LEDGER ENCODING ---
+# Both files are append-only and start with a 6-byte header (magic + format version).
+# events.ledger, one frame per event:
+#   [u32 body length][u32 CRC32][f64 timestamp][u8 kind][i64 amount][u16 id length][u8 operator length]
+#   [batch_id][operator][details JSON, ADD events only]
+# events.snapshots, one frame per snapshot of the folded state:
+#   [u32 body length][u32 CRC32][f64 timestamp][u64 ledger offset][zlib(JSON {batch_id: state})]
+# The CRC covers everything after itself. Only a torn tail is expected (a crash
+# mid-append); open() cuts it off so later frames are never written after garbage.
+# The snapshot file is the one exception to append-only: old snapshots are thinned
+# out by rewriting it to events.snapshots.tmp and renaming that over it.
+LEDGER_MAGIC: bytes = b"AMLOG"
+SNAPSHOT_MAGIC: bytes = b"AMSNP"
+LEDGER_FORMAT_VERSION: int = 1
+_EVENT_HEADER: struct.Struct = struct.Struct("<IIdBqHB")
+_SNAPSHOT_HEADER: struct.Struct = struct.Struct("<IIdQ")
+_COMPACT: dict[str, Any] = {"separators": (",", ":")}
+
+# Snapshot retention: the first one (history starts there), the latest
+# SNAPSHOT_KEEP_RECENT, one per day for SNAPSHOT_KEEP_DAYS days and one per week
+# before that. Older states are still reachable, by replaying from an earlier one.
+SNAPSHOT_KEEP_RECENT: int = 8
+SNAPSHOT_KEEP_DAYS: int = 31
+
+# Event kinds
+ADD: int = 1       # batch created or redefined; amount = qty, details = the tracked fields
+RESTOCK: int = 2   # amount units added
+DISPENSE: int = 3  # amount units taken out
+DELETE: int = 4    # soft delete: qty set to 0 (amount = the qty it had)
+PURGE: int = 5     # batch removed for good by compaction
+KIND_NAMES: dict[int, str] = {ADD: "add", RESTOCK: "restock", DISPENSE: "dispense",
+                              DELETE: "delete", PURGE: "purge"}
+
+# The fields of a batch whose history is kept.
+TRACKED_FIELDS: tuple[str, ...] = ("name", "expiry", "qty")
+
+def _project(details: dict[str, Any]) -> dict[str, Any]:
+    return {field: details.get(field) for field in TRACKED_FIELDS}
+
+def _int_qty(details: dict[str, Any]) -> int | None:
+    qty: Any = details.get("qty")
+    return qty if isinstance(qty, int) and not isinstance(qty, bool) else None
+
+def describe_change(old: dict[str, Any] | None, new: dict[str, Any] | None,
+                    deleted: bool = False) -> tuple[int, int, dict[str, Any] | None] | None:
+    """
+    Turns a write to one batch into a typed event.
+
+    Args:
+        old (dict): The batch's details before the write (None if it did not exist).
+        new (dict): The details after the write (None if the batch was purged).
+        deleted (bool): The write was a soft delete (the qty is set to 0).
+
+    Returns:
+        tuple: (kind, amount, details), with details only for ADD events, or
+               None when none of the tracked fields changed.
+    """
+    if new is None:
+        return None if old is None else (PURGE, 0, None)
+    new_qty: int | None = _int_qty(new)
+    old_qty: int | None = _int_qty(old) if old is not None else None
+    if (old is None or new_qty is None or old_qty is None
+            or any(old.get(field) != new.get(field) for field in ("name", "expiry"))):
+        # A new batch, a new name/expiry, or a qty that is not a number: store it whole.
+        if old is not None and _project(old) == _project(new):
+            return None
+        return ADD, new_qty or 0, _project(new)
+    if deleted and new_qty == 0:
+        return (DELETE, old_qty, None) if old_qty != 0 else None
+    if new_qty > old_qty:
+        return RESTOCK, new_qty - old_qty, None
+    if new_qty < old_qty:
+        return DISPENSE, old_qty - new_qty, None
+    return None
+
+def _apply_event(state: dict[str, dict[str, Any]], kind: int, batch_id: str, amount: int,
+                 details: dict[str, Any] | None) -> None:
+    """Folds one event into 'state' (batch_id -> tracked fields)."""
+    if kind == ADD:
+        state[batch_id] = dict(details or {})
+    elif kind == PURGE:
+        state.pop(batch_id, None)
+    elif batch_id in state:
+        current: dict[str, Any] = state[batch_id]
+        qty: int = current.get("qty") if isinstance(current.get("qty"), int) else 0
+        if kind == RESTOCK:
+            current["qty"] = qty + amount
+        elif kind == DISPENSE:
+            current["qty"] = qty - amount
+        elif kind == DELETE:
+            current["qty"] = 0
+
+def _encode_event(ts: float, kind: int, batch_id: str, amount: int, operator: str,
+                  details: dict[str, Any] | None) -> bytes:
+    key: bytes = batch_id.encode("utf-8")
+    who: bytes = operator.encode("utf-8")[:0xFF]
+    extra: bytes = json.dumps(details, **_COMPACT).encode("utf-8") if details is not None else b""
+    body: bytes = struct.pack("<dBqHB", ts, kind, amount, len(key), len(who)) + key + who + extra
+    return struct.pack("<II", len(key) + len(who) + len(extra), zlib.crc32(body)) + body
+
+def _decode_event(buf: bytes, pos: int) -> tuple[int, tuple[float, int, str, str, int, Any]] | None:
+    """
+    Decodes the event frame at 'pos' of 'buf'.
+
+    Returns:
+        tuple: (end offset, (ts, kind, batch_id, operator, amount, details)), or
+               None if the frame is truncated or fails its CRC.
+    """
+    size: int = _EVENT_HEADER.size
+    if pos + size > len(buf):
+        return None
+    length, crc, ts, kind, amount, id_len, op_len = _EVENT_HEADER.unpack_from(buf, pos)
+    end: int = pos + size + length
+    if end > len(buf) or zlib.crc32(buf[pos + 8:end]) != crc:
+        return None
+    start: int = pos + size
+    batch_id: str = bytes(buf[start:start + id_len]).decode("utf-8")
+    operator: str = bytes(buf[start + id_len:start + id_len + op_len]).decode("utf-8", errors="replace")
+    extra: bytes = bytes(buf[start + id_len + op_len:end])
+    return end, (ts, kind, batch_id, operator, amount, json.loads(extra) if extra else None)
+
+def _snapshots_to_keep(snapshots: list[tuple[float, int, int]]) -> list[tuple[float, int, int]]:
+    """
+    Picks the snapshots the retention policy keeps, ages measured from the newest.
+
+    Args:
+        snapshots (list): (timestamp, ledger offset, file offset) tuples, oldest first.
+
+    Returns:
+        list: The kept tuples, still oldest first.
+    """
+    if not snapshots:
+        return []
+    newest: float = snapshots[-1][0]
+    recent: int = len(snapshots) - SNAPSHOT_KEEP_RECENT
+    buckets: set[tuple[str, int]] = set()
+    kept: list[tuple[float, int, int]] = []
+    for i, snap in enumerate(snapshots):
+        day: int = int(snap[0] // 86400)
+        bucket: tuple[str, int] = (("day", day) if newest - snap[0] <= SNAPSHOT_KEEP_DAYS * 86400
+                                   else ("week", day // 7))
+        # The earliest snapshot of each bucket stays, so a bucket's pick never
+        # changes as newer snapshots arrive.
+        if i == 0 or i >= recent or bucket not in buckets:
+            kept.append(snap)
+        buckets.add(bucket)
+    return kept
+
+def _fsync_dir(path: str) -> None:
+    """Makes a rename inside 'path' durable (not supported on Windows)."""
+    if os.name == 'nt':
+        return
+    fd: int = os.open(path, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+def _event_dict(event: tuple[float, int, str, str, int, Any]) -> dict[str, Any]:
+    ts, kind, batch_id, operator, amount, details = event
+    entry: dict[str, Any] = {"ts": ts, "event": KIND_NAMES.get(kind, str(kind)), "batch_id": batch_id,
+                             "operator": operator, "qty": amount}
+    if details is not None:
+        entry["details"] = details
+    return entry
+
+class EventLedger:
+    """
+    Append-only history of every inventory write, as compact typed events.
+
+    The WAL and checkpoints only hold the latest value of each batch; the ledger
+    keeps how it got there (who dispensed or restocked how much, and when), so
+    past states can be reconstructed. Two structures keep reads from replaying
+    the whole ledger:
+
+    - an in-memory index from batch ID to the offsets of its events, so one
+      batch's history is a handful of seeks;
+    - periodic snapshots of the folded state (every 'snapshot_every' events),
+      so "the inventory as of X" starts from the last snapshot before X and
+      replays only the events between it and X. Old snapshots are thinned out
+      (see SNAPSHOT_KEEP_RECENT), so the snapshot file stops growing with
+      every snapshot.
+
+    Events get non-decreasing timestamps, so file order is time order.
+
+    Events are not fsynced with each write: the WAL is what makes a write
+    durable. They reach the OS as they are recorded, so only a power loss can
+    cost the latest ones, and reconcile() repairs that at boot from the recovered
+    inventory.
+
+    Attributes:
+        path (str): The event file.
+        snapshot_path (str): The snapshot file.
+        snapshot_every (int): Events between two snapshots (see snapshot_due).
+    """
+    def __init__(self, directory: str, snapshot_every: int = 5000) -> None:
+        """
+        Args:
+            directory (str): The data directory holding the ledger files.
+            snapshot_every (int): Events to append before another snapshot is due.
+        """
+        self.path: str = os.path.join(directory, LEDGER_NAME)
+        self.snapshot_path: str = os.path.join(directory, SNAPSHOTS_NAME)
+        self.snapshot_every: int = snapshot_every
+        self._index: dict[str, array] = {}
+        # (timestamp, ledger offset covered, offset in the snapshot file), oldest first
+        self._snapshots: list[tuple[float, int, int]] = []
+        self._events: int = 0
+        self._since_snapshot: int = 0
+        self._size: int = 0
+        self._synced: int = 0
+        self._last_ts: float = 0.0
+        self._handle: BinaryIO | None = None
+        # Guards the handle, the index and the counters; _sync_lock lets one
+        # fsync cover the appends of every thread that waits on it.
+        self._lock: threading.Lock = threading.Lock()
+        self._sync_lock: threading.Lock = threading.Lock()
+        # Serializes appending to, rewriting and reading the snapshot file, so a
+        # reader never opens it halfway through a rewrite.
+        self._snapshot_lock: threading.Lock = threading.Lock()
+
+    @staticmethod
+    def _open_file(path: str, magic: bytes) -> int:
+        """Creates 'path' with its header if needed; returns its size."""
+        header: bytes = magic + bytes([LEDGER_FORMAT_VERSION])
+        if not os.path.exists(path) or os.path.getsize(path) == 0:
+            with open(path, "wb") as f:
+                f.write(header)
+                f.flush()
+                os.fsync(f.fileno())
+            return len(header)
+        with open(path, "rb") as f:
+            found: bytes = f.read(len(header))
+        if found != header:
+            raise ValueError(f"{os.path.basename(path)} is not a version {LEDGER_FORMAT_VERSION} ledger file")
+        return os.path.getsize(path)
+
+    @staticmethod
+    def _cut_tail(path: str, valid: int, size: int) -> None:
+        if valid < size:
+            print(f"LEDGER: Torn tail in {os.path.basename(path)}, dropping {size - valid} bytes.")
+            with open(path, "r+b") as f:
+                f.truncate(valid)
+                os.fsync(f.fileno())
+
+    def open(self) -> None:
+        """
+        Opens (or creates) the ledger files and rebuilds the offset index from the
+        event headers. Idempotent.
+        """
+        if self._handle is not None:
+            return
+        self._scan_snapshots()
+        size: int = self._open_file(self.path, LEDGER_MAGIC)
+        pos: int = len(LEDGER_MAGIC) + 1
+        last: int | None = None
+        head_size: int = _EVENT_HEADER.size
+        with open(self.path, "rb") as f:
+            f.seek(pos)
+            while True:
+                head: bytes = f.read(head_size)
+                if len(head) < head_size:
+                    break
+                length, _crc, ts, _kind, _amount, id_len, _op_len = _EVENT_HEADER.unpack(head)
+                end: int = pos + head_size + length
+                if end > size:
+                    break
+                batch_id: str = f.read(id_len).decode("utf-8", errors="replace")
+                self._index.setdefault(batch_id, array("Q")).append(pos)
+                self._events += 1
+                self._last_ts = ts
+                last, pos = pos, end
+                f.seek(end)
+            # Only the last frame can be half-written; the rest are checked when read.
+            if last is not None and self._read_event(f, last) is None:
+                self._index[batch_id].pop()
+                self._events -= 1
+                pos = last
+        self._cut_tail(self.path, pos, size)
+        self._size = self._synced = pos
+        # A snapshot can never cover more of the ledger than survived.
+        self._snapshots = [snap for snap in self._snapshots if snap[1] <= pos]
+        covered: int = self._snapshots[-1][1] if self._snapshots else 0
+        self._since_snapshot = sum(len(offsets) - bisect_left(offsets, covered)
+                                   for offsets in self._index.values())
+        if self._snapshots:
+            self._last_ts = max(self._last_ts, self._snapshots[-1][0])
+        # Unbuffered: every event reaches the OS as it is recorded.
+        self._handle = open(self.path, "ab", buffering=0)
+        print(f"LEDGER: {self._events} events, {len(self._snapshots)} snapshots.")
+
+    def _scan_snapshots(self) -> None:
+        if os.path.exists(self.snapshot_path + ".tmp"):
+            # A rewrite that crashed before its rename; the old file is intact.
+            os.remove(self.snapshot_path + ".tmp")
+        size: int = self._open_file(self.snapshot_path, SNAPSHOT_MAGIC)
+        pos: int = len(SNAPSHOT_MAGIC) + 1
+        head_size: int = _SNAPSHOT_HEADER.size
+        self._snapshots = []
+        with open(self.snapshot_path, "rb") as f:
+            f.seek(pos)
+            while True:
+                head: bytes = f.read(head_size)
+                if len(head) < head_size:
+                    break
+                length, _crc, ts, offset = _SNAPSHOT_HEADER.unpack(head)
+                end: int = pos + head_size + length
+                if end > size:
+                    break
+                self._snapshots.append((ts, offset, pos))
+                pos = end
+                f.seek(end)
+        if self._snapshots and self._load_snapshot(self._snapshots[-1][2]) is None:
+            pos = self._snapshots.pop()[2]
+        self._cut_tail(self.snapshot_path, pos, size)
+
+    def close(self) -> None:
+        """Syncs and closes the event file (open() reopens it)."""
+        self.sync()
+        with self._lock:
+            if self._handle is not None:
+                self._handle.close()
+                self._handle = None
+                self._index.clear()
+                self._events = 0
+
+    # --- WRITING ---
+    def record(self, batch_id: Any, old: dict[str, Any] | None, new: dict[str, Any] | None,
+               operator: str, deleted: bool = False) -> bool:
+        """
+        Appends the event for one write (see describe_change). The event is in the
+        OS cache when this returns; call sync() to make it durable.
+
+        Args:
+            batch_id (Any): The batch that was written.
+            old (dict): Its details before the write (None if it did not exist).
+            new (dict): Its details after the write (None if it was purged).
+            operator (str): Who made the change.
+            deleted (bool): The write was a soft delete.
+
+        Returns:
+            bool: True if an event was appended (False: nothing tracked changed).
+        """
+        change: tuple[int, int, dict[str, Any] | None] | None = describe_change(old, new, deleted)
+        key: str = str(batch_id)
+        if change is None or len(key.encode("utf-8")) > 0xFFFF:
+            return False
+        kind, amount, details = change
+        with self._lock:
+            self._last_ts = max(time.time(), self._last_ts)
+            frame: bytes = _encode_event(self._last_ts, kind, key, amount, operator, details)
+            self._handle.write(frame)
+            self._index.setdefault(key, array("Q")).append(self._size)
+            self._size += len(frame)
+            self._events += 1
+            self._since_snapshot += 1
+        return True
+
+    def sync(self) -> None:
+        """Makes every event appended so far durable (one fsync covers concurrent callers)."""
+        with self._lock:
+            if self._handle is None:
+                return
+            self._handle.flush()
+            target: int = self._size
+            fileno: int = self._handle.fileno()
+        with self._sync_lock:
+            if self._synced >= target:
+                return
+            os.fsync(fileno)
+            self._synced = target
+
+    def reconcile(self, items: Iterable[tuple[Any, Any]], operator: str = "recovery") -> int:
+        """
+        Brings the ledger back in line with the inventory recovered from the WAL.
+
+        After a crash the ledger can miss its last events, or keep events whose
+        WAL record never became durable. Either way restock/dispense deltas would
+        add up to the wrong stock from then on, so every batch whose folded state
+        differs from 'items' gets the event that turns one into the other.
+        The caller must keep writers out until this returns (app.py runs it at boot).
+
+        Args:
+            items (Iterable): (batch_id, details) pairs of the whole inventory.
+            operator (str): Who the correcting events are recorded for.
+
+        Returns:
+            int: The number of correcting events (always 0 before the first snapshot).
+        """
+        if not self._snapshots:
+            return 0
+        state: dict[str, dict[str, Any]] = self.state_at(math.inf)
+        fixed: int = 0
+        for batch_id, details in items:
+            if not isinstance(details, dict):
+                continue
+            key: str = str(batch_id)
+            old: dict[str, Any] | None = state.pop(key, None)
+            if old != _project(details) and self.record(key, old, details, operator):
+                fixed += 1
+        for key, old in state.items():
+            fixed += self.record(key, old, None, operator)
+        if fixed:
+            self.sync()
+            print(f"LEDGER: Reconciled {fixed} batches with the recovered inventory.")
+        return fixed
+
+    @property
+    def snapshot_due(self) -> bool:
+        """True once 'snapshot_every' events were appended since the last snapshot
+        (or before the first one)."""
+        return not self._snapshots or self._since_snapshot >= self.snapshot_every
+
+    def snapshot(self, items: Iterable[tuple[Any, Any]]) -> int:
+        """
+        Appends a snapshot of the inventory at the current end of the ledger.
+
+        The caller must keep writers out until this returns (app.py holds the
+        tree's read lock), so 'items' is exactly the state the events add up to.
+
+        Args:
+            items (Iterable): (batch_id, details) pairs of the whole inventory.
+
+        Returns:
+            int: The number of batches in the snapshot.
+        """
+        self.sync()
+        with self._lock:
+            offset: int = self._size
+            self._last_ts = max(time.time(), self._last_ts)
+            ts: float = self._last_ts
+        state: dict[str, dict[str, Any]] = {
+            str(batch_id): _project(details) for batch_id, details in items if isinstance(details, dict)
+        }
+        payload: bytes = zlib.compress(json.dumps(state, **_COMPACT).encode("utf-8"))
+        body: bytes = struct.pack("<dQ", ts, offset) + payload
+        with self._snapshot_lock:
+            with open(self.snapshot_path, "ab") as f:
+                pos: int = f.tell()
+                f.write(struct.pack("<II", len(payload), zlib.crc32(body)) + body)
+                f.flush()
+                os.fsync(f.fileno())
+            with self._lock:
+                self._snapshots.append((ts, offset, pos))
+                self._since_snapshot = 0
+                snapshots: list[tuple[float, int, int]] = list(self._snapshots)
+            kept: list[tuple[float, int, int]] = _snapshots_to_keep(snapshots)
+            # Rewrites in bulk, not on every snapshot past the limit.
+            if len(snapshots) - len(kept) >= SNAPSHOT_KEEP_RECENT:
+                self._rewrite_snapshots(kept)
+        print(f"LEDGER: Snapshot of {len(state)} batches at offset {offset}.")
+        return len(state)
+
+    def _rewrite_snapshots(self, kept: list[tuple[float, int, int]]) -> None:
+        """
+        Rewrites the snapshot file with only the 'kept' snapshots, atomically:
+        a crash leaves either the old file or the new one. The caller holds
+        _snapshot_lock. Best effort: on failure the old file stays as it was
+        and the next snapshot tries again.
+
+        Args:
+            kept (list): (timestamp, ledger offset, file offset) tuples to keep.
+        """
+        tmp: str = self.snapshot_path + ".tmp"
+        moved: list[tuple[float, int, int]] = []
+        try:
+            with open(self.snapshot_path, "rb") as src, open(tmp, "wb") as dst:
+                dst.write(SNAPSHOT_MAGIC + bytes([LEDGER_FORMAT_VERSION]))
+                for ts, offset, pos in kept:
+                    src.seek(pos)
+                    head: bytes = src.read(_SNAPSHOT_HEADER.size)
+                    moved.append((ts, offset, dst.tell()))
+                    dst.write(head + src.read(struct.unpack_from("<I", head)[0]))
+                dst.flush()
+                os.fsync(dst.fileno())
+            size_before: int = os.path.getsize(self.snapshot_path)
+            os.replace(tmp, self.snapshot_path)
+        except OSError as e:
+            # e.g. Windows refuses to replace a file another process has open.
+            print(f"LEDGER: Could not thin snapshots, keeping them all: {e}")
+            if os.path.exists(tmp):
+                os.remove(tmp)
+            return
+        _fsync_dir(os.path.dirname(self.snapshot_path))
+        with self._lock:
+            dropped: int = len(self._snapshots) - len(moved)
+            self._snapshots = moved
+        print(f"LEDGER: Thinned {dropped} old snapshots "
+              f"({size_before} -> {os.path.getsize(self.snapshot_path)} bytes).")
+
+    # --- READING ---
+    @staticmethod
+    def _read_event(f: BinaryIO, offset: int) -> tuple[float, int, str, str, int, Any] | None:
+        f.seek(offset)
+        head: bytes = f.read(_EVENT_HEADER.size)
+        if len(head) < _EVENT_HEADER.size:
+            return None
+        frame: bytes = head + f.read(struct.unpack_from("<I", head)[0])
+        decoded: tuple[int, tuple[float, int, str, str, int, Any]] | None = _decode_event(frame, 0)
+        return decoded[1] if decoded else None
+
+    def _load_snapshot(self, pos: int, expect: tuple[float, int] | None = None) -> dict[str, dict[str, Any]] | None:
+        # 'expect' is the (timestamp, ledger offset) the caller pinned: if a
+        # rewrite moved the frames since, 'pos' now holds another one (or none).
+        with self._snapshot_lock:
+            with open(self.snapshot_path, "rb") as f:
+                f.seek(pos)
+                head: bytes = f.read(_SNAPSHOT_HEADER.size)
+                if len(head) < _SNAPSHOT_HEADER.size:
+                    return None
+                length, crc, ts, offset = _SNAPSHOT_HEADER.unpack(head)
+                if expect is not None and (ts, offset) != expect:
+                    return None
+                payload: bytes = f.read(length)
+        if len(payload) < length or zlib.crc32(head[8:] + payload) != crc:
+            return None
+        return json.loads(zlib.decompress(payload))
+
+    def _pin(self, batch_id: str | None) -> tuple[int, list[tuple[float, int, int]], list[int]]:
+        # Flushes pending appends and copies what a reader needs, so it can read
+        # the files without holding the lock.
+        with self._lock:
+            if self._handle is not None:
+                self._handle.flush()
+            offsets: list[int] = list(self._index.get(batch_id, ())) if batch_id is not None else []
+            return self._size, list(self._snapshots), offsets
+
+    def history(self, batch_id: Any, limit: int | None = None) -> list[dict[str, Any]]:
+        """
+        Returns one batch's events, oldest first, read through the offset index.
+
+        Args:
+            batch_id (Any): The batch to look up.
+            limit (int): Only return the most recent 'limit' events.
+
+        Returns:
+            list: {"ts", "event", "batch_id", "operator", "qty"[, "details"]} dicts.
+        """
+        _size, _snapshots, offsets = self._pin(str(batch_id))
+        if limit is not None:
+            offsets = offsets[-limit:] if limit > 0 else []
+        events: list[dict[str, Any]] = []
+        with open(self.path, "rb") as f:
+            for offset in offsets:
+                event: tuple[float, int, str, str, int, Any] | None = self._read_event(f, offset)
+                if event is not None:
+                    events.append(_event_dict(event))
+        return events
+
+    def state_at(self, ts: float, batch_id: Any = None) -> dict[str, dict[str, Any]]:
+        """
+        Reconstructs the inventory as it was at time 'ts' (inclusive): the last
+        snapshot taken at or before 'ts', plus the events after it up to 'ts'.
+
+        Args:
+            ts (float): A UNIX timestamp.
+            batch_id (Any): Only reconstruct this batch (replays just its events).
+
+        Returns:
+            dict: batch_id -> {"name", "expiry", "qty"} of the batches that existed.
+
+        Raises:
+            ValueError: If 'ts' is older than the first snapshot (history starts there).
+        """
+        key: str | None = str(batch_id) if batch_id is not None else None
+        # A second pass only happens when thinning moved the snapshot between
+        # pinning and loading it.
+        for _attempt in range(2):
+            end, snapshots, offsets = self._pin(key)
+            i: int = bisect_right([snap[0] for snap in snapshots], ts) - 1
+            if i < 0:
+                first: str = time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(snapshots[0][0])) if snapshots else "now"
+                raise ValueError(f"No history before {first}")
+            snap_ts, covered, pos = snapshots[i]
+            state: dict[str, dict[str, Any]] | None = self._load_snapshot(pos, (snap_ts, covered))
+            if state is not None:
+                break
+        else:
+            raise ValueError("Snapshot is unreadable")
+
+        with open(self.path, "rb") as f:
+            if key is not None:
+                state = {key: state[key]} if key in state else {}
+                for offset in offsets[bisect_left(offsets, covered):]:
+                    event: tuple[float, int, str, str, int, Any] | None = self._read_event(f, offset)
+                    if event is None:
+                        continue
+                    if event[0] > ts:
+                        break
+                    _apply_event(state, event[1], event[2], event[4], event[5])
+                return state
+            f.seek(covered)
+            data: bytes = f.read(end - covered)
+        at: int = 0
+        while True:
+            decoded: tuple[int, tuple[float, int, str, str, int, Any]] | None = _decode_event(data, at)
+            if decoded is None:
+                break
+            at, (event_ts, kind, event_id, _operator, amount, details) = decoded
+            if event_ts > ts:
+                break
+            _apply_event(state, kind, event_id, amount, details)
+        return state
+
+    def stats(self) -> dict[str, int]:
+        """Event count, file size and snapshot counters (for /api/metrics)."""
+        with self._lock:
+            return {"events": self._events, "bytes": self._size, "snapshots": len(self._snapshots),
+                    "events_since_snapshot": self._since_snapshot}
@@ -0,0 +1,162 @@
+import argparse
+import json
+import os
+import random
+import shutil
+import signal
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+import requests
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+# The request mix of a busy clinic network: terminals paging through the
+# inventory, a few full refreshes, and peers pushing sync batches.
+MIX = [("page", 0.6), ("full", 0.2), ("sync", 0.2)]
+
+
+def start_server(mode, data_dir, port):
+    """Starts app.py the way a clinic would run it, and waits until it is ready."""
+    cmd = [sys.executable, os.path.join(HERE, "app.py"), "--data-dir", data_dir, "--port", str(port)]
+    if mode == "production":
+        cmd.append("--production")
+    # Own process group: the debug server's reloader runs the app in a child process.
+    proc = subprocess.Popen(cmd, cwd=HERE, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+                            start_new_session=(os.name != "nt"))
+    url = f"http://127.0.0.1:{port}/api"
+    deadline = time.time() + 60
+    while time.time() < deadline:
+        try:
+            if requests.get(f"{url}/ready", timeout=1).status_code == 200:
+                return proc, url
+        except requests.RequestException:
+            pass
+        time.sleep(0.2)
+    stop_server(proc)
+    raise RuntimeError(f"{mode} server did not become ready")
+
+
+def stop_server(proc):
+    if os.name != "nt":
+        os.killpg(proc.pid, signal.SIGINT)
+    else:
+        proc.terminate()
+    try:
+        proc.wait(timeout=15)
+    except subprocess.TimeoutExpired:
+        if os.name != "nt":
+            os.killpg(proc.pid, signal.SIGKILL)
+        proc.kill()
+        proc.wait()
+
+
+def seed(url, records):
+    ops = [{"op": "add", "batch_id": f"BATCH-{i:07d}", "med_name": f"Medicine-{i % 300}",
+            "expiry": f"202{7 + i % 3}-{1 + i % 12:02d}", "qty": 10 + i % 90} for i in range(records)]
+    for start in range(0, len(ops), 1000):
+        res = requests.post(f"{url}/batch", json={"operations": ops[start:start + 1000]}, timeout=60)
+        res.raise_for_status()
+
+
+def client(url, records, stop, out, seed_value):
+    """One terminal: a keep-alive session issuing the request mix until 'stop'."""
+    rng = random.Random(seed_value)
+    session = requests.Session()
+    kinds, weights = zip(*MIX)
+    while not stop.is_set():
+        kind = rng.choices(kinds, weights)[0]
+        started = time.perf_counter()
+        try:
+            if kind == "page":
+                after = f"BATCH-{rng.randrange(records):07d}"
+                res = session.get(f"{url}/view_all", params={"after": after, "limit": 100}, timeout=30)
+            elif kind == "full":
+                res = session.get(f"{url}/view_all", timeout=30)
+            else:
+                batch = [{"batch_id": f"BATCH-{rng.randrange(records):07d}",
+                          "details": {"qty": rng.randrange(1, 100)}} for _ in range(20)]
+                res = session.post(f"{url}/sync", json={"inventory": batch}, timeout=30)
+            res.content
+            ok = res.status_code == 200
+        except requests.RequestException:
+            ok = False
+        out.append((kind, time.perf_counter() - started, ok))
+
+
+def run_load(url, records, clients, duration):
+    stop = threading.Event()
+    samples = []
+    threads = [threading.Thread(target=client, args=(url, records, stop, samples, i)) for i in range(clients)]
+    started = time.perf_counter()
+    for th in threads:
+        th.start()
+    time.sleep(duration)
+    stop.set()
+    for th in threads:
+        th.join()
+    elapsed = time.perf_counter() - started
+
+    def summary(rows):
+        latencies = sorted(t for _, t, _ in rows)
+        if not latencies:
+            return {"requests": 0}
+        pick = lambda q: latencies[min(len(latencies) - 1, int(q * len(latencies)))]
+        return {
+            "requests": len(rows),
+            "errors": sum(1 for _, _, ok in rows if not ok),
+            "req_s": round(len(rows) / elapsed, 1),
+            "mean_ms": round(statistics.fmean(latencies) * 1000, 2),
+            "p50_ms": round(pick(0.50) * 1000, 2),
+            "p95_ms": round(pick(0.95) * 1000, 2),
+            "max_ms": round(latencies[-1] * 1000, 2),
+        }
+
+    return {"all": summary(samples),
+            **{kind: summary([s for s in samples if s[0] == kind]) for kind, _ in MIX}}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load test: debug server vs production server")
+    parser.add_argument("--records", type=int, default=5000, help="inventory size to seed")
+    parser.add_argument("--clients", type=int, default=16, help="concurrent keep-alive clients")
+    parser.add_argument("--duration", type=float, default=15, help="seconds of load per server")
+    parser.add_argument("--modes", nargs="+", default=["dev", "production"], choices=["dev", "production"])
+    parser.add_argument("--port", type=int, default=5090)
+    parser.add_argument("--output", help="also write the results as JSON")
+    args = parser.parse_args()
+
+    print("=== 🚦 ANCHOR-MED LOAD TEST ===")
+    print(f"{args.records} records, {args.clients} clients, {args.duration:g}s per server")
+    results = {}
+    for mode in args.modes:
+        data_dir = tempfile.mkdtemp(prefix="anchormed-load-")
+        try:
+            proc, url = start_server(mode, data_dir, args.port)
+            try:
+                seed(url, args.records)
+                results[mode] = run_load(url, args.records, args.clients, args.duration)
+            finally:
+                stop_server(proc)
+        finally:
+            shutil.rmtree(data_dir, ignore_errors=True)
+        print(f"\n[{mode}]")
+        for kind, stats in results[mode].items():
+            if stats["requests"]:
+                print(f"  {kind:>5}: {stats['req_s']:>8,.1f} req/s  p50 {stats['p50_ms']:>8.2f} ms  "
+                      f"p95 {stats['p95_ms']:>8.2f} ms  errors {stats['errors']}")
+
+    if "dev" in results and "production" in results:
+        before, after = results["dev"]["all"]["req_s"], results["production"]["all"]["req_s"]
+        print(f"\n📈 Production vs debug server: {after / before:.2f}x the throughput")
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump({"params": vars(args), "results": results}, f, indent=2)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
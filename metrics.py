@@ -0,0 +1,261 @@
+import os
+import sys
+import threading
+import time
+from collections import Counter as _Tally
+from typing import Any, Callable, Iterator
+
+# Master switch for the hot-path instruments (histograms and counters). When it is
+# off, observe()/inc() return straight away, so the only cost left in the engine
+# is one attribute check. Gauges are computed at scrape time and cost nothing.
+enabled: bool = True
+
+# Default latency buckets, in seconds (0.5 ms .. 10 s).
+LATENCY_BUCKETS: tuple[float, ...] = (
+    0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0
+)
+
+_REGISTRY: list[Any] = []
+
+def set_enabled(flag: bool) -> None:
+    """Turns the histogram/counter instruments on or off."""
+    global enabled
+    enabled = flag
+
+def _escape(value: Any) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+def _labels(names: tuple[str, ...], values: tuple[Any, ...], extra: str = "") -> str:
+    pairs: list[str] = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+def _number(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+class Counter:
+    """
+    A monotonically increasing count, optionally split by labels.
+
+    Attributes:
+        name (str): Metric name, e.g. "anchormed_wal_records_total".
+        help (str): One-line description for the exposition.
+        labelnames (tuple): Label names; inc() takes one value per name.
+    """
+    def __init__(self, name: str, help: str, labelnames: tuple[str, ...] = ()) -> None:
+        self.name: str = name
+        self.help: str = help
+        self.labelnames: tuple[str, ...] = labelnames
+        self._values: dict[tuple[Any, ...], float] = {}
+        self._lock: threading.Lock = threading.Lock()
+        _REGISTRY.append(self)
+
+    def inc(self, *labels: Any, amount: float = 1) -> None:
+        """Adds 'amount' to the series selected by 'labels'."""
+        if not enabled:
+            return
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def render(self) -> Iterator[str]:
+        yield f"# HELP {self.name} {self.help}"
+        yield f"# TYPE {self.name} counter"
+        with self._lock:
+            series: list[tuple[tuple[Any, ...], float]] = sorted(self._values.items(), key=lambda kv: str(kv[0]))
+        for labels, value in series:
+            yield f"{self.name}{_labels(self.labelnames, labels)} {_number(value)}"
+
+class Histogram:
+    """
+    Cumulative-bucket histogram (Prometheus style), optionally split by labels.
+
+    Attributes:
+        name (str): Metric name, e.g. "anchormed_wal_fsync_seconds".
+        help (str): One-line description for the exposition.
+        buckets (tuple): Upper bounds of the buckets, ascending (+Inf is implied).
+        labelnames (tuple): Label names; observe() takes one value per name.
+    """
+    def __init__(self, name: str, help: str, buckets: tuple[float, ...] = LATENCY_BUCKETS,
+                 labelnames: tuple[str, ...] = ()) -> None:
+        self.name: str = name
+        self.help: str = help
+        self.buckets: tuple[float, ...] = tuple(buckets)
+        self.labelnames: tuple[str, ...] = labelnames
+        # labels -> [per-bucket counts..., +Inf count, sum]
+        self._series: dict[tuple[Any, ...], list[float]] = {}
+        self._lock: threading.Lock = threading.Lock()
+        _REGISTRY.append(self)
+
+    def observe(self, value: float, *labels: Any) -> None:
+        """Records one sample in the series selected by 'labels'."""
+        if not enabled:
+            return
+        with self._lock:
+            series: list[float] | None = self._series.get(labels)
+            if series is None:
+                series = self._series[labels] = [0] * (len(self.buckets) + 2)
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[i] += 1
+                    break
+            else:
+                series[len(self.buckets)] += 1
+            series[-1] += value
+
+    def time(self, *labels: Any) -> '_Timer':
+        """Context manager that observes the duration of its block."""
+        return _Timer(self, labels)
+
+    def render(self) -> Iterator[str]:
+        yield f"# HELP {self.name} {self.help}"
+        yield f"# TYPE {self.name} histogram"
+        with self._lock:
+            snapshot: list[tuple[tuple[Any, ...], list[float]]] = [
+                (labels, list(series)) for labels, series in sorted(self._series.items(), key=lambda kv: str(kv[0]))
+            ]
+        for labels, series in snapshot:
+            running: float = 0
+            for bound, count in zip(self.buckets + (float("inf"),), series):
+                running += count
+                le: str = 'le="' + _number(bound) + '"'
+                yield f"{self.name}_bucket{_labels(self.labelnames, labels, le)} {_number(running)}"
+            yield f"{self.name}_sum{_labels(self.labelnames, labels)} {_number(series[-1])}"
+            yield f"{self.name}_count{_labels(self.labelnames, labels)} {_number(running)}"
+
+class _Timer:
+    __slots__ = ("histogram", "labels", "start")
+
+    def __init__(self, histogram: Histogram, labels: tuple[Any, ...]) -> None:
+        self.histogram: Histogram = histogram
+        self.labels: tuple[Any, ...] = labels
+        self.start: float = 0.0
+
+    def __enter__(self) -> '_Timer':
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc: Any) -> None:
+        self.histogram.observe(time.perf_counter() - self.start, *self.labels)
+
+class Gauge:
+    """
+    A value that can go up and down. Either set() it, or pass 'fn' to compute it
+    at scrape time (fn returns a number, or a dict of label-value tuple -> number).
+
+    Attributes:
+        name (str): Metric name, e.g. "anchormed_btree_height".
+        help (str): One-line description for the exposition.
+        labelnames (tuple): Label names of the series.
+    """
+    def __init__(self, name: str, help: str, fn: Callable[[], Any] | None = None,
+                 labelnames: tuple[str, ...] = ()) -> None:
+        self.name: str = name
+        self.help: str = help
+        self.labelnames: tuple[str, ...] = labelnames
+        self._fn: Callable[[], Any] | None = fn
+        self._values: dict[tuple[Any, ...], float] = {}
+        _REGISTRY.append(self)
+
+    def set(self, value: float, *labels: Any) -> None:
+        """Sets the series selected by 'labels' (always recorded, even when disabled)."""
+        self._values[labels] = value
+
+    def render(self) -> Iterator[str]:
+        values: Any = self._fn() if self._fn is not None else dict(self._values)
+        if values is None:
+            return
+        if not isinstance(values, dict):
+            values = {(): values}
+        yield f"# HELP {self.name} {self.help}"
+        yield f"# TYPE {self.name} gauge"
+        for labels, value in sorted(values.items(), key=lambda kv: str(kv[0])):
+            yield f"{self.name}{_labels(self.labelnames, labels)} {_number(value)}"
+
+def render() -> str:
+    """
+    Renders every registered metric in the Prometheus text exposition format (0.0.4).
+    """
+    lines: list[str] = []
+    for metric in _REGISTRY:
+        try:
+            lines.extend(metric.render())
+        except Exception as e:
+            lines.append(f"# {metric.name} unavailable: {_escape(e)}")
+    return "\n".join(lines) + "\n"
+
+class SamplingProfiler:
+    """
+    Opt-in statistical profiler.
+
+    A daemon thread wakes up every 'interval' seconds, grabs the current stack
+    of every other thread (sys._current_frames) and counts identical stacks.
+    Nothing is traced between samples, so the cost is bounded by the sampling
+    rate and is zero while the profiler is stopped.
+
+    The result is in "collapsed stack" format (one 'frame;frame;frame count'
+    line per stack), which flamegraph.pl and speedscope read directly.
+
+    Attributes:
+        interval (float): Seconds between samples.
+        samples (int): Number of sampling rounds taken so far.
+    """
+    MAX_STACKS: int = 5000
+
+    def __init__(self) -> None:
+        self.interval: float = 0.01
+        self.samples: int = 0
+        self._stacks: _Tally[str] = _Tally()
+        self._lock: threading.Lock = threading.Lock()
+        self._stop: threading.Event = threading.Event()
+        self._thread: threading.Thread | None = None
+
+    @property
+    def running(self) -> bool:
+        return self._thread is not None
+
+    def start(self, interval: float = 0.01) -> None:
+        """Clears previous samples and starts sampling every 'interval' seconds."""
+        self.stop()
+        with self._lock:
+            self._stacks.clear()
+            self.samples = 0
+        self.interval = max(interval, 0.001)
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="sampling-profiler", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        """Stops sampling; the collected stacks are kept until the next start()."""
+        if self._thread is None:
+            return
+        self._stop.set()
+        self._thread.join()
+        self._thread = None
+
+    def _run(self) -> None:
+        me: int = threading.get_ident()
+        while not self._stop.wait(self.interval):
+            frames: dict[int, Any] = sys._current_frames()
+            with self._lock:
+                self.samples += 1
+                for ident, frame in frames.items():
+                    if ident == me:
+                        continue
+                    stack: list[str] = []
+                    while frame is not None:
+                        code: Any = frame.f_code
+                        stack.append(f"{os.path.basename(code.co_filename)}:{code.co_name}")
+                        frame = frame.f_back
+                    key: str = ";".join(reversed(stack))
+                    if key in self._stacks or len(self._stacks) < self.MAX_STACKS:
+                        self._stacks[key] += 1
+
+    def collapsed(self) -> str:
+        """Returns the stacks collected so far, most frequent first."""
+        with self._lock:
+            return "".join(f"{stack} {count}\n" for stack, count in self._stacks.most_common())
+
+profiler: SamplingProfiler = SamplingProfiler()
@@ -0,0 +1,519 @@
+import json
+import os
+import struct
+import threading
+import zlib
+from collections import OrderedDict
+from typing import Any, Callable, Iterable
+
+from btree_logic import BTree, BTreeNode
+
+# --- PAGE FILE LAYOUT ---
+# The file is an array of fixed-size pages. Page 0 is the file header:
+#   [8s magic][u32 version][u32 page size][u32 degree t][u32 root page]
+#   [u32 page count][u32 free-list head][u64 key count][u32 node count][u32 height]
+# Every other page starts with [u32 segment length][u32 next page] followed by
+# the segment. A node is stored as compact JSON [leaf, keys, values, children]
+# (children are page ids); a node too big for one page continues in overflow
+# pages chained through 'next'. A free page has length 0 and 'next' pointing at
+# the next free page. Page id 0 doubles as "none", since it is always the header.
+PAGE_MAGIC: bytes = b"AMPAGES\x00"
+PAGE_FORMAT_VERSION: int = 1
+DEFAULT_PAGE_SIZE: int = 8192
+_FILE_HEADER: struct.Struct = struct.Struct("<8sIIIIIIQII")
+_PAGE_HEADER: struct.Struct = struct.Struct("<II")
+_COMPACT: dict[str, Any] = {"separators": (",", ":")}
+
+# --- ROLLBACK JOURNAL ---
+# Before a page of the last committed version is overwritten for the first time,
+# its old image is appended to '<file>-journal' and fsynced:
+#   [8s magic][u32 page size][u32 committed page count], then per page
+#   [u32 page id][u32 CRC32 of image][image]
+# Committing (flush) writes the dirty pages and the header, fsyncs the file and
+# deletes the journal. Opening a file with a journal left behind copies the old
+# images back, so the file is always exactly the last committed tree; everything
+# after it is replayed from the WAL.
+JOURNAL_MAGIC: bytes = b"AMJRNL\x00\x01"
+_JOURNAL_HEADER: struct.Struct = struct.Struct("<8sII")
+_JOURNAL_ENTRY: struct.Struct = struct.Struct("<II")
+
+def _fsync_dir(path: str) -> None:
+    """Makes a file creation or removal inside 'path' durable (not supported on Windows)."""
+    if os.name == 'nt':
+        return
+    fd: int = os.open(path, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+class PageFile:
+    """
+    A file of fixed-size pages with a free list and a rollback journal.
+
+    All reads and writes go through one lock, so the file can be shared by
+    several reader threads (seek + read is not atomic on its own).
+
+    Attributes:
+        path (str): The data file.
+        page_size (int): Size of every page in bytes.
+        degree (int): The B-Tree minimum degree the file was created with.
+        root (int): Page id of the committed root node (0 if the file holds no tree yet).
+        page_count (int): Pages in the file, including the header page.
+        tree_stats (tuple): The committed tree's (key count, node count, height);
+                            a height of 0 means the file was written without them.
+    """
+    def __init__(self, path: str, page_size: int = DEFAULT_PAGE_SIZE, degree: int = 3) -> None:
+        """
+        Opens 'path', rolling back an interrupted commit, or creates an empty page file.
+
+        Args:
+            path (str): The data file.
+            page_size (int): Page size for a NEW file (an existing file keeps its own).
+            degree (int): B-Tree degree for a NEW file (an existing file keeps its own).
+
+        Raises:
+            ValueError: If the file is not a page file or uses an unknown version.
+        """
+        self.path: str = path
+        self.journal_path: str = path + "-journal"
+        self._lock: threading.RLock = threading.RLock()
+        self._journaled: set[int] = set()
+        self._journal: Any = None
+
+        if os.path.exists(path) and os.path.getsize(path) > 0:
+            self._file: Any = open(path, "r+b")
+            header: bytes = self._file.read(_FILE_HEADER.size)
+            if len(header) < _FILE_HEADER.size or not header.startswith(PAGE_MAGIC):
+                self._file.close()
+                raise ValueError(f"{path} is not an AnchorMed page file")
+            version: int = self._unpack_header(header)
+            if version != PAGE_FORMAT_VERSION:
+                self._file.close()
+                raise ValueError(f"Unsupported page file version {version}")
+            if os.path.exists(self.journal_path):
+                self._rollback()
+        else:
+            if page_size < 256:
+                raise ValueError(f"Page size must be at least 256 bytes, got {page_size}")
+            self._file = open(path, "w+b")
+            self.page_size, self.degree = page_size, degree
+            self.root, self.page_count, self.free_head = 0, 1, 0
+            self.tree_stats: tuple[int, int, int] = (0, 1, 1)
+            self._write_header()
+            self._file.flush()
+            os.fsync(self._file.fileno())
+            _fsync_dir(os.path.dirname(os.path.abspath(path)))
+        # Pages up to here belong to the committed tree and must be journaled before
+        # they are overwritten; pages past it are new and simply cut off on rollback.
+        self._committed_pages: int = self.page_count
+
+    def _unpack_header(self, header: bytes) -> int:
+        """Loads the header fields and returns the format version."""
+        (_, version, self.page_size, self.degree, self.root, self.page_count,
+         self.free_head, keys, nodes, height) = _FILE_HEADER.unpack(header)
+        self.tree_stats = (keys, nodes, height)
+        return version
+
+    def _write_header(self) -> None:
+        header: bytes = _FILE_HEADER.pack(
+            PAGE_MAGIC, PAGE_FORMAT_VERSION, self.page_size, self.degree,
+            self.root, self.page_count, self.free_head, *self.tree_stats
+        )
+        self._file.seek(0)
+        self._file.write(header.ljust(self.page_size, b"\x00"))
+
+    def _rollback(self) -> None:
+        """Copies the journaled page images back and cuts off pages added since the commit."""
+        with open(self.journal_path, "rb") as j:
+            data: bytes = j.read()
+        restored: int = 0
+        if len(data) >= _JOURNAL_HEADER.size:
+            magic, page_size, committed = _JOURNAL_HEADER.unpack_from(data)
+            if magic == JOURNAL_MAGIC and page_size == self.page_size:
+                pos: int = _JOURNAL_HEADER.size
+                entry_size: int = _JOURNAL_ENTRY.size + page_size
+                # An entry torn mid-write was never followed by its page write.
+                while pos + entry_size <= len(data):
+                    pid, crc = _JOURNAL_ENTRY.unpack_from(data, pos)
+                    image: bytes = data[pos + _JOURNAL_ENTRY.size:pos + entry_size]
+                    if zlib.crc32(image) != crc:
+                        break
+                    self._file.seek(pid * page_size)
+                    self._file.write(image)
+                    restored += 1
+                    pos += entry_size
+                self._file.truncate(committed * page_size)
+                self._file.flush()
+                os.fsync(self._file.fileno())
+                self._file.seek(0)
+                self._unpack_header(self._file.read(_FILE_HEADER.size))
+        os.remove(self.journal_path)
+        _fsync_dir(os.path.dirname(os.path.abspath(self.path)))
+        print(f"PAGES: Rolled back an interrupted flush ({restored} pages restored).")
+
+    def read(self, pid: int) -> bytes:
+        """Returns the raw bytes of page 'pid'."""
+        with self._lock:
+            self._file.seek(pid * self.page_size)
+            return self._file.read(self.page_size).ljust(self.page_size, b"\x00")
+
+    def write_many(self, pages: list[tuple[int, bytes]]) -> None:
+        """
+        Writes whole pages, first journaling any committed page not yet journaled.
+
+        Args:
+            pages: (page id, page bytes) pairs; each value is at most one page long.
+        """
+        with self._lock:
+            fresh: list[int] = [
+                pid for pid, _ in pages
+                if pid < self._committed_pages and pid not in self._journaled
+            ]
+            if fresh:
+                self._journal_pages(fresh)
+            for pid, data in pages:
+                self._file.seek(pid * self.page_size)
+                self._file.write(data.ljust(self.page_size, b"\x00"))
+
+    def _journal_pages(self, pids: list[int]) -> None:
+        """Appends the current images of 'pids' to the journal and makes them durable."""
+        if self._journal is None:
+            self._journal = open(self.journal_path, "wb")
+            self._journal.write(_JOURNAL_HEADER.pack(JOURNAL_MAGIC, self.page_size, self._committed_pages))
+            created: bool = True
+        else:
+            created = False
+        for pid in pids:
+            self._file.seek(pid * self.page_size)
+            image: bytes = self._file.read(self.page_size).ljust(self.page_size, b"\x00")
+            self._journal.write(_JOURNAL_ENTRY.pack(pid, zlib.crc32(image)) + image)
+            self._journaled.add(pid)
+        self._journal.flush()
+        os.fsync(self._journal.fileno())
+        if created:
+            _fsync_dir(os.path.dirname(os.path.abspath(self.journal_path)))
+
+    def allocate(self) -> int:
+        """Returns a page id for new data: a free page if there is one, else a new page."""
+        with self._lock:
+            if self.free_head:
+                pid: int = self.free_head
+                _, self.free_head = _PAGE_HEADER.unpack_from(self.read(pid))
+                return pid
+            pid = self.page_count
+            self.page_count += 1
+            return pid
+
+    def free(self, pid: int) -> None:
+        """Puts page 'pid' on the free list."""
+        with self._lock:
+            self.write_many([(pid, _PAGE_HEADER.pack(0, self.free_head))])
+            self.free_head = pid
+
+    def reset(self) -> None:
+        """Forgets every page, so the next allocations start again from page 1."""
+        with self._lock:
+            self.root, self.page_count, self.free_head = 0, 1, 0
+
+    def commit(self, root: int, tree_stats: tuple[int, int, int]) -> None:
+        """
+        Makes everything written so far the new committed version: writes the header
+        (with 'root' and the tree's counters), fsyncs, and deletes the rollback journal.
+        """
+        with self._lock:
+            self.root, self.tree_stats = root, tree_stats
+            if 0 not in self._journaled and self._committed_pages > 0:
+                self._journal_pages([0])
+            self._write_header()
+            self._file.truncate(self.page_count * self.page_size)
+            self._file.flush()
+            os.fsync(self._file.fileno())
+            if self._journal is not None:
+                self._journal.close()
+                self._journal = None
+                os.remove(self.journal_path)
+                _fsync_dir(os.path.dirname(os.path.abspath(self.journal_path)))
+            self._journaled.clear()
+            self._committed_pages = self.page_count
+
+    def close(self) -> None:
+        """Closes the file. Uncommitted pages are rolled back on the next open."""
+        with self._lock:
+            if self._journal is not None:
+                self._journal.close()
+                self._journal = None
+            self._file.close()
+
+class BufferPool:
+    """
+    A bounded LRU cache of decoded nodes, with dirty-page write-back.
+
+    When the pool is over capacity the least recently used node is dropped,
+    and written back first if it is dirty. flush() writes every dirty node.
+
+    Attributes:
+        capacity (int): Most nodes kept in memory at once.
+        hits (int): Lookups served from the pool.
+        misses (int): Lookups that had to read the page file.
+    """
+    def __init__(self, capacity: int, load: Callable[[int], Any], store: Callable[[Any], None]) -> None:
+        """
+        Args:
+            capacity (int): Most nodes kept in memory (at least 8).
+            load: Reads and decodes the node stored at a page id.
+            store: Encodes and writes a node back to its page(s).
+        """
+        if capacity < 8:
+            raise ValueError(f"Buffer pool needs at least 8 pages, got {capacity}")
+        self.capacity: int = capacity
+        self.hits: int = 0
+        self.misses: int = 0
+        self._load: Callable[[int], Any] = load
+        self._store: Callable[[Any], None] = store
+        self._nodes: OrderedDict[int, Any] = OrderedDict()
+        self._dirty: set[int] = set()
+        self._lock: threading.RLock = threading.RLock()
+
+    def get(self, pid: int) -> Any:
+        """Returns the node stored at page 'pid', loading it if it is not cached."""
+        with self._lock:
+            node: Any = self._nodes.get(pid)
+            if node is not None:
+                self._nodes.move_to_end(pid)
+                self.hits += 1
+                return node
+            self.misses += 1
+            node = self._load(pid)
+            self._nodes[pid] = node
+            self._evict()
+            return node
+
+    def put(self, node: Any) -> None:
+        """Caches 'node' (again) as most recently used and marks it dirty."""
+        with self._lock:
+            self._nodes[node.page_id] = node
+            self._nodes.move_to_end(node.page_id)
+            self._dirty.add(node.page_id)
+            self._evict()
+
+    def discard(self, pid: int) -> None:
+        """Drops page 'pid' from the pool without writing it (e.g. the page was freed)."""
+        with self._lock:
+            self._nodes.pop(pid, None)
+            self._dirty.discard(pid)
+
+    def clear(self) -> None:
+        """Drops every cached node without writing anything."""
+        with self._lock:
+            self._nodes.clear()
+            self._dirty.clear()
+
+    def _evict(self) -> None:
+        while len(self._nodes) > self.capacity:
+            pid, node = self._nodes.popitem(last=False)
+            if pid in self._dirty:
+                self._store(node)
+                self._dirty.discard(pid)
+
+    def flush(self) -> int:
+        """
+        Writes every dirty node back (in page order) and marks them clean.
+
+        Returns:
+            int: The number of nodes written.
+        """
+        with self._lock:
+            dirty: list[int] = sorted(self._dirty)
+            for pid in dirty:
+                self._store(self._nodes[pid])
+                self._dirty.discard(pid)
+            return len(dirty)
+
+    def stats(self) -> dict[str, int]:
+        """Returns the pool's size, dirty count and hit/miss counters."""
+        with self._lock:
+            return {
+                "capacity": self.capacity, "cached": len(self._nodes),
+                "dirty": len(self._dirty), "hits": self.hits, "misses": self.misses
+            }
+
+class PagedNode(BTreeNode):
+    """
+    A BTreeNode that lives in a page file.
+
+    Attributes:
+        page_id (int): The node's first page; parents store it in 'children'.
+        overflow (list): Extra pages holding the rest of a node bigger than one page.
+    """
+    __slots__ = ("page_id", "overflow")
+
+    def __init__(self, leaf: bool = False, page_id: int = 0) -> None:
+        super().__init__(leaf)
+        self.page_id: int = page_id
+        self.overflow: list[int] = []
+
+class PagedBTree(BTree):
+    """
+    A BTree whose nodes live in fixed-size pages of a single data file.
+
+    Nodes are loaded on demand and kept in a bounded LRU BufferPool, so memory
+    stays flat however large the inventory grows, and opening a store reads only
+    the header page. Children are stored as page ids. Modified nodes are written
+    back when evicted, and flush() writes the rest and commits the file atomically
+    (see the rollback journal above). wal_engine.create_checkpoint() calls flush()
+    instead of writing a JSON snapshot, and recovery replays the WAL on top.
+
+    Attributes:
+        file (PageFile): The underlying page file.
+        pool (BufferPool): The node cache.
+        fresh (bool): True until the first flush of a newly created file.
+    """
+    def __init__(self, path: str, t: int, cache_pages: int = 1024, page_size: int = DEFAULT_PAGE_SIZE) -> None:
+        """
+        Opens (or creates) the paged tree stored at 'path'.
+
+        Args:
+            path (str): The data file.
+            t (int): The minimum degree for a new file. An existing file keeps the
+                     degree it was built with, since its nodes are sized for it.
+            cache_pages (int): Buffer pool capacity, in nodes.
+            page_size (int): Page size in bytes for a new file.
+
+        Raises:
+            ValueError: If t is smaller than 2, or 'path' is not a valid page file.
+        """
+        if t < 2:
+            raise ValueError(f"B-Tree minimum degree must be at least 2, got {t}")
+        self.file: PageFile = PageFile(path, page_size, t)
+        if self.file.degree != t:
+            print(f"PAGES: {path} was built with t={self.file.degree}; using that instead of t={t}.")
+        self.t: int = self.file.degree
+        self.dirty: set[Any] = set()
+        self.pool: BufferPool = BufferPool(cache_pages, self._load_node, self._store_node)
+        self.fresh: bool = self.file.root == 0
+        if self.fresh:
+            self._root_page: int = self._new_node(True).page_id
+        else:
+            self._root_page = self.file.root
+        self.key_count, self.node_count, self.height = self.file.tree_stats
+        if not self.height:
+            self._recount()
+        print(f"PAGES: Opened {path} ({self.file.page_count} pages of {self.file.page_size} bytes).")
+
+    @property
+    def root(self) -> PagedNode:
+        return self.pool.get(self._root_page)
+
+    @root.setter
+    def root(self, node: PagedNode) -> None:
+        self._root_page = node.page_id
+
+    # --- Node storage hooks ---
+    def _child(self, node: BTreeNode, i: int) -> PagedNode:
+        return self.pool.get(node.children[i])
+
+    def _ref(self, node: BTreeNode) -> int:
+        return node.page_id
+
+    def _new_node(self, leaf: bool = False) -> PagedNode:
+        node: PagedNode = PagedNode(leaf, self.file.allocate())
+        self.pool.put(node)
+        return node
+
+    def _touch(self, node: BTreeNode) -> None:
+        # Re-adding also restores a node that was evicted while it was being changed.
+        self.pool.put(node)
+
+    def _free_node(self, node: BTreeNode) -> None:
+        self.pool.discard(node.page_id)
+        for pid in [node.page_id] + node.overflow:
+            self.file.free(pid)
+
+    def _recount(self) -> None:
+        """Counts keys, nodes and levels with one walk (for files written without them)."""
+        self.key_count, self.node_count, self.height = 0, 0, 0
+        level: list[int] = [self._root_page]
+        while level:
+            self.height += 1
+            self.node_count += len(level)
+            below: list[int] = []
+            for pid in level:
+                node: PagedNode = self.pool.get(pid)
+                self.key_count += len(node.keys)
+                below.extend(node.children)
+            level = below
+
+    def _load_node(self, pid: int) -> PagedNode:
+        """Reads the node at page 'pid', following its overflow chain."""
+        segments: list[bytes] = []
+        overflow: list[int] = []
+        page: int = pid
+        while True:
+            raw: bytes = self.file.read(page)
+            length, page = _PAGE_HEADER.unpack_from(raw)
+            segments.append(raw[_PAGE_HEADER.size:_PAGE_HEADER.size + length])
+            if not page:
+                break
+            overflow.append(page)
+        leaf, keys, values, children = json.loads(b"".join(segments))
+        node: PagedNode = PagedNode(leaf, pid)
+        node.keys, node.values, node.children, node.overflow = keys, values, children, overflow
+        return node
+
+    def _store_node(self, node: PagedNode) -> None:
+        """Writes 'node' to its page(s), growing or shrinking its overflow chain."""
+        data: bytes = json.dumps([node.leaf, node.keys, node.values, node.children], **_COMPACT).encode("utf-8")
+        room: int = self.file.page_size - _PAGE_HEADER.size
+        needed: int = max(1, -(-len(data) // room))
+        pids: list[int] = [node.page_id] + node.overflow
+        while len(pids) < needed:
+            pids.append(self.file.allocate())
+        for spare in pids[needed:]:
+            self.file.free(spare)
+        pids = pids[:needed]
+        node.overflow = pids[1:]
+
+        pages: list[tuple[int, bytes]] = []
+        for j, pid in enumerate(pids):
+            segment: bytes = data[j * room:(j + 1) * room]
+            following: int = pids[j + 1] if j + 1 < needed else 0
+            pages.append((pid, _PAGE_HEADER.pack(len(segment), following) + segment))
+        self.file.write_many(pages)
+
+    def bulk_load(self, items: Iterable[tuple[Any, Any]]) -> int:
+        """
+        Replaces the whole tree with sorted key-value pairs (see BTree.bulk_load).
+        The old pages are reused from page 1 up; nothing is committed until flush().
+        """
+        self.pool.clear()
+        self.file.reset()
+        return super().bulk_load(items)
+
+    def flush(self) -> int:
+        """
+        Writes every dirty node and atomically commits the page file.
+
+        Returns:
+            int: The number of nodes written.
+        """
+        written: int = self.pool.flush()
+        self.file.commit(self._root_page, (self.key_count, self.node_count, self.height))
+        self.fresh = False
+        return written
+
+    def page_stats(self) -> dict[str, int]:
+        """
+        Returns the buffer pool counters plus the page file's size.
+
+        Returns:
+            dict: capacity, cached, dirty, hits, misses, pages and page_size.
+        """
+        stats: dict[str, int] = self.pool.stats()
+        stats.update({"pages": self.file.page_count, "page_size": self.file.page_size})
+        return stats
+
+    def close(self) -> None:
+        """Closes the page file without flushing; unflushed changes are in the WAL."""
+        self.pool.clear()
+        self.file.close()
@@ -0,0 +1,97 @@
+import threading
+from typing import Any, Callable
+
+class _LockSide:
+    """
+    One side (read or write) of a ReadWriteLock, usable as a context manager:
+    'with lock.read:' / 'with lock.write:'.
+    """
+    __slots__ = ("_acquire", "_release")
+
+    def __init__(self, acquire: Callable[[], None], release: Callable[[], None]) -> None:
+        self._acquire: Callable[[], None] = acquire
+        self._release: Callable[[], None] = release
+
+    def __enter__(self) -> None:
+        self._acquire()
+
+    def __exit__(self, *exc: Any) -> None:
+        self._release()
+
+class ReadWriteLock:
+    """
+    A reader-writer lock: many readers at once, or one writer alone.
+    
+    Writers are preferred: once a writer is waiting, new readers queue behind it,
+    so a steady stream of reads cannot starve writes. Both sides are reentrant
+    per thread, and a thread holding the write side may also take the read side
+    (e.g. a write handler that calls a read helper). Releasing the write side
+    while still inside such a read downgrades: the thread keeps read access.
+
+    Attributes:
+        read (_LockSide): Context manager for shared (read) access.
+        write (_LockSide): Context manager for exclusive (write) access.
+    """
+    def __init__(self) -> None:
+        self._cond: threading.Condition = threading.Condition(threading.Lock())
+        self._readers: int = 0
+        self._writer: int | None = None
+        self._write_depth: int = 0
+        self._writers_waiting: int = 0
+        self._local: threading.local = threading.local()
+        self.read: _LockSide = _LockSide(self.acquire_read, self.release_read)
+        self.write: _LockSide = _LockSide(self.acquire_write, self.release_write)
+
+    def acquire_read(self) -> None:
+        me: int = threading.get_ident()
+        depth: int = getattr(self._local, "read_depth", 0)
+        with self._cond:
+            if depth == 0:
+                # Only a read taken outside our own write lock counts as a reader.
+                self._local.read_counted = self._writer != me
+                if self._local.read_counted:
+                    while self._writer is not None or self._writers_waiting:
+                        self._cond.wait()
+                    self._readers += 1
+        # Nested reads (or reads under our own write lock) never wait, so they cannot
+        # deadlock against a writer queued in between.
+        self._local.read_depth = depth + 1
+
+    def release_read(self) -> None:
+        depth: int = self._local.read_depth - 1
+        self._local.read_depth = depth
+        with self._cond:
+            if depth == 0 and self._local.read_counted:
+                self._readers -= 1
+                if self._readers == 0:
+                    self._cond.notify_all()
+
+    def acquire_write(self) -> None:
+        me: int = threading.get_ident()
+        with self._cond:
+            if self._writer == me:
+                self._write_depth += 1
+                return
+            if getattr(self._local, "read_depth", 0):
+                raise RuntimeError("Cannot upgrade a read lock to a write lock")
+            self._writers_waiting += 1
+            try:
+                while self._writer is not None or self._readers:
+                    self._cond.wait()
+            finally:
+                self._writers_waiting -= 1
+            self._writer = me
+            self._write_depth = 1
+
+    def release_write(self) -> None:
+        with self._cond:
+            if self._writer != threading.get_ident():
+                raise RuntimeError("Write lock released by a thread that does not hold it")
+            self._write_depth -= 1
+            if self._write_depth == 0:
+                self._writer = None
+                if getattr(self._local, "read_depth", 0) and not self._local.read_counted:
+                    # Downgrade: the read taken under the write lock becomes a real one.
+                    self._readers += 1
+                    self._local.read_counted = True
+                self._cond.notify_all()
@@ -0,0 +1,11 @@
+import os
+import sys
+import tempfile
+
+# The modules under test live at the repository root.
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# The app reads its settings on import: point it at a scratch data directory
+# (never the real inventory) before any test module imports it.
+os.environ["ANCHORMED_DATA_DIR"] = tempfile.mkdtemp(prefix="anchormed-test-")
+os.environ["AUTO_CHECKPOINT"] = "0"
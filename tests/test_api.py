@@ -0,0 +1,495 @@
+import contextlib
+import glob
+import os
+import random
+import re
+import shutil
+import signal
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+import app as anchor_app
+import ledger as event_ledger
+import wal_engine
+from load_test import start_server, stop_server
+
+anchor_app.start_engine(background=False)
+client = anchor_app.app.test_client()
+
+
+def reset_inventory(records):
+    """Replaces the tree with 'records' (batch_id -> details), bypassing the WAL,
+    and rebuilds the indexes from it."""
+    with anchor_app.db_lock.write:
+        for batch_id, _ in list(anchor_app.db.iter_items()):
+            anchor_app.db.delete(batch_id)
+        for batch_id, details in records.items():
+            anchor_app.db.insert(batch_id, details)
+        for index in (anchor_app.expiry_index, anchor_app.name_index, anchor_app.range_digest):
+            index.rebuild(anchor_app.db)
+
+
+class WriteBeforeEachRead:
+    """Stands in for db_lock: runs 'write' (under the real write lock) every time a
+    reader is about to take the read lock, i.e. a writer wins every race."""
+    def __init__(self, lock, write):
+        self.lock = lock
+        self._write = write
+
+    @property
+    @contextlib.contextmanager
+    def read(self):
+        with self.lock.write:
+            self._write()
+        with self.lock.read:
+            yield
+
+
+def test_ndjson_stream_survives_writes_between_chunks():
+    """Writes between chunks must not make the stream skip, repeat or reorder keys."""
+    rng = random.Random(15)
+    real_lock, chunk_size = anchor_app.db_lock, anchor_app.VIEW_STREAM_CHUNK
+    stable = {f"S{i:04d}": {"qty": i} for i in range(0, 400, 2)}
+    churn = [f"S{i:04d}" for i in range(1, 400, 2)]
+
+    def write():
+        # Splits and merges all over the tree, also around the stream position.
+        for key in rng.sample(churn, 20):
+            if rng.random() < 0.5:
+                anchor_app.db.delete(key)
+            else:
+                anchor_app.db.insert(key, {"qty": 0})
+
+    try:
+        anchor_app.VIEW_STREAM_CHUNK = 7
+        for _ in range(30):
+            reset_inventory(stable)
+            anchor_app.db_lock = WriteBeforeEachRead(real_lock, write)
+            seen = []
+            for chunk in anchor_app.stream_inventory():
+                seen += [line.split('"')[3] for line in chunk.splitlines()]
+            anchor_app.db_lock = real_lock
+
+            assert seen == sorted(set(seen)), "stream repeated or reordered keys"
+            assert set(stable) <= set(seen), "stream skipped keys nobody touched"
+    finally:
+        anchor_app.db_lock, anchor_app.VIEW_STREAM_CHUNK = real_lock, chunk_size
+
+
+def add(batch_id, name, expiry, qty, to=None):
+    op = {"batch_id": batch_id, "med_name": name, "expiry": expiry, "qty": qty}
+    if to is None:
+        assert client.post("/api/add", json=op).status_code == 200
+    else:
+        anchor_app.requests.post(f"{to}/add", json=op, timeout=10).raise_for_status()
+
+
+def test_digest_sync_converges():
+    """Records that differ in more than qty must not be re-fetched on every sync:
+    the second sync transfers nothing. An empty batch this node never held is
+    not copied."""
+    reset_inventory({})
+    anchor_app.range_digest.rebuild(anchor_app.db)
+    peer_dir = tempfile.mkdtemp(prefix="anchormed-peer-")
+    proc, peer_url = start_server("production", peer_dir, 5093)
+    try:
+        add("P-NAME", "Amox", "2027-01", 5)
+        add("P-NAME", "Amoxicillin", "2027-01", 5, to=peer_url)
+        add("P-EXPIRY", "Para", "2027-01", 9)
+        add("P-EXPIRY", "Para", "2028-06", 9, to=peer_url)
+        add("P-EMPTY", "Zinc", "2026-11", 0, to=peer_url)
+        add("P-NEW", "Ors", "2027-03", 40, to=peer_url)
+        add("L-ONLY", "Iron", "2027-02", 12)
+
+        anchor_app.PEER_HOSTS = ["127.0.0.1:5093"]
+        first = client.post("/api/sync_peer", json={"target_ip": "127.0.0.1:5093"}).json
+        assert first["success"], first
+        assert first["message"] == "Merged 3 records (4 differed).", first
+        second = client.post("/api/sync_peer", json={"target_ip": "127.0.0.1:5093"}).json
+        assert second["message"] == "Merged 0 records (1 differed).", second
+        assert anchor_app.db.search("P-NAME")["name"] == "Amoxicillin"
+        assert anchor_app.db.search("L-ONLY")["qty"] == 12
+        assert anchor_app.db.search("P-EMPTY") is None
+    finally:
+        anchor_app.PEER_HOSTS = []
+        stop_server(proc)
+        shutil.rmtree(peer_dir, ignore_errors=True)
+
+
+def test_compacted_batches_stay_purged_after_a_sync():
+    """A batch purged here must not come back from a peer that still holds it empty."""
+    reset_inventory({})
+    anchor_app.range_digest.rebuild(anchor_app.db)
+    peer_dir = tempfile.mkdtemp(prefix="anchormed-peer-")
+    proc, peer_url = start_server("production", peer_dir, 5095)
+    try:
+        for to in (None, peer_url):
+            add("C-GONE", "Zinc", "2026-11", 0, to=to)
+            add("C-KEEP", "Iron", "2027-02", 6, to=to)
+        assert client.post("/api/compact", json={"retention_days": 0}).json["success"]
+        assert anchor_app.db.search("C-GONE") is None
+
+        anchor_app.PEER_HOSTS = ["127.0.0.1:5095"]
+        res = client.post("/api/sync_peer", json={"target_ip": "127.0.0.1:5095"}).json
+        assert res["message"] == "Merged 0 records (1 differed).", res
+        assert anchor_app.db.search("C-GONE") is None
+        assert anchor_app.db.search("C-KEEP")["qty"] == 6
+    finally:
+        anchor_app.PEER_HOSTS = []
+        stop_server(proc)
+        shutil.rmtree(peer_dir, ignore_errors=True)
+
+
+def test_sync_peer_only_reaches_configured_peers():
+    anchor_app.PEER_HOSTS = ["192.168.1.20"]
+    try:
+        for target in ("169.254.169.254", "localhost:22", "192.168.1.20:8080", "192.168.1.21"):
+            res = client.post("/api/sync_peer", json={"target_ip": target})
+            assert res.status_code == 403, target
+            assert "PEER_HOSTS" in res.json["message"]
+        assert anchor_app.peer_refusal("192.168.1.20:5000") is None
+    finally:
+        anchor_app.PEER_HOSTS = []
+
+
+def test_sync_peer_accepts_lan_peers_by_default():
+    assert anchor_app.PEER_HOSTS == []
+    for target in ("192.168.1.20", "10.0.0.7", "172.16.4.2", "[fd00::5]:5000"):
+        assert anchor_app.peer_refusal(anchor_app.peer_address(target)) is None, target
+    for target in ("169.254.169.254", "127.0.0.1", "localhost", "0.0.0.0", "8.8.8.8",
+                   "clinic.example.com", "192.168.1.20:22", "[::1]:5000"):
+        res = client.post("/api/sync_peer", json={"target_ip": target})
+        assert res.status_code == 403, target
+        assert "PEER_HOSTS" in res.json["message"]
+
+
+def test_view_all_etag_differs_per_encoding():
+    """A cache must never answer a gzip request with the identity body (or the
+    reverse) because both carried the same strong ETag."""
+    reset_inventory({f"E{i:04d}": {"name": "Zinc", "expiry": "2027-05", "qty": i} for i in range(200)})
+    add("E-BUMP", "Zinc", "2027-05", 1)
+    plain = client.get("/api/view_all", headers={"Accept-Encoding": "identity"})
+    packed = client.get("/api/view_all", headers={"Accept-Encoding": "gzip"})
+    assert packed.headers["Content-Encoding"] == "gzip"
+    assert "Content-Encoding" not in plain.headers
+    assert plain.headers["ETag"] != packed.headers["ETag"]
+    for res, encoding in ((plain, "identity"), (packed, "gzip")):
+        again = client.get("/api/view_all", headers={"Accept-Encoding": encoding,
+                                                     "If-None-Match": res.headers["ETag"]})
+        assert again.status_code == 304 and again.headers["ETag"] == res.headers["ETag"]
+    add("E-BUMP", "Zinc", "2027-05", 2)
+    stale = client.get("/api/view_all", headers={"Accept-Encoding": "gzip", "If-None-Match": packed.headers["ETag"]})
+    assert stale.status_code == 200
+
+
+def test_full_view_says_where_the_change_feed_resumes():
+    """A client that loaded /api/view_all only needs /api/changes from then on."""
+    reset_inventory({})
+    add("F-OLD", "Zinc", "2027-05", 3)
+    full = client.get("/api/view_all").json
+    assert full["epoch"] == anchor_app.changes.epoch and full["seq"] == anchor_app.changes.seq
+    assert [i["batch_id"] for i in full["inventory"]] == ["F-OLD"]
+
+    add("F-NEW", "Iron", "2027-02", 8)
+    assert client.post("/api/update", json={"batch_id": "F-OLD", "new_qty": 4}).status_code == 200
+    delta = client.get(f"/api/changes?since={full['seq']}&epoch={full['epoch']}").json
+    assert not delta["reset"] and delta["seq"] == full["seq"] + 2
+    assert [(c["batch_id"], c["details"]["qty"]) for c in delta["changes"]] == [("F-NEW", 8), ("F-OLD", 4)]
+    # Nothing new: an empty delta at the same position.
+    again = client.get(f"/api/changes?since={delta['seq']}&epoch={delta['epoch']}").json
+    assert (again["reset"], again["seq"], again["changes"]) == (False, delta["seq"], [])
+    # Another server instance (a restart) means one full fetch.
+    assert client.get(f"/api/changes?since={delta['seq']}&epoch=other").json["reset"]
+
+
+def test_compact_purges_only_batches_empty_past_retention():
+    day, now = 86400, time.time()
+    reset_inventory({
+        "OLD": {"name": "Zinc", "qty": 0, "emptied_at": now - 31 * day},
+        "LEGACY": {"name": "Zinc", "qty": 0},  # emptied before stamps existed
+        "RECENT": {"name": "Zinc", "qty": 0, "emptied_at": now - day},
+        "STOCKED": {"name": "Iron", "qty": 5, "emptied_at": now - 90 * day},
+        "RESTOCKED": {"name": "Iron", "qty": 3},
+    })
+    # Emptied and refilled: the refill clears the stamp.
+    assert client.post("/api/delete", json={"batch_id": "RESTOCKED"}).status_code == 200
+    assert anchor_app.db.search("RESTOCKED")["emptied_at"] >= int(now)
+    assert client.post("/api/update", json={"batch_id": "RESTOCKED", "new_qty": 4}).status_code == 200
+    assert "emptied_at" not in anchor_app.db.search("RESTOCKED")
+
+    for bad in ("soon", -1):
+        res = client.post("/api/compact", json={"retention_days": bad})
+        assert res.status_code == 400 and not res.json["success"]
+
+    since = anchor_app.changes.seq
+    res = client.post("/api/compact", json={})  # TOMBSTONE_RETENTION_DAYS (30)
+    assert res.json["message"] == "Purged 2 empty batches.", res.json
+    assert sorted(k for k, _ in anchor_app.db.iter_items()) == ["RECENT", "RESTOCKED", "STOCKED"]
+    feed = client.get(f"/api/changes?since={since}").json["changes"]
+    assert sorted((c["batch_id"], c["details"]) for c in feed) == [("LEGACY", None), ("OLD", None)]
+
+    assert client.post("/api/compact", json={"retention_days": 2}).json["message"] == "Purged 0 empty batches."
+    assert client.post("/api/compact", json={"retention_days": 0}).json["message"] == "Purged 1 empty batches."
+    assert sorted(k for k, _ in anchor_app.db.iter_items()) == ["RESTOCKED", "STOCKED"]
+
+
+def test_batch_reports_a_status_per_operation(monkeypatch):
+    reset_inventory({"EXIST": {"name": "Zinc", "expiry": "2027-05", "qty": 10},
+                     "GONE": {"name": "Iron", "expiry": "2027-02", "qty": 3}})
+    frames = []
+    submit = anchor_app.engine.submit_transactions
+    monkeypatch.setattr(anchor_app.engine, "submit_transactions",
+                        lambda records: (frames.append(list(records)), submit(frames[-1]))[1])
+    operations = [
+        {"op": "update", "batch_id": "EXIST", "new_qty": 7},
+        {"op": "add", "batch_id": "NEW", "med_name": "Ors", "expiry": "2027-03", "qty": 20},
+        {"op": "update", "batch_id": "NEW", "new_qty": 15},  # sees the add before it
+        {"op": "update", "batch_id": "MISSING", "new_qty": 1},
+        {"op": "update", "batch_id": "EXIST"},
+        {"op": "delete", "batch_id": "GONE"},
+        {"op": "delete", "batch_id": "MISSING"},
+        {"op": "restock", "batch_id": "EXIST"},
+        {"op": "add", "med_name": "No id", "qty": 1},
+        "not an operation",
+    ]
+    res = client.post("/api/batch", json={"operations": operations})
+    assert res.status_code == 200
+    assert res.json["message"] == "Applied 3 records."
+    assert [(r["batch_id"], r["status"]) for r in res.json["results"]] == [
+        ("EXIST", 200), ("NEW", 200), ("NEW", 200), ("MISSING", 404), ("EXIST", 400),
+        ("GONE", 200), ("MISSING", 404), ("EXIST", 400), (None, 400), (None, 400),
+    ]
+    assert [r["success"] for r in res.json["results"]] == [r["status"] == 200 for r in res.json["results"]]
+    assert res.json["results"][7]["message"] == "Unknown op 'restock'"
+
+    # All changes in ONE WAL frame, one entry per batch.
+    assert len(frames) == 1 and sorted(k for k, _ in frames[0]) == ["EXIST", "GONE", "NEW"]
+    assert anchor_app.db.search("EXIST")["qty"] == 7
+    assert anchor_app.db.search("NEW") == {"name": "Ors", "expiry": "2027-03", "qty": 15}
+    assert anchor_app.db.search("GONE")["qty"] == 0 and "emptied_at" in anchor_app.db.search("GONE")
+    assert anchor_app.name_index.get("ors").qty == 15
+    # ...but one ledger event per operation.
+    events = client.get("/api/history?batch_id=NEW").json["events"]
+    assert len(events) == 2
+
+
+def test_batch_rejects_empty_and_oversized_requests(monkeypatch):
+    for body in ({}, {"operations": []}, {"operations": "add"}):
+        res = client.post("/api/batch", json=body)
+        assert res.status_code == 400 and not res.json["success"]
+    monkeypatch.setattr(anchor_app, "BATCH_MAX_OPERATIONS", 2)
+    ops = [{"op": "delete", "batch_id": f"X{i}"} for i in range(3)]
+    assert client.post("/api/batch", json={"operations": ops}).status_code == 413
+    # Nothing to apply is still a success, with the reasons per operation.
+    res = client.post("/api/batch", json={"operations": ops[:2]})
+    assert res.status_code == 200 and res.json["message"] == "Applied 0 records."
+    assert [r["status"] for r in res.json["results"]] == [404, 404]
+
+
+SAMPLE = re.compile(r'^([a-zA-Z_:][a-zA-Z0-9_:]*)(\{(?:[a-zA-Z_]\w*="(?:[^"\\]|\\.)*",?)*\})? (\S+)$')
+
+
+def scrape():
+    """GETs /api/metrics and checks it against the text exposition format. Returns
+    {family: type} and [(name, labels, value)]."""
+    res = client.get("/api/metrics")
+    assert res.status_code == 200
+    assert res.headers["Content-Type"].startswith("text/plain; version=0.0.4")
+    text = res.get_data(as_text=True)
+    assert text.endswith("\n")
+    types, samples = {}, []
+    for line in text.splitlines():
+        if line.startswith("# TYPE "):
+            _, _, family, kind = line.split(" ")
+            assert kind in ("counter", "gauge", "histogram") and family not in types, line
+            types[family] = kind
+        elif line.startswith("# HELP "):
+            assert line.split(" ")[2] not in types, "HELP goes before TYPE"
+        else:
+            match = SAMPLE.match(line)
+            assert match, f"not a sample line: {line!r}"
+            name, labels, value = match.groups()
+            family = re.sub(r"_(bucket|sum|count)$", "", name) if name not in types else name
+            assert family in types, f"{name} has no TYPE line before it"
+            float(value)  # numbers, or +Inf
+            samples.append((name, labels or "", value))
+    return types, samples
+
+
+def test_metrics_exposition_format():
+    reset_inventory({})
+    add("M-1", "Zinc", "2027-05", 3)
+    client.get("/api/view_all")
+    types, samples = scrape()
+    assert types["anchormed_http_request_seconds"] == "histogram"
+    assert types["anchormed_wal_fsync_seconds"] == "histogram"
+    assert types["anchormed_view_cache_total"] == "counter"
+    assert types["anchormed_btree_keys"] == "gauge"
+    values = {(name, labels): value for name, labels, value in samples}
+    assert values[("anchormed_btree_keys", "")] == str(anchor_app.db.key_count)
+    assert values[("anchormed_engine_ready", "")] == "1"
+
+    # Histogram buckets are cumulative and end at +Inf, which equals _count.
+    add_series = '{method="POST",route="/api/add",status="200"'
+    buckets = [(labels, float(value)) for name, labels, value in samples
+               if name == "anchormed_http_request_seconds_bucket" and labels.startswith(add_series)]
+    counts = [count for _, count in buckets]
+    assert counts == sorted(counts) and buckets[-1][0].endswith(',le="+Inf"}')
+    assert float(values[("anchormed_http_request_seconds_count", add_series + "}")]) == buckets[-1][1]
+    assert float(values[("anchormed_http_request_seconds_sum", add_series + "}")]) > 0
+
+
+def test_profiler_is_off_unless_enabled():
+    for method in ("get", "post"):
+        res = getattr(client, method)("/api/profiler", json={"enabled": True})
+        assert res.status_code == 404 and "PROFILER_ENABLED" in res.json["message"]
+    assert not anchor_app.metrics.profiler.running
+    anchor_app.PROFILER_ENABLED = True
+    try:
+        assert client.post("/api/profiler", json={"enabled": True, "interval_ms": 5}).json["success"]
+        time.sleep(0.05)
+        assert client.get("/api/profiler").status_code == 200
+    finally:
+        client.post("/api/profiler", json={"enabled": False})
+        anchor_app.PROFILER_ENABLED = False
+
+
+def test_routes_answer_503_until_the_engine_is_ready(monkeypatch):
+    progress = wal_engine.RecoveryProgress()
+    progress.begin()
+    progress.phase, progress.records = "wal", 42
+    monkeypatch.setattr(anchor_app, "engine_ready", threading.Event())
+    monkeypatch.setattr(anchor_app, "boot_stage", "recovering")
+    monkeypatch.setattr(anchor_app.engine, "progress", progress)
+
+    ready = client.get("/api/ready")
+    assert ready.status_code == 503
+    assert ready.json["success"] is False and ready.json["status"] == "recovering"
+    assert ready.json["recovery"]["phase"] == "wal" and ready.json["recovery"]["records"] == 42
+
+    gated = [("get", "/api/view_all"), ("get", "/api/changes"), ("post", "/api/add"), ("post", "/api/batch"),
+             ("post", "/api/sync_peer"), ("post", "/api/compact"), ("get", "/api/profiler")]
+    for method, url in gated:
+        res = getattr(client, method)(url, json={})
+        assert res.status_code == 503, url
+        assert res.headers["Retry-After"] == "1"
+        assert res.json["status"] == "recovering" and res.json["recovery"]["records"] == 42
+    # These don't touch the tree and work throughout.
+    assert client.get("/api/metrics").status_code == 200
+    assert client.post("/api/login", json={"username": "x", "password": "y"}).status_code == 401
+
+    monkeypatch.setattr(anchor_app, "boot_stage", "failed")
+    monkeypatch.setattr(anchor_app, "boot_error", "ValueError: broken store")
+    failed = client.get("/api/ready")
+    assert failed.status_code == 503 and failed.json["error"] == "ValueError: broken store"
+
+    anchor_app.engine_ready.set()
+    monkeypatch.setattr(anchor_app, "boot_stage", "ready")
+    ready = client.get("/api/ready")
+    assert ready.status_code == 200 and ready.json["success"] and ready.json["status"] == "ready"
+    assert client.get("/api/view_all").status_code == 200
+
+
+def test_failed_boot_is_reported_by_ready():
+    data_dir = tempfile.mkdtemp(prefix="anchormed-boot-")
+    with open(os.path.join(data_dir, wal_engine.PAGE_NAME), "wb") as f:
+        f.write(b"not a page file" * 100)
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    proc = subprocess.Popen([sys.executable, os.path.join(root, "app.py"), "--data-dir", data_dir,
+                             "--port", "5096", "--production"],
+                            cwd=root, env={**os.environ, "BTREE_BACKEND": "paged"},
+                            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+                            start_new_session=(os.name != "nt"))
+    try:
+        url, ready = "http://127.0.0.1:5096/api", None
+        deadline = time.time() + 60
+        while time.time() < deadline:
+            try:
+                ready = anchor_app.requests.get(f"{url}/ready", timeout=1)
+                if ready.json()["status"] == "failed":
+                    break
+            except anchor_app.requests.RequestException:
+                pass
+            time.sleep(0.2)
+        assert ready is not None and ready.status_code == 503
+        assert ready.json()["status"] == "failed" and "not an AnchorMed page file" in ready.json()["error"]
+        assert anchor_app.requests.get(f"{url}/view_all", timeout=5).status_code == 503
+    finally:
+        stop_server(proc)
+        shutil.rmtree(data_dir, ignore_errors=True)
+
+
+def crash_server(proc):
+    """Kills the server outright: no shutdown hooks, no final fsync."""
+    if os.name != "nt":
+        os.killpg(proc.pid, signal.SIGKILL)
+    else:
+        proc.kill()
+    proc.wait()
+
+
+def drop_ledger_events(data_dir, count):
+    """Cuts the last 'count' events off the ledger, as a power loss would."""
+    path = os.path.join(data_dir, event_ledger.LEDGER_NAME)
+    with open(path, "rb") as f:
+        data = f.read()
+    ends, pos = [], len(event_ledger.LEDGER_MAGIC) + 1
+    while (decoded := event_ledger._decode_event(data, pos)) is not None:
+        pos = decoded[0]
+        ends.append(pos)
+    with open(path, "r+b") as f:
+        f.truncate(ends[-count - 1])
+
+
+def drop_wal_records(data_dir, count):
+    """Cuts the last 'count' records off the (JSON) WAL."""
+    path = sorted(glob.glob(os.path.join(data_dir, "recovery.*.wal")))[-1]
+    with open(path, "rb") as f:
+        lines = f.readlines()
+    with open(path, "wb") as f:
+        f.writelines(lines[:-count])
+
+
+def test_ledger_reconciles_after_crash():
+    """After a power loss the ledger may lag or lead the WAL; either way the
+    restock/dispense deltas must still add up to the recovered stock."""
+    # (ledger events lost, WAL records lost): the ledger behind, then ahead
+    for ledger_cut, wal_cut in ((2, 1), (1, 2)):
+        data_dir = tempfile.mkdtemp(prefix="anchormed-crash-")
+        try:
+            proc, url = start_server("production", data_dir, 5094)
+            try:
+                for batch_id, qty in (("A", 10), ("B", 5), ("C", 7)):
+                    add(batch_id, "Amox", "2027-01", qty, to=url)
+                for batch_id, qty in (("A", 4), ("B", 9), ("C", 1)):
+                    anchor_app.requests.post(f"{url}/update", json={"batch_id": batch_id, "new_qty": qty},
+                                             timeout=10).raise_for_status()
+            finally:
+                crash_server(proc)
+            drop_ledger_events(data_dir, ledger_cut)
+            drop_wal_records(data_dir, wal_cut)
+
+            proc, url = start_server("production", data_dir, 5094)
+            try:
+                stock = {item["batch_id"]: item["details"]["qty"]
+                         for item in anchor_app.requests.get(f"{url}/view_all", timeout=10).json()["inventory"]}
+                assert stock == {"A": 4, "B": 9 if wal_cut == 1 else 5, "C": 7}, stock
+                history = anchor_app.requests.get(f"{url}/inventory_at", params={"as_of": time.time()},
+                                                  timeout=10).json()["inventory"]
+                assert {item["batch_id"]: item["details"]["qty"] for item in history} == stock, history
+                events = anchor_app.requests.get(f"{url}/history", params={"batch_id": "B"}, timeout=10).json()
+                assert [e["operator"] for e in events["events"]].count("recovery") == 1, events
+            finally:
+                stop_server(proc)
+        finally:
+            shutil.rmtree(data_dir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    for name, test in list(globals().items()):
+        if name.startswith("test_"):
+            test()
+            print(f"✅ {name}")
@@ -0,0 +1,205 @@
+import random
+
+import pytest
+
+from btree_logic import BTree, BTreeNode
+
+
+def check_invariants(tree):
+    """Asserts the B-Tree shape rules and that the counters match the nodes."""
+    t, leaf_depths, nodes, keys = tree.t, set(), [0], []
+
+    def walk(node, depth, low, high):
+        nodes[0] += 1
+        if node is not tree.root:
+            assert t - 1 <= len(node.keys), "node below the minimum"
+        assert len(node.keys) <= 2 * t - 1, "node above the maximum"
+        assert node.keys == sorted(node.keys) and len(node.values) == len(node.keys)
+        assert all((low is None or k > low) and (high is None or k < high) for k in node.keys)
+        if node.leaf:
+            leaf_depths.add(depth)
+            keys.extend(node.keys)
+            return
+        children = [tree._child(node, i) for i in range(len(node.children))]
+        assert len(children) == len(node.keys) + 1
+        bounds = [low] + node.keys + [high]
+        for i, child in enumerate(children):
+            walk(child, depth + 1, bounds[i], bounds[i + 1])
+            if i < len(node.keys):
+                keys.append(node.keys[i])
+
+    walk(tree.root, 1, None, None)
+    assert len(leaf_depths) == 1 and leaf_depths == {tree.height}, "leaves at different depths"
+    assert keys == sorted(set(keys))
+    assert (tree.key_count, tree.node_count) == (len(keys), nodes[0])
+    return keys
+
+
+@pytest.mark.parametrize("n", [0, 1, 4, 5, 6, 100, 1001])
+def test_bulk_load_builds_a_valid_tree(n):
+    tree = BTree(t=3)
+    assert tree.bulk_load((f"K{i:05d}", i) for i in range(n)) == n
+    assert check_invariants(tree) == [f"K{i:05d}" for i in range(n)]
+    assert tree.search("K00000") == (0 if n else None)
+    assert tree.dirty == set()
+
+
+def test_bulk_load_keeps_the_last_value_of_a_repeated_key():
+    tree = BTree(t=3)
+    assert tree.bulk_load([("A", 1), ("B", 2), ("B", 3), ("C", 4), ("C", 5), ("C", 6)]) == 3
+    assert list(tree.iter_items()) == [("A", 1), ("B", 3), ("C", 6)]
+
+
+def test_bulk_load_rejects_unsorted_keys():
+    tree = BTree(t=3)
+    tree.insert("keep", 1)
+    with pytest.raises(ValueError, match="sorted"):
+        tree.bulk_load([("A", 1), ("C", 2), ("B", 3)])
+    assert list(tree.iter_items()) == [("keep", 1)], "a rejected load must leave the tree alone"
+
+
+def test_bulk_load_matches_inserts():
+    rng = random.Random(2)
+    items = sorted({rng.randrange(10 ** 6): rng.random() for _ in range(3000)}.items())
+    loaded, inserted = BTree(t=3), BTree(t=3)
+    loaded.bulk_load(items)
+    for k, v in rng.sample(items, len(items)):
+        inserted.insert(k, v)
+    assert list(loaded.iter_items()) == list(inserted.iter_items()) == items
+    # The loaded tree keeps working as an ordinary tree.
+    for k, _ in items[::3]:
+        assert loaded.delete(k)
+    loaded.insert(-1, "new")
+    check_invariants(loaded)
+
+
+@pytest.mark.parametrize("n", [0, 1, 5, 60, 400])
+def test_cursor_seek_inclusive_and_exclusive(n):
+    tree = BTree(t=3)
+    for i in random.Random(n).sample(range(n), n):
+        tree.insert(i * 2, str(i))  # even keys, so odd probes fall between them
+    keys = [i * 2 for i in range(n)]
+    cursor = tree.cursor()
+    for probe in range(-1, 2 * n + 2):
+        cursor.seek(probe)
+        assert [k for k, _ in cursor] == [k for k in keys if k >= probe], probe
+        cursor.seek(probe, inclusive=False)
+        assert [k for k, _ in cursor] == [k for k in keys if k > probe], probe
+    cursor.seek(None)
+    assert cursor.take(3) == [(k, str(k // 2)) for k in keys[:3]]
+
+
+def test_cursor_resumes_after_the_tree_changes():
+    tree = BTree(t=3)
+    for i in range(100):
+        tree.insert(f"K{i:03d}", i)
+    cursor, seen = tree.cursor(), []
+    while page := cursor.take(7):
+        seen.extend(k for k, _ in page)
+        # Writes between pages split and merge nodes; seek past the last key sent.
+        tree.insert(f"K{len(seen):03d}x", -1)
+        tree.delete(f"K{99 - len(seen):03d}")
+        cursor.seek(page[-1][0], inclusive=False)
+    assert seen == sorted(set(seen))
+    # No key that was there the whole time is skipped.
+    assert {k for k, _ in tree.iter_items() if len(k) == 4} <= set(seen)
+
+
+def test_iter_items_range():
+    tree = BTree(t=3)
+    for i in range(50):
+        tree.insert(i, i)
+    assert [k for k, _ in tree.iter_items(10, 15)] == [10, 11, 12, 13, 14]
+    assert [k for k, _ in tree.iter_items(45)] == [45, 46, 47, 48, 49]
+    assert list(tree.iter_items(20, 20)) == [] and list(tree.iter_items(60)) == []
+
+
+def test_iter_prefix():
+    tree = BTree(t=3)
+    keys = ["AMX-2025-9", "AMX-2026", "AMX-2026-001", "AMX-2026-002", "AMX-20260",
+            "AMX-2027-001", "AMY", "IBU-2026-001", "IBU-2026-002"] + [f"PAR-{i:03d}" for i in range(40)]
+    for k in reversed(keys):
+        tree.insert(k, k.lower())
+    assert [k for k, _ in tree.iter_prefix("AMX-2026-")] == ["AMX-2026-001", "AMX-2026-002"]
+    assert [k for k, _ in tree.iter_prefix("AMX-2026")] == ["AMX-2026", "AMX-2026-001", "AMX-2026-002", "AMX-20260"]
+    assert [k for k, _ in tree.iter_prefix("AM")] == keys[:7]
+    assert [k for k, _ in tree.iter_prefix("PAR-03")] == [f"PAR-{i:03d}" for i in range(30, 40)]
+    assert list(tree.iter_prefix("IBU-2026-001")) == [("IBU-2026-001", "ibu-2026-001")]
+    assert list(tree.iter_prefix("AMX-2028")) == [] and list(tree.iter_prefix("ZZZ")) == []
+    assert [k for k, _ in tree.iter_prefix("")] == sorted(keys)
+
+
+def build(spec, t=2):
+    """A tree of exactly the given shape: a spec is a leaf's key list, or (keys, [child specs])."""
+    tree = BTree(t)
+
+    def make(spec, depth):
+        keys, children = spec if isinstance(spec, tuple) else (spec, [])
+        node = BTreeNode(leaf=not children)
+        node.keys, node.values = list(keys), [k * 10 for k in keys]
+        node.children = [make(child, depth + 1) for child in children]
+        tree.key_count += len(keys)
+        tree.node_count += 1
+        tree.height = max(tree.height, depth)
+        return node
+
+    tree.node_count, tree.height = 0, 1
+    tree.root = make(spec, 1)
+    check_invariants(tree)
+    return tree
+
+
+def shape(tree, node=None):
+    node = tree.root if node is None else node
+    return node.keys if node.leaf else (node.keys, [shape(tree, child) for child in node.children])
+
+
+@pytest.mark.parametrize("spec, key, after", [
+    # Leaf child topped up from its left sibling, then from its right sibling.
+    (([10], [[1, 5], [20]]), 20, ([5], [[1], [10]])),
+    (([10], [[1], [20, 30]]), 1, ([20], [[10], [30]])),
+    # Both siblings minimal: merge, and the emptied root hands over to the merged child.
+    (([10], [[1], [20]]), 1, [10, 20]),
+    (([10, 30], [[1], [20], [40]]), 40, ([10], [[1], [20, 30]])),
+    # Key in an internal node: replaced by its predecessor, its successor, or merged away.
+    (([10], [[1, 5], [20]]), 10, ([5], [[1], [20]])),
+    (([10], [[1], [20, 30]]), 10, ([20], [[1], [30]])),
+    (([10], [[1], [20]]), 10, [1, 20]),
+    # An internal child borrows from its right sibling, taking a subtree along.
+    (([50], [([20], [[10], [30]]), ([70, 90], [[60], [80], [95]])]), 10,
+     ([70], [([50], [[20, 30], [60]]), ([90], [[80], [95]])])),
+    # ...and from its left sibling.
+    (([50], [([20, 40], [[10], [30], [45]]), ([70], [[60], [80]])]), 80,
+     ([40], [([20], [[10], [30]]), ([50], [[45], [60, 70]])])),
+])
+def test_delete_borrows_and_merges(spec, key, after):
+    tree = build(spec)
+    before = set(check_invariants(tree))
+    assert tree.delete(key) is True
+    assert shape(tree) == after
+    assert check_invariants(tree) == sorted(before - {key})
+    assert tree.search(key) is None and tree.dirty == {key}
+
+
+def test_delete_missing_key_changes_nothing():
+    tree = build(([10], [[1], [20]]))
+    assert tree.delete(15) is False and tree.delete(99) is False
+    assert tree.dirty == set() and tree.key_count == 3
+    assert BTree(3).delete("nothing") is False
+
+
+@pytest.mark.parametrize("t", [2, 3, 5])
+def test_random_deletes_keep_the_tree_valid(t):
+    rng = random.Random(t)
+    tree, expected = BTree(t), {}
+    for k in rng.sample(range(5000), 1500):
+        tree.insert(k, -k)
+        expected[k] = -k
+    for n, k in enumerate(rng.sample(range(5000), 2500)):
+        assert tree.delete(k) == (expected.pop(k, None) is not None)
+        if n % 100 == 0:
+            assert check_invariants(tree) == sorted(expected)
+    assert list(tree.iter_items()) == sorted(expected.items())
+    for k in list(expected):
+        tree.delete(k)
+    assert check_invariants(tree) == [] and tree.height == 1
@@ -0,0 +1,167 @@
+import contextlib
+import io
+import json
+import os
+
+import pytest
+
+import wal_engine
+from btree_logic import BTree
+from wal_engine import StorageEngine
+
+
+class Store:
+    """A tree and the engine logging it, written to the way the app does."""
+
+    def __init__(self, data_dir):
+        self.engine = StorageEngine(data_dir)
+        self.tree = BTree(t=3)
+
+    def write(self, changes):
+        self.engine.log_transactions(changes)
+        for k, v in changes:
+            wal_engine._apply(self.tree, k, v)
+
+    def checkpoint(self, full=False):
+        with contextlib.redirect_stdout(io.StringIO()):
+            self.engine.create_checkpoint(self.tree, full=full)
+
+    def deltas(self):
+        return [os.path.basename(path) for _, path in self.engine._list_deltas()]
+
+
+@pytest.fixture
+def store(tmp_path):
+    store = Store(str(tmp_path))
+    store.write([(f"K{i:03d}", {"qty": i}) for i in range(40)])
+    store.checkpoint()
+    yield store
+    store.engine.close()
+
+
+def read_file(path):
+    trailer = {}
+    records = list(wal_engine._read_checkpoint(path, trailer))
+    return records, trailer
+
+
+def recovered(data_dir):
+    tree = BTree(t=3)
+    engine = StorageEngine(data_dir)
+    with contextlib.redirect_stdout(io.StringIO()):
+        engine.recover_tree(tree)
+    engine.close()
+    return dict(tree.iter_items()), engine
+
+
+def test_first_checkpoint_is_a_base(store):
+    records, trailer = read_file(store.engine.checkpoint_file)
+    assert (trailer["kind"], trailer["delta_seq"], trailer["records"]) == ("base", 0, 40)
+    assert records == [(f"K{i:03d}", {"qty": i}) for i in range(40)]
+    assert store.deltas() == [] and store.engine.wal_segments() == []
+
+
+def test_delta_holds_only_the_changed_keys(store):
+    store.write([("K005", {"qty": 500}), ("K010", None), ("NEW", {"qty": 1})])
+    store.checkpoint()
+    assert store.deltas() == ["checkpoint.delta.000001.json"]
+    records, trailer = read_file(store.engine._delta_path(1))
+    # Sorted by key; the deleted batch is a tombstone.
+    assert records == [("K005", {"qty": 500}), ("K010", None), ("NEW", {"qty": 1})]
+    assert (trailer["kind"], trailer["delta_seq"]) == ("delta", 1)
+    # The base is left alone.
+    assert read_file(store.engine.checkpoint_file)[1]["records"] == 40
+
+    store.checkpoint()  # Nothing changed: no new delta
+    assert store.deltas() == ["checkpoint.delta.000001.json"]
+
+
+def test_long_chain_compacts_into_a_new_base(store):
+    for i in range(wal_engine.DELTA_MAX_CHAIN):
+        store.write([(f"K{i:03d}", {"qty": -i})])
+        store.checkpoint()
+    assert len(store.deltas()) == wal_engine.DELTA_MAX_CHAIN
+
+    store.write([("K039", None)])
+    store.checkpoint()
+    assert store.deltas() == []
+    records, trailer = read_file(store.engine.checkpoint_file)
+    assert (trailer["kind"], trailer["delta_seq"]) == ("base", wal_engine.DELTA_MAX_CHAIN)
+    assert dict(records) == dict(store.tree.iter_items())
+
+    # The chain starts over, numbered after the compacted deltas.
+    store.write([("K000", {"qty": 0})])
+    store.checkpoint()
+    assert store.deltas() == [f"checkpoint.delta.{wal_engine.DELTA_MAX_CHAIN + 1:06d}.json"]
+
+
+def test_large_change_ratio_writes_a_base(store):
+    limit = int(wal_engine.DELTA_MAX_RATIO * 40)
+    store.write([(f"K{i:03d}", {"qty": 0}) for i in range(limit)])
+    store.checkpoint()
+    assert store.deltas() == ["checkpoint.delta.000001.json"]
+
+    store.write([(f"K{i:03d}", {"qty": 1}) for i in range(limit + 1)])
+    store.checkpoint()
+    assert store.deltas() == []
+    assert read_file(store.engine.checkpoint_file)[1]["kind"] == "base"
+
+
+def test_full_forces_a_base(store):
+    store.write([("K001", {"qty": 100})])
+    store.checkpoint()
+    store.write([("K002", {"qty": 200})])
+    store.checkpoint(full=True)
+    assert store.deltas() == []
+    assert dict(read_file(store.engine.checkpoint_file)[0])["K002"] == {"qty": 200}
+
+
+def test_recovery_layers_deltas_and_the_wal_on_the_base(store):
+    store.write([("K001", None), ("K002", {"qty": 200}), ("A", {"qty": 1})])
+    store.checkpoint()
+    store.write([("K002", None), ("K001", {"qty": 100}), ("A", {"qty": 2})])
+    store.checkpoint()
+    store.write([("K003", None), ("B", {"qty": 3})])  # only in the WAL
+    assert len(store.deltas()) == 2 and store.engine.wal_segments()
+
+    expected = dict(store.tree.iter_items())
+    state, engine = recovered(store.engine.data_dir)
+    assert state == expected
+    assert (engine._delta_seq, engine._delta_chain, engine._base_records) == (2, 2, 40)
+
+
+def test_recovery_skips_deltas_already_in_the_base(store):
+    store.write([("K001", {"qty": 100})])
+    store.checkpoint()
+    stale = read_file(store.engine._delta_path(1))
+    store.write([("K001", None)])
+    store.checkpoint(full=True)
+    # A crash between writing the base and removing the old deltas leaves them behind.
+    with open(store.engine._delta_path(1), "w") as f:
+        for k, v in stale[0]:
+            f.write(json.dumps({"batch_id": k, "details": v}) + "\n")
+        f.write(json.dumps({"checkpoint": stale[1]}) + "\n")
+
+    state, _ = recovered(store.engine.data_dir)
+    assert "K001" not in state and state == dict(store.tree.iter_items())
+
+
+def test_damaged_delta_forces_the_next_checkpoint_to_a_base(store):
+    store.write([("K001", {"qty": 100})])
+    store.checkpoint()
+    path = store.engine._delta_path(1)
+    with open(path) as f:
+        lines = f.readlines()
+    with open(path, "w") as f:
+        f.writelines(lines[:-1])  # trailer lost
+
+    tree = BTree(t=3)
+    engine = StorageEngine(store.engine.data_dir)
+    with contextlib.redirect_stdout(io.StringIO()):
+        engine.recover_tree(tree)
+        assert engine._delta_seq is None
+        tree.insert("K002", {"qty": 2})
+        engine.create_checkpoint(tree)
+    engine.close()
+    assert store.deltas() == []
+    assert dict(read_file(store.engine.checkpoint_file)[0])["K001"] == {"qty": 100}
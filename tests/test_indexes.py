@@ -0,0 +1,119 @@
+import random
+
+from btree_logic import BTree
+from indexes import ExpiryIndex, NameIndex
+
+
+def inventory(records):
+    tree = BTree(t=3)
+    for batch_id, details in records.items():
+        tree.insert(batch_id, details)
+    return tree
+
+
+EXPIRIES = {
+    "A1": {"expiry": "2026-09"}, "A2": {"expiry": "2026-10"}, "B1": {"expiry": "2026-10"},
+    "A3": {"expiry": "2026-11"}, "C1": {"expiry": "2026-12"}, "C2": {"expiry": "2026-12-31"},
+    "D1": {"expiry": "2027-01"}, "D2": {"expiry": "2028-06"},
+    "X1": {"qty": 4}, "X2": {"expiry": ""}, "X3": {"expiry": 202701}, "X4": "not a dict",
+}
+
+
+def test_expiry_range_is_inclusive_and_ordered():
+    index = ExpiryIndex()
+    assert index.rebuild(inventory(EXPIRIES)) == 8  # batches without a usable expiry are left out
+    assert list(index.range("2026-10", "2026-11")) == [("2026-10", "A2"), ("2026-10", "B1"), ("2026-11", "A3")]
+    # An 'end' month admits full dates inside it, but nothing after it.
+    assert [b for _, b in index.range("2026-12", "2026-12")] == ["C1", "C2"]
+    assert [b for _, b in index.range(None, "2026-10")] == ["A1", "A2", "B1"]
+    assert [b for _, b in index.range("2027")] == ["D1", "D2"]
+    assert [b for _, b in index.range()] == ["A1", "A2", "B1", "A3", "C1", "C2", "D1", "D2"]
+    assert list(index.range("2026-11", "2026-10")) == [] and list(index.range("2029")) == []
+
+
+def test_expiry_index_follows_writes():
+    index = ExpiryIndex()
+    index.rebuild(inventory(EXPIRIES))
+    index.update("A2", EXPIRIES["A2"], {"expiry": "2027-01"})  # moved
+    index.update("B1", EXPIRIES["B1"], None)  # deleted
+    index.update("N1", None, {"expiry": "2026-10"})  # new
+    index.update("X1", EXPIRIES["X1"], {"expiry": "2026-10", "qty": 4})  # gained an expiry
+    index.update("C1", EXPIRIES["C1"], {"qty": 0})  # lost it
+    index.update("D1", EXPIRIES["D1"], {"expiry": "2027-01", "qty": 9})  # unchanged expiry
+    assert list(index.range("2026-10", "2027-01")) == [
+        ("2026-10", "N1"), ("2026-10", "X1"), ("2026-11", "A3"), ("2026-12-31", "C2"),
+        ("2027-01", "A2"), ("2027-01", "D1"),
+    ]
+
+
+def test_expiry_index_matches_a_rebuild_after_random_writes():
+    rng = random.Random(12)
+    records, index = {}, ExpiryIndex()
+    for _ in range(2000):
+        batch_id = f"R{rng.randrange(150):03d}"
+        new = None if rng.random() < 0.2 else {"expiry": f"20{rng.randrange(26, 29)}-{rng.randrange(1, 13):02d}"}
+        index.update(batch_id, records.get(batch_id), new)
+        if new is None:
+            records.pop(batch_id, None)
+        else:
+            records[batch_id] = new
+    fresh = ExpiryIndex()
+    fresh.rebuild(inventory(records))
+    assert list(index.range()) == list(fresh.range()) == sorted((d["expiry"], b) for b, d in records.items())
+    assert list(index.range("2027-03", "2027-08")) == list(fresh.range("2027-03", "2027-08"))
+
+
+def stock(index, name):
+    found = index.get(name)
+    return None if found is None else (found.name, found.qty, sorted(found.batches))
+
+
+def test_names_are_folded():
+    index = NameIndex()
+    assert index.rebuild(inventory({
+        "B1": {"name": "Amoxicillin", "qty": 10},
+        "B2": {"name": "  AMOXICILLIN ", "qty": 5},
+        "B3": {"name": "amoxicillin", "qty": "7"},
+        "B4": {"name": "Straße Syrup", "qty": 1},
+        "B5": {"name": "   ", "qty": 3}, "B6": {"qty": 3}, "B7": {"name": "Zinc", "qty": "n/a"},
+    })) == 3
+    # Display name as first seen (in batch order); quantities summed, bad ones as 0.
+    assert stock(index, "amoxicillin") == ("Amoxicillin", 22, ["B1", "B2", "B3"])
+    assert stock(index, " AmOxIcIlLiN") == stock(index, "amoxicillin")
+    assert stock(index, "STRASSE SYRUP") == ("Straße Syrup", 1, ["B4"])
+    assert stock(index, "zinc") == ("Zinc", 0, ["B7"])
+    assert index.get("amox") is None and index.get("") is None
+
+
+def test_name_totals_follow_writes():
+    index = NameIndex()
+    index.rebuild(inventory({"B1": {"name": "Amoxicillin", "qty": 10}, "B2": {"name": "Ibuprofen", "qty": 4}}))
+    index.update("B3", None, {"name": "amoxicillin", "qty": 6})
+    index.update("B1", {"name": "Amoxicillin", "qty": 10}, {"name": "Amoxicillin", "qty": 2})
+    assert stock(index, "Amoxicillin") == ("Amoxicillin", 8, ["B1", "B3"])
+
+    # Renaming the last batch of a medicine moves it and drops the old name.
+    index.update("B2", {"name": "Ibuprofen", "qty": 4}, {"name": "Paracetamol", "qty": 4})
+    assert index.get("ibuprofen") is None and stock(index, "paracetamol") == ("Paracetamol", 4, ["B2"])
+    # A change of case only keeps the stock (and its display name).
+    index.update("B2", {"name": "Paracetamol", "qty": 4}, {"name": "PARACETAMOL", "qty": 5})
+    assert stock(index, "paracetamol") == ("Paracetamol", 5, ["B2"])
+
+    index.update("B1", {"name": "Amoxicillin", "qty": 2}, None)
+    index.update("B3", {"name": "amoxicillin", "qty": 6}, None)
+    assert index.get("amoxicillin") is None and index.prefix("a") == []
+    # A stale old version (batch not filed under that name) changes nothing.
+    index.update("B9", {"name": "Paracetamol", "qty": 50}, None)
+    assert stock(index, "paracetamol") == ("Paracetamol", 5, ["B2"])
+
+
+def test_name_prefix_search():
+    index = NameIndex()
+    names = ["Paracetamol", "paracetamol 500", "Paroxetine", "Pantoprazole", "Amoxicillin", "Prednisolone"]
+    index.rebuild(inventory({f"B{i}": {"name": name, "qty": i} for i, name in enumerate(names)}))
+    assert [s.name for s in index.prefix("par")] == ["Paracetamol", "paracetamol 500", "Paroxetine"]
+    assert [s.name for s in index.prefix(" PARA")] == ["Paracetamol", "paracetamol 500"]
+    assert [s.name for s in index.prefix("p", limit=2)] == ["Pantoprazole", "Paracetamol"]
+    assert [s.name for s in index.prefix("")] == sorted(names, key=str.casefold)
+    assert index.prefix("q") == [] and index.prefix("paracetamol 5000") == []
+    assert index.prefix("amox")[0].to_dict() == {"name": "Amoxicillin", "qty": 4, "batches": ["B4"]}
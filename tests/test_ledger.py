@@ -0,0 +1,122 @@
+import contextlib
+import io
+import os
+
+import pytest
+
+import ledger
+from ledger import EventLedger
+
+
+class Clock:
+    """Stands in for time.time() in ledger.py, moved forward by hand."""
+
+    def __init__(self, now=19676 * 86400 + 3600.0):  # 01:00 UTC
+        self.now = now
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    fake = Clock()
+    monkeypatch.setattr(ledger.time, "time", fake)
+    return fake
+
+
+def open_ledger(data_dir):
+    events = EventLedger(str(data_dir))
+    with contextlib.redirect_stdout(io.StringIO()):
+        events.open()
+    return events
+
+
+def run(events, clock, steps, step_seconds, sizes=None):
+    """Dispenses one unit and snapshots at each step; returns {ts: qty} as recorded
+    (and appends the snapshot file's size after each step to 'sizes')."""
+    details = {"name": "Amoxicillin", "expiry": "2030-01-01", "qty": 10_000}
+    events.record("B1", None, details, "tester")
+    seen = {}
+    for _ in range(steps):
+        clock.now += step_seconds
+        new = dict(details, qty=details["qty"] - 1)
+        events.record("B1", details, new, "tester")
+        details = new
+        with contextlib.redirect_stdout(io.StringIO()):
+            events.snapshot([("B1", details)])
+        seen[clock.now] = details["qty"]
+        if sizes is not None:
+            sizes.append(os.path.getsize(events.snapshot_path))
+    return seen
+
+
+def test_snapshot_file_stays_bounded(tmp_path, clock):
+    events = open_ledger(tmp_path)
+    sizes = []
+    seen = run(events, clock, 500, 60, sizes)
+    positions = [pos for _, _, pos in events._snapshots]
+    frame = max(b - a for a, b in zip(positions, positions[1:]))
+
+    # 500 snapshots in one day: the first, then at most the latest few plus
+    # the ones a rewrite waits to drop in bulk.
+    assert events.stats()["snapshots"] < 2 * ledger.SNAPSHOT_KEEP_RECENT + 1
+    assert max(sizes) <= 6 + (2 * ledger.SNAPSHOT_KEEP_RECENT + 1) * frame
+    assert not os.path.exists(events.snapshot_path + ".tmp")
+
+    # Every past state is still reachable, thinned snapshot or not.
+    for ts in list(seen)[::37] + [max(seen)]:
+        assert events.state_at(ts, "B1")["B1"]["qty"] == seen[ts]
+        assert events.state_at(ts)["B1"]["qty"] == seen[ts]
+
+
+def test_thinning_keeps_one_snapshot_per_day_then_per_week(tmp_path, clock):
+    events = open_ledger(tmp_path)
+    seen = run(events, clock, 400, 6 * 3600)  # 100 days, 4 snapshots a day
+
+    kept = events._snapshots
+    thinned = ledger._snapshots_to_keep(kept)
+    assert len(kept) - len(thinned) < ledger.SNAPSHOT_KEEP_RECENT
+    days = [int(ts // 86400) for ts, _, _ in thinned]
+    older = days[1:-ledger.SNAPSHOT_KEEP_RECENT]
+    daily = [day for day in older if days[-1] - day < ledger.SNAPSHOT_KEEP_DAYS]
+    weekly = [day // 7 for day in older if days[-1] - day > ledger.SNAPSHOT_KEEP_DAYS]
+    assert daily and weekly
+    assert len(daily) == len(set(daily))
+    assert len(weekly) == len(set(weekly))
+    assert len(kept) < 1 + 2 * ledger.SNAPSHOT_KEEP_RECENT + ledger.SNAPSHOT_KEEP_DAYS + 100 // 7 + 2
+
+    # The first snapshot survives, so history still starts where it did.
+    first = min(seen)
+    assert kept[0][0] == first
+    assert events.state_at(first, "B1")["B1"]["qty"] == seen[first]
+    with pytest.raises(ValueError):
+        events.state_at(first - 1)
+
+    # The rewritten file scans back to the same snapshots.
+    events.close()
+    reopened = open_ledger(tmp_path)
+    assert reopened._snapshots == kept
+    for ts in list(seen)[::23]:
+        assert reopened.state_at(ts)["B1"]["qty"] == seen[ts]
+
+
+def test_interrupted_rewrite_is_discarded(tmp_path, clock):
+    events = open_ledger(tmp_path)
+    seen = run(events, clock, 5, 60)
+    events.close()
+    with open(events.snapshot_path + ".tmp", "wb") as f:
+        f.write(b"half a rewrite")
+
+    reopened = open_ledger(tmp_path)
+    assert not os.path.exists(reopened.snapshot_path + ".tmp")
+    assert len(reopened._snapshots) == 5
+    assert reopened.state_at(max(seen))["B1"]["qty"] == seen[max(seen)]
+
+
+def test_stale_snapshot_position_is_detected(tmp_path, clock):
+    events = open_ledger(tmp_path)
+    run(events, clock, 3, 60)
+    ts, offset, pos = events._snapshots[1]
+    assert events._load_snapshot(pos, (ts, offset)) is not None
+    assert events._load_snapshot(pos, (ts + 1, offset)) is None
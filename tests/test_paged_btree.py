@@ -0,0 +1,110 @@
+import contextlib
+import io
+import os
+
+import pytest
+
+from paged_btree import PagedBTree, PageFile
+from test_btree import check_invariants
+
+
+def open_tree(path, **kwargs):
+    with contextlib.redirect_stdout(io.StringIO()):
+        return PagedBTree(str(path), 3, **kwargs)
+
+
+def committed_tree(path, n=300):
+    """A page file holding K0000..K<n-1>, flushed and reopened with a small cache."""
+    tree = open_tree(path, cache_pages=8)
+    for i in range(n):
+        tree.insert(f"K{i:04d}", {"qty": i})
+    tree.flush()
+    tree.close()
+    return {f"K{i:04d}": {"qty": i} for i in range(n)}
+
+
+def churn(tree):
+    """Rewrites, deletes and adds enough keys that evictions overwrite committed pages."""
+    for i in range(0, 300, 2):
+        tree.delete(f"K{i:04d}")
+    for i in range(300, 600):
+        tree.insert(f"K{i:04d}", {"qty": -i})
+
+
+def reopened(path):
+    tree = open_tree(path)
+    items = dict(tree.iter_items())
+    check_invariants(tree)
+    tree.close()
+    return items
+
+
+def test_flush_then_reopen(tmp_path):
+    path = tmp_path / "store.pages"
+    expected = committed_tree(path)
+    tree = open_tree(path, cache_pages=8)
+    assert not tree.fresh and tree.key_count == 300
+    churn(tree)
+    tree.flush()
+    expected = dict(tree.iter_items())
+    tree.close()
+    assert not os.path.exists(f"{path}-journal")
+    assert reopened(path) == expected
+
+
+def test_unflushed_changes_roll_back(tmp_path):
+    path = tmp_path / "store.pages"
+    expected = committed_tree(path)
+    size = os.path.getsize(path)
+    tree = open_tree(path, cache_pages=8)
+    churn(tree)
+    assert os.path.exists(f"{path}-journal"), "evictions should have journaled committed pages"
+    tree.close()  # a crash: no flush
+
+    assert reopened(path) == expected
+    assert not os.path.exists(f"{path}-journal")
+    assert os.path.getsize(path) == size, "pages added after the commit are cut off"
+
+
+def test_crash_inside_the_commit_rolls_back(tmp_path, monkeypatch):
+    path = tmp_path / "store.pages"
+    expected = committed_tree(path)
+    tree = open_tree(path, cache_pages=1000)
+    churn(tree)
+
+    def crash(self):
+        raise OSError("power cut")
+
+    # Every dirty page is written, then the header write fails.
+    monkeypatch.setattr(PageFile, "_write_header", crash)
+    with pytest.raises(OSError):
+        tree.flush()
+    monkeypatch.undo()
+    tree.close()
+    assert reopened(path) == expected
+
+
+def test_torn_journal_tail_is_ignored(tmp_path):
+    path = tmp_path / "store.pages"
+    expected = committed_tree(path)
+    tree = open_tree(path, cache_pages=8)
+    churn(tree)
+    tree.close()
+    # The last entry was torn mid-append, so its page write never happened either.
+    with open(f"{path}-journal", "ab") as j:
+        j.write(b"\x05\x00\x00\x00" + b"\xff" * 100)
+    assert reopened(path) == expected
+
+
+def test_never_committed_file_rolls_back_to_empty(tmp_path):
+    path = tmp_path / "store.pages"
+    tree = open_tree(path, cache_pages=8)
+    for i in range(200):
+        tree.insert(f"N{i:04d}", i)
+    tree.close()
+    tree = open_tree(path)
+    assert tree.fresh and list(tree.iter_items()) == []
+    tree.insert("A", 1)
+    tree.flush()
+    tree.close()
+    assert reopened(path) == {"A": 1}
@@ -0,0 +1,91 @@
+import threading
+import time
+
+import pytest
+
+from rwlock import ReadWriteLock
+
+
+def run(target):
+    """Starts 'target' in a thread and returns an Event set once it returns."""
+    done = threading.Event()
+
+    def body():
+        target()
+        done.set()
+
+    threading.Thread(target=body, daemon=True).start()
+    return done
+
+
+def write_once(lock):
+    with lock.write:
+        pass
+
+
+def test_reads_share_and_writes_wait_for_them():
+    lock = ReadWriteLock()
+    with lock.read:
+        assert run(lambda: lock.read.__enter__() or lock.read.__exit__()).wait(2)
+        writer = run(lambda: write_once(lock))
+        assert not writer.wait(0.1)
+    assert writer.wait(2)
+    assert lock._readers == 0
+
+
+def test_waiting_writer_goes_before_new_readers():
+    lock, order = ReadWriteLock(), []
+    lock.acquire_read()
+    writer = run(lambda: (write_once(lock), order.append("write")))
+    while not lock._writers_waiting:
+        time.sleep(0.001)
+    reader = run(lambda: (lock.read.__enter__(), order.append("read"), lock.read.__exit__()))
+    with lock.read:  # nested: doesn't queue behind the writer
+        pass
+    lock.release_read()
+    assert writer.wait(2) and reader.wait(2)
+    assert order == ["write", "read"]
+
+
+def test_reentrant_sides_and_no_upgrade():
+    lock = ReadWriteLock()
+    with lock.write:
+        with lock.write:
+            with lock.read:
+                assert lock._readers == 0
+        assert not run(lambda: write_once(lock)).wait(0.1), "still held by the outer write"
+    with lock.read:
+        with lock.read:
+            with pytest.raises(RuntimeError):
+                lock.acquire_write()
+    assert lock._readers == 0
+
+
+def test_downgrade_keeps_read_access_and_balances():
+    lock = ReadWriteLock()
+    lock.acquire_write()
+    lock.acquire_read()
+    lock.release_write()  # still reading
+    assert lock._readers == 1
+    writer = run(lambda: write_once(lock))
+    assert not writer.wait(0.1), "a writer got in while the downgraded read was held"
+    lock.release_read()
+    assert writer.wait(2)
+    assert lock._readers == 0
+    with lock.read:
+        assert lock._readers == 1
+    assert lock._readers == 0
+
+
+def test_write_released_by_another_thread_raises():
+    lock, errors = ReadWriteLock(), []
+
+    def release():
+        try:
+            lock.release_write()
+        except RuntimeError as e:
+            errors.append(e)
+
+    with lock.write:
+        assert run(release).wait(2)
+    assert len(errors) == 1
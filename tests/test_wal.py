@@ -0,0 +1,287 @@
+import contextlib
+import io
+import json
+import os
+import threading
+import time
+
+import pytest
+
+import wal_engine
+from btree_logic import BTree
+from wal_engine import StorageEngine
+
+
+def quiet():
+    """The engine logs every step with print()."""
+    return contextlib.redirect_stdout(io.StringIO())
+
+
+def recovered(data_dir, **kwargs):
+    with quiet():
+        engine = StorageEngine(data_dir, **kwargs)
+        tree = BTree(t=3)
+        engine.recover_tree(tree)
+        engine.close()
+    return dict(tree.iter_items())
+
+
+def test_group_commit_makes_every_concurrent_write_durable(tmp_path):
+    with quiet():
+        engine = StorageEngine(str(tmp_path))
+        engine.enable_group_commit()
+    fsyncs = []
+    write_records = engine._write_records
+    engine._write_records = lambda f, records: (fsyncs.append(len(records)), write_records(f, records))
+
+    def writer(w):
+        for i in range(50):
+            engine.log_transaction(f"W{w}-{i:03d}", {"qty": i})
+
+    with quiet():
+        pool = [threading.Thread(target=writer, args=(w,)) for w in range(8)]
+        for th in pool:
+            th.start()
+        for th in pool:
+            th.join()
+        engine.disable_group_commit()
+        engine.close()
+    assert sum(fsyncs) == 400
+    assert recovered(str(tmp_path)) == {f"W{w}-{i:03d}": {"qty": i} for w in range(8) for i in range(50)}
+
+
+def test_group_commit_flushes_a_lone_writer_at_once(tmp_path):
+    """A single writer leads its own commit: it never waits for a window to pass."""
+    with quiet():
+        engine = StorageEngine(str(tmp_path))
+        engine.enable_group_commit(window_ms=10_000)
+        started = time.perf_counter()
+        for i in range(3):
+            engine.log_transaction(f"K{i}", {"qty": i})
+        commit = engine.submit_transactions([("K0", None), ("K1", {"qty": 9})])
+        commit.wait()
+        assert time.perf_counter() - started < 5
+        engine.disable_group_commit()
+        engine.close()
+    assert recovered(str(tmp_path)) == {"K1": {"qty": 9}, "K2": {"qty": 2}}
+
+
+def test_group_commit_close_flushes_queued_records(tmp_path):
+    with quiet():
+        engine = StorageEngine(str(tmp_path))
+        engine.enable_group_commit()
+        commit = engine.submit_transactions([("Q", {"qty": 1})])
+        engine.disable_group_commit()
+        assert commit.done.is_set()
+        commit.wait()
+        engine.close()
+    assert recovered(str(tmp_path)) == {"Q": {"qty": 1}}
+
+
+def segment_frames(data_dir, number=1):
+    """The (seq, record type, payload) of every intact frame in a binary segment."""
+    with open(os.path.join(data_dir, f"recovery.{number:06d}.wal"), "rb") as f:
+        data = f.read()
+    assert data.startswith(wal_engine.WAL_MAGIC)
+    return [(seq, rec_type, payload) for _end, seq, rec_type, payload
+            in wal_engine._iter_binary_frames(data[len(wal_engine._WAL_HEADER):])]
+
+
+def write_all(data_dir, batches, wal_format="binary", **kwargs):
+    """Logs each batch as one frame and returns the state they add up to."""
+    expected = {}
+    with quiet():
+        engine = StorageEngine(data_dir, wal_format, **kwargs)
+        for batch in batches:
+            engine.submit_transactions(batch).wait()
+            for k, v in batch:
+                if v is None:
+                    expected.pop(k, None)
+                else:
+                    expected[k] = v
+        engine.close()
+    return expected
+
+
+VALUES = [
+    {"name": "Amoxicillin 250mg", "expiry": "2027-01", "qty": 40},
+    {"name": "Amoxicillin 250mg", "expiry": "2027-01", "qty": 0, "emptied_at": 1_760_000_000},
+    {"qty": -3},
+    {"name": "", "expiry": ""},
+    {},
+    {"name": None, "expiry": "2027-02", "qty": 1},
+    {"name": "Ünïcødé ✓", "qty": 2 ** 31 - 1},
+    {"qty": 2 ** 40},
+    {"qty": True},
+    {"name": "x", "supplier": {"id": 7}},
+    "a plain string",
+    [1, 2, 3],
+]
+
+
+def test_packed_records_round_trip(tmp_path):
+    batches = [[(f"B{i:03d}", value)] for i, value in enumerate(VALUES)]
+    batches += [[(f"B{i:03d}", None)] for i in range(0, len(VALUES), 3)]
+    batches.append([(f"C{i:03d}", value) for i, value in enumerate(VALUES)] + [("B001", None)])
+    expected = write_all(str(tmp_path), batches)
+    assert recovered(str(tmp_path)) == expected
+    # Every record fits the packed layout: no frame fell back to JSON.
+    assert not any(rec_type & wal_engine.REC_FLAG_JSON for _, rec_type, _ in segment_frames(str(tmp_path)))
+
+    # Appending after a reopen resolves against the string table rebuilt from the file.
+    expected.update(write_all(str(tmp_path), [[("B000", {"name": "Amoxicillin 250mg", "qty": 5})],
+                                              [("D000", {"name": "Ünïcødé ✓", "expiry": "2027-01"})]]))
+    assert recovered(str(tmp_path)) == expected
+
+
+def test_unpackable_records_fall_back_to_json(tmp_path):
+    batches = [
+        [("NUL\0KEY", {"qty": 1})],
+        [("K1", {"name": "nul\0name", "qty": 2})],
+        [("K2", {"qty": 1}), ("K2", None), ("K3", {"qty": 3}), ("K3", {"qty": 4})],  # a key twice
+        [("K4", {"name": "after the fallbacks", "qty": 5})],
+    ]
+    expected = write_all(str(tmp_path), batches)
+    flags = [rec_type & wal_engine.REC_FLAG_JSON for _, rec_type, _ in segment_frames(str(tmp_path))]
+    assert [bool(f) for f in flags] == [True, True, True, False]
+    assert recovered(str(tmp_path)) == expected
+
+    # Keys the tree can't mix with strings still replay from the segment.
+    write_all(str(tmp_path / "ints"), [[(7, {"qty": 3}), ("k", None)], [("k", {"qty": 1})]])
+    changes, records, _, _ = wal_engine._decode_segment(str(tmp_path / "ints" / "recovery.000001.wal"))
+    assert (changes, records) == ({7: {"qty": 3}, "k": {"qty": 1}}, 3)
+
+
+def test_wide_string_ids(tmp_path):
+    # 3 new strings per record: the table passes 65535 entries partway through.
+    batches = [[(f"W{i:06d}", {"name": f"n{i}", "expiry": f"e{i}", "qty": i,
+                               **({"emptied_at": i} if i % 7 == 0 else {})}) for i in range(j, j + 1000)]
+               for j in range(0, 24_000, 1000)]
+    batches += [[(f"W{i:06d}", None) for i in range(0, 24_000, 97)], [("W000001", {"qty": -1})]]
+    expected = write_all(str(tmp_path), batches)
+    wide = [bool(rec_type & wal_engine.REC_FLAG_WIDE) for _, rec_type, _ in segment_frames(str(tmp_path))]
+    assert wide[0] is False and wide[-1] is True
+    assert recovered(str(tmp_path)) == expected
+
+
+def test_large_frames_are_compressed(tmp_path):
+    batch = [(f"Z{i:05d}", {"name": "Paracetamol 500mg", "expiry": "2027-03", "qty": i}) for i in range(300)]
+    expected = write_all(str(tmp_path), [batch, [("Z00001", None)]])
+    (_, first, payload), (_, last, _) = segment_frames(str(tmp_path))
+    assert first & wal_engine.REC_FLAG_ZLIB and not last & wal_engine.REC_FLAG_ZLIB
+    assert first & ~wal_engine.REC_FLAG_ZLIB == wal_engine.REC_BATCH
+    assert recovered(str(tmp_path)) == expected
+
+
+def test_truncated_packed_tail_drops_only_the_torn_frame(tmp_path):
+    batches = [[(f"T{i}", {"name": f"n{i % 3}", "qty": i})] for i in range(6)]
+    source = tmp_path / "source"
+    write_all(str(source), batches)
+    path = source / "recovery.000001.wal"
+    data = path.read_bytes()
+    last_frame = len(data) - len(segment_frames(str(source))[-1][2]) - wal_engine._FRAME_HEADER.size
+    for cut in range(last_frame, len(data)):
+        data_dir = tmp_path / f"cut{cut}"
+        data_dir.mkdir()
+        (data_dir / "recovery.000001.wal").write_bytes(data[:cut])
+        assert recovered(str(data_dir)) == {f"T{i}": {"name": f"n{i % 3}", "qty": i} for i in range(5)}, cut
+
+
+def test_version_1_segments_still_replay(tmp_path):
+    frames = [wal_engine._encode_frame(1, wal_engine.REC_PUT, json.dumps(["V1", {"qty": 1}]).encode()),
+              wal_engine._encode_frame(2, wal_engine.REC_BATCH, json.dumps([["V2", {"qty": 2}], ["V1", None]]).encode())]
+    (tmp_path / "recovery.000001.wal").write_bytes(wal_engine.WAL_MAGIC + bytes([1]) + b"".join(frames))
+    assert recovered(str(tmp_path)) == {"V2": {"qty": 2}}
+    # Appends to a version 1 segment stay in its format.
+    write_all(str(tmp_path), [[("V3", {"qty": 3})]])
+    assert json.loads(segment_frames(str(tmp_path))[-1][2]) == ["V3", {"qty": 3}]
+    assert recovered(str(tmp_path)) == {"V2": {"qty": 2}, "V3": {"qty": 3}}
+
+
+@pytest.mark.parametrize("wal_format", ["json", "binary"])
+def test_appends_without_recovery_never_follow_a_torn_tail(tmp_path, wal_format):
+    write_all(str(tmp_path), [[(f"K{i}", {"qty": i})] for i in range(3)], wal_format)
+    path = tmp_path / "recovery.000001.wal"
+    path.write_bytes(path.read_bytes()[:-3])  # a crash tore K2
+    # A fresh engine appends straight away, without a recover_tree() first.
+    write_all(str(tmp_path), [[("AFTER", {"qty": 9})]], wal_format)
+    assert recovered(str(tmp_path)) == {"K0": {"qty": 0}, "K1": {"qty": 1}, "AFTER": {"qty": 9}}
+
+
+def segment_numbers(engine):
+    return [number for number, _ in engine.wal_segments()]
+
+
+@pytest.mark.parametrize("wal_format", ["json", "binary"])
+def test_segments_roll_at_the_size_limit(tmp_path, wal_format):
+    with quiet():
+        engine = StorageEngine(str(tmp_path), wal_format, segment_bytes=300)
+        for i in range(40):
+            engine.log_transaction(f"S{i:02d}", {"name": "Zinc", "qty": i})
+        segments = engine.wal_segments()
+        engine.close()
+    assert [number for number, _ in segments] == list(range(1, len(segments) + 1)) and len(segments) > 3
+    for _, path in segments[:-1]:
+        assert os.path.getsize(path) >= 300  # sealed only once full...
+        with open(path, "rb") as f:
+            data = f.read()
+        # ...and each one stands alone: its own header, whole records only.
+        assert data.startswith(wal_engine.WAL_MAGIC) if wal_format == "binary" else data.endswith(b"\n")
+    assert recovered(str(tmp_path), segment_bytes=300) == {f"S{i:02d}": {"name": "Zinc", "qty": i} for i in range(40)}
+
+
+def test_checkpoint_drops_only_the_covered_segments(tmp_path):
+    with quiet():
+        engine = StorageEngine(str(tmp_path), "binary", segment_bytes=300)
+        tree = BTree(t=3)
+        engine.recover_tree(tree)
+        for i in range(20):
+            engine.log_transaction(f"A{i:02d}", {"qty": i})
+            tree.insert(f"A{i:02d}", {"qty": i})
+        assert len(engine.wal_segments()) > 1 and engine.wal_stats()["records"] == 20
+
+        engine.create_checkpoint(tree)
+        assert engine.wal_segments() == []
+        assert (engine.wal_stats()["bytes"], engine.wal_stats()["records"]) == (0, 0)
+
+        # Written after the seal but before the drop: a newer segment, kept.
+        covered, records = engine._seal_wal()
+        engine.log_transaction("LATE", {"qty": 1})
+        engine._drop_segments(covered, records)
+        assert segment_numbers(engine) == [covered + 1]
+        assert engine.wal_stats()["records"] == 1
+        engine.close()
+    assert recovered(str(tmp_path)) == {**{f"A{i:02d}": {"qty": i} for i in range(20)}, "LATE": {"qty": 1}}
+
+
+def test_segments_left_by_an_interrupted_checkpoint_replay_harmlessly(tmp_path, monkeypatch):
+    with quiet():
+        engine = StorageEngine(str(tmp_path), segment_bytes=200)
+        tree = BTree(t=3)
+        for i in range(15):
+            engine.log_transaction(f"I{i:02d}", {"qty": i})
+            tree.insert(f"I{i:02d}", {"qty": i})
+        engine.log_transaction("I00", None)
+        tree.delete("I00")
+        # The checkpoint is on disk, then the process dies before deleting the segments.
+        monkeypatch.setattr(engine, "_drop_segments", lambda upto, records: None)
+        engine.create_checkpoint(tree)
+        engine.close()
+    assert len(StorageEngine(str(tmp_path)).wal_segments()) > 1
+    assert recovered(str(tmp_path)) == dict(tree.iter_items())
+
+
+def test_legacy_single_file_wal_is_replayed_then_dropped(tmp_path):
+    (tmp_path / wal_engine.WAL_NAME).write_text(
+        json.dumps({"k": "OLD", "v": {"qty": 1}}) + "\n", encoding="utf-8")
+    with quiet():
+        engine = StorageEngine(str(tmp_path))
+        tree = BTree(t=3)
+        engine.recover_tree(tree)
+        assert segment_numbers(engine)[0] == 0
+        engine.log_transaction("NEW", {"qty": 2})
+        tree.insert("NEW", {"qty": 2})
+        engine.create_checkpoint(tree)
+        engine.close()
+    assert not (tmp_path / wal_engine.WAL_NAME).exists()
+    assert recovered(str(tmp_path)) == {"OLD": {"qty": 1}, "NEW": {"qty": 2}}
@@ -1,97 +1,1503 @@
+import contextlib
+import multiprocessing
 import os
 import json
+import struct
 import sys
-from typing import Any
+import threading
+import time
+import zlib
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Any, Iterable, Iterator
 
-# 1. Get the current user's home directory (Works on Windows/Mac/Linux)
-HOME_DIR: str = os.path.expanduser("~")
+import metrics
 
-# 2. Hardcode the database path straight to their Documents folder!
-DATA_DIR: str = os.path.join(HOME_DIR, "Documents", "AnchorMedData")
+# --- DATA DIRECTORY ---
+# Nothing here touches the disk at import time. A StorageEngine creates its
+# directory when it is first used, so the UI process can start (and answer
+# /api/ready) before a large store has been opened and recovered.
+#
+# The directory comes from ANCHORMED_DATA_DIR when set (the server's
+# --data-dir flag sets it too), else the user's Documents folder (Windows/Mac/Linux).
+DATA_DIR_ENV: str = "ANCHORMED_DATA_DIR"
 
-# 3. Create the folder if it doesn't exist
-os.makedirs(DATA_DIR, exist_ok=True)
+def default_data_dir() -> str:
+    """Returns $ANCHORMED_DATA_DIR, or ~/Documents/AnchorMedData."""
+    configured: str | None = os.environ.get(DATA_DIR_ENV)
+    if configured:
+        return os.path.abspath(os.path.expanduser(configured))
+    return os.path.join(os.path.expanduser("~"), "Documents", "AnchorMedData")
 
-# 4. Set the absolute file paths
-WAL_FILE: str = os.path.join(DATA_DIR, "recovery.wal")
-CHECKPOINT_FILE: str = os.path.join(DATA_DIR, "checkpoint.json")
+# File names inside a data directory
+CHECKPOINT_NAME: str = "checkpoint.json"
+# Single-file WAL written by older versions; replayed (as segment 0) if present.
+WAL_NAME: str = "recovery.wal"
+# Data file of the optional paged backend (paged_btree.PagedBTree).
+PAGE_NAME: str = "inventory.pages"
 
-print(f"--- ENGINE INITIALIZED ---")
-print(f"DATABASE LOCKED TO: {DATA_DIR}")
+# Paths of the default engine (the one the module-level functions below use).
+# WAL_FILE is the legacy single-file log; see wal_segments() for the live log.
+DATA_DIR: str = default_data_dir()
+WAL_FILE: str = os.path.join(DATA_DIR, WAL_NAME)
+CHECKPOINT_FILE: str = os.path.join(DATA_DIR, CHECKPOINT_NAME)
+PAGE_FILE: str = os.path.join(DATA_DIR, PAGE_NAME)
 
-def log_transaction(key: str, value: dict[str, Any]) -> None:
+# --- WAL ENCODING ---
+# "json":   one newline-delimited JSON object per record (the original format).
+# "binary": a 6-byte header (magic + format version), then length-prefixed frames:
+#           [u32 payload length][u32 CRC32][u64 sequence number][u8 record type][payload]
+#           The CRC covers everything after itself, so a torn or garbled tail is detected
+#           and recovery stops cleanly at the last intact frame.
+#           Version 2 payloads are packed entries (see "Packed payload" below):
+#           fixed-width struct rows whose strings are interned once per segment.
+#           Version 1 payloads were JSON text; those segments are still replayed.
+# The format only applies when a WAL file is started; an existing non-empty WAL
+# keeps its own format until the next checkpoint clears it.
+WAL_FORMAT: str = "json"
+WAL_MAGIC: bytes = b"AMWAL"
+WAL_FORMAT_VERSION: int = 2
+_WAL_HEADER: bytes = WAL_MAGIC + bytes([WAL_FORMAT_VERSION])
+_FRAME_HEADER: struct.Struct = struct.Struct("<IIQB")
+_COMPACT: dict[str, Any] = {"separators": (",", ":")}
+
+# Record types
+REC_PUT: int = 0    # payload: [key, value]
+REC_BATCH: int = 1  # payload: [[key, value], ...] (applied atomically; a None value deletes)
+REC_DELETE: int = 2 # payload: [key]
+# Flag OR-ed into the record type when the payload is zlib-compressed
+# (only done for large payloads such as sync batches, where it pays off).
+REC_FLAG_ZLIB: int = 0x80
+_ZLIB_MIN_PAYLOAD: int = 512
+# Flag OR-ed into the record type when a version 2 payload is JSON after all
+# (a record _pack_entries can't express, e.g. a non-string Batch ID).
+REC_FLAG_JSON: int = 0x40
+# Flag OR-ed into the record type when a version 2 payload's string ids are u32s
+# (the segment's string table has outgrown u16 ids).
+REC_FLAG_WIDE: int = 0x20
+
+# Packed payload (version 2):
+#   [varint new strings][varint their bytes][varint rows][varint deletes]
+#   [the new strings, UTF-8, NUL-separated]
+#   [rows: u8 flags, key id, name id, expiry id, i32 qty][delete key ids][u32 emptied_at]*
+# Ids index the segment's string table: every string the segment has seen, in
+# first-use order, so a repeated Batch ID, name or expiry costs 2 bytes. Ids are u16
+# (u32 with REC_FLAG_WIDE). The emptied_at stamps follow in the order of the rows
+# that have one. Tables start empty in every segment, so segments still replay
+# independently. Keys are unique within a packed payload, so rows and deletes can
+# be applied in either order.
+_E_NAME: int = 0x02
+_E_EXPIRY: int = 0x04
+_E_QTY: int = 0x08
+_E_EMPTIED: int = 0x10
+_E_JSON: int = 0x80  # any other value: the name id holds its JSON text
+_PACKED_FIELDS: frozenset[str] = frozenset(("name", "expiry", "qty", "emptied_at"))
+_ROW: struct.Struct = struct.Struct("<BHHHi")
+_ROW_WIDE: struct.Struct = struct.Struct("<BIIIi")
+_ID: struct.Struct = struct.Struct("<H")
+_ID_WIDE: struct.Struct = struct.Struct("<I")
+_U32: struct.Struct = struct.Struct("<I")
+
+# --- WAL SEGMENTS ---
+# The log is a numbered run of segment files ('recovery.000001.wal', ...), each
+# capped at about WAL_SEGMENT_BYTES; only the newest one is appended to. A
+# checkpoint first seals the active segment, so it always covers whole segments,
+# which are then deleted outright instead of rewriting the log. Every segment is
+# started in the WAL format of the moment (a binary one with its own header and
+# sequence numbers), so segments can be decoded independently - and in parallel.
+WAL_SEGMENT_BYTES: int = 4 * 1024 * 1024
+_SEGMENT_PREFIX: str = "recovery."
+_SEGMENT_SUFFIX: str = ".wal"
+# Replay decodes segments in a pool of worker processes once the log is at least
+# this big; below it, starting the workers costs more than it saves.
+PARALLEL_REPLAY_MIN_BYTES: int = 16 * 1024 * 1024
+
+# --- INSTRUMENTATION (see metrics.py; exposed on /api/metrics) ---
+_FSYNC_SECONDS = metrics.Histogram(
+    "anchormed_wal_fsync_seconds", "Time spent in fsync() of the write-ahead log."
+)
+_GROUP_SIZE = metrics.Histogram(
+    "anchormed_wal_group_commit_records", "WAL records made durable by one group commit.",
+    buckets=(1, 2, 4, 8, 16, 32, 64, 128, 256, 512)
+)
+_APPENDED_BYTES = metrics.Counter(
+    "anchormed_wal_appended_bytes_total", "Bytes appended to the write-ahead log."
+)
+_CHECKPOINT_SECONDS = metrics.Histogram(
+    "anchormed_checkpoint_seconds", "Duration of checkpoints, by kind (base, delta, pages).",
+    buckets=(0.01, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0), labelnames=("kind",)
+)
+_RECOVERY_SECONDS = metrics.Gauge(
+    "anchormed_recovery_seconds", "Duration of the last recover_tree() (startup recovery)."
+)
+
+def _default_wal_stat(name: str) -> float | None:
+    # The backlog gauges follow the default engine, once there is one.
+    return None if _default is None else round(_default.wal_stats()[name], 3)
+
+metrics.Gauge("anchormed_wal_bytes_since_checkpoint", "WAL bytes not yet covered by a checkpoint.",
+              fn=lambda: _default_wal_stat("bytes"))
+metrics.Gauge("anchormed_wal_records_since_checkpoint", "WAL records not yet covered by a checkpoint.",
+              fn=lambda: _default_wal_stat("records"))
+metrics.Gauge("anchormed_wal_seconds_since_checkpoint", "Seconds since the last checkpoint.",
+              fn=lambda: _default_wal_stat("age_seconds"))
+
+def _encode_frame(seq: int, rec_type: int, payload: bytes) -> bytes:
+    """Builds one binary WAL frame: header (length, CRC32, seq, type) + payload."""
+    body: bytes = struct.pack("<QB", seq, rec_type) + payload
+    return struct.pack("<II", len(payload), zlib.crc32(body)) + body
+
+def _varint(n: int) -> bytes:
+    """Encodes a non-negative int as a little-endian base-128 varint."""
+    out: bytearray = bytearray()
+    while n >= 0x80:
+        out.append(n & 0x7F | 0x80)
+        n >>= 7
+    out.append(n)
+    return bytes(out)
+
+def _read_varint(data: bytes, pos: int) -> tuple[int, int]:
+    """Decodes the varint at 'pos'; returns (value, position after it)."""
+    n: int = 0
+    shift: int = 0
+    while True:
+        b: int = data[pos]
+        pos += 1
+        n |= (b & 0x7F) << shift
+        if b < 0x80:
+            return n, pos
+        shift += 7
+
+def _pack_entries(entries: list[Any], strings: dict[str, int]) -> tuple[bytes, bool] | None:
     """
-    Appends a new transaction to the Write-Ahead Log.
+    Packs [key, value] entries (None deletes) into a version 2 payload, adding the
+    strings it introduces to 'strings' (the segment's table, string -> id).
+    Returns (payload, wide ids), or None, leaving 'strings' untouched, if the
+    entries can't be packed; the caller then writes them as JSON.
     """
-    record: dict[str, Any] = {"k": key, "v": value}
-    
-    with open(WAL_FILE, "a") as f:
-        f.write(json.dumps(record) + "\n")
-        f.flush()
-        os.fsync(f.fileno()) # Force write to disk
+    if len(entries) > 1 and len({k for k, _ in entries}) != len(entries):
+        return None  # a key written twice: rows and deletes would lose their order
+    new: dict[str, int] = {}
+    base: int = len(strings)
 
-    print(f"WAL: Anchored '{key}' to disk.")
-
-def create_checkpoint(btree_instance: Any) -> None:
-    """
-     THE SNAPSHOT MECHANISM
-    1. Dumps the entire B-Tree memory to 'checkpoint.json'
-    2. Wipes 'recovery.wal' clean.
-    """
-    print("\nWAL: Starting Checkpoint...")
-    
-    # 1. Get all data from B-Tree
-    # Returns list like: [{'batch_id': 'B1', 'details': {...}}, ...]
-    all_data: list[dict[str, Any]] = btree_instance.get_all_data() 
-    
-    # 2. Save Snapshot
-    with open(CHECKPOINT_FILE, 'w') as f:
-        json.dump(all_data, f)
-    
-    # 3. Truncate WAL (Wipe it clean)
-    with open(WAL_FILE, 'w') as f:
-        f.truncate(0)
-        
-    print(f" WAL: Checkpoint created with {len(all_data)} records. Log cleared.\n")
+    def ref(s: str) -> int:
+        i: int | None = strings.get(s)
+        if i is None:
+            i = new.get(s)
+            if i is None:
+                if "\0" in s:
+                    raise ValueError("NUL in string")
+                i = new[s] = base + len(new)
+        return i
 
-def recover_tree(btree_instance: Any) -> None:
+    rows: list[tuple[int, int, int, int, int]] = []
+    deletes: list[int] = []
+    emptied: list[int] = []
+    try:
+        for k, v in entries:
+            if type(k) is not str:
+                return None
+            if v is None:
+                deletes.append(ref(k))
+                continue
+            flags: int = 0
+            if type(v) is dict and v.keys() <= _PACKED_FIELDS:
+                name: Any = v.get("name", "")
+                expiry: Any = v.get("expiry", "")
+                qty: Any = v.get("qty", 0)
+                stamp: Any = v.get("emptied_at", 0)
+                if (type(name) is str and type(expiry) is str
+                        and type(qty) is int and -2 ** 31 <= qty < 2 ** 31
+                        and type(stamp) is int and 0 <= stamp < 2 ** 32):
+                    flags = ((_E_NAME if "name" in v else 0) | (_E_EXPIRY if "expiry" in v else 0)
+                             | (_E_QTY if "qty" in v else 0) | (_E_EMPTIED if "emptied_at" in v else 0))
+            if flags:
+                rows.append((flags, ref(k), ref(name) if flags & _E_NAME else 0,
+                             ref(expiry) if flags & _E_EXPIRY else 0, qty))
+                if flags & _E_EMPTIED:
+                    emptied.append(stamp)
+            else:
+                rows.append((_E_JSON, ref(k), ref(json.dumps(v, **_COMPACT)), 0, 0))
+    except ValueError:
+        return None
+    wide: bool = base + len(new) > 0xFFFF
+    row, key_id = (_ROW_WIDE, _ID_WIDE) if wide else (_ROW, _ID)
+    blob: bytes = "\0".join(new).encode("utf-8")
+    strings.update(new)
+    return (_varint(len(new)) + _varint(len(blob)) + _varint(len(rows)) + _varint(len(deletes)) + blob
+            + b"".join(row.pack(*r) for r in rows) + b"".join(key_id.pack(i) for i in deletes)
+            + b"".join(_U32.pack(s) for s in emptied)), wide
+
+def _unpack_entries(payload: bytes, wide: bool, strings: list[str], changes: dict[Any, Any]) -> int:
+    """
+    Folds the entries of a version 2 payload into 'changes', extending 'strings'
+    (the segment's table, id -> string) with the strings it introduces. Values are
+    left as rows, None for a delete or else (flags, name id, expiry id, qty, emptied_at);
+    see _unpack_value. Returns the number of entries.
+    """
+    head: bytes = payload[:4]
+    if max(head) < 0x80:  # the usual case: four one-byte varints
+        new, size, count, deleted = head
+        pos: int = 4
+    else:
+        new, pos = _read_varint(payload, 0)
+        size, pos = _read_varint(payload, pos)
+        count, pos = _read_varint(payload, pos)
+        deleted, pos = _read_varint(payload, pos)
+    if new == 1:
+        strings.append(payload[pos:pos + size].decode("utf-8"))
+    elif new:
+        strings.extend(payload[pos:pos + size].decode("utf-8").split("\0"))
+    pos += size
+    row, key_id = (_ROW_WIDE, _ID_WIDE) if wide else (_ROW, _ID)
+    rows_end: int = pos + count * row.size
+    if count + deleted == 1:  # a single write: skip the iterators
+        if count:
+            flags, key, name, expiry, qty = row.unpack_from(payload, pos)
+            stamp: int = _U32.unpack_from(payload, rows_end)[0] if flags & _E_EMPTIED else 0
+            changes[strings[key]] = (flags, name, expiry, qty, stamp)
+        else:
+            changes[strings[key_id.unpack_from(payload, pos)[0]]] = None
+        return 1
+    view: memoryview = memoryview(payload)
+    deletes_end: int = rows_end + deleted * key_id.size
+    stamps: Iterator[tuple[int]] = _U32.iter_unpack(view[deletes_end:])
+    for flags, key, name, expiry, qty in row.iter_unpack(view[pos:rows_end]):
+        changes[strings[key]] = (flags, name, expiry, qty, next(stamps)[0] if flags & _E_EMPTIED else 0)
+    for (key,) in key_id.iter_unpack(view[rows_end:deletes_end]):
+        changes[strings[key]] = None
+    return count + deleted
+
+def _unpack_value(row: tuple[int, int, int, int, int], strings: list[str]) -> Any:
+    """Rebuilds the value of a packed entry row (flags, name id, expiry id, qty, emptied_at)."""
+    flags, name, expiry, qty, emptied = row
+    if flags & _E_JSON:
+        return json.loads(strings[name])
+    value: dict[str, Any] = {}
+    if flags & _E_NAME:
+        value["name"] = strings[name]
+    if flags & _E_EXPIRY:
+        value["expiry"] = strings[expiry]
+    if flags & _E_QTY:
+        value["qty"] = qty
+    if flags & _E_EMPTIED:
+        value["emptied_at"] = emptied
+    return value
+
+def _iter_binary_frames(data: bytes) -> Iterator[tuple[int, int, int, bytes]]:
+    """
+    Walks the frames of a binary WAL image (header already stripped).
+    Yields (end_offset, seq, rec_type, payload) and stops silently at the first
+    frame that is truncated, fails its CRC, or breaks the sequence order.
+    """
+    view: memoryview = memoryview(data)
+    pos: int = 0
+    last_seq: int = 0
+    size: int = _FRAME_HEADER.size
+    while pos + size <= len(data):
+        length, crc, seq, rec_type = _FRAME_HEADER.unpack_from(view, pos)
+        end: int = pos + size + length
+        if end > len(data) or zlib.crc32(view[pos + 8:end]) != crc or seq <= last_seq:
+            return
+        yield end, seq, rec_type, bytes(view[pos + size:end])
+        last_seq = seq
+        pos = end
+
+class CommitBatch:
+    """
+    One group of WAL records that is written and fsynced together.
+    Every caller that joined the batch waits on it and sees the same outcome.
+    """
+    __slots__ = ("lines", "done", "error", "committer")
+
+    def __init__(self, committer: '_GroupCommitter | None' = None) -> None:
+        self.lines: list[tuple[int, Any]] = []
+        self.done: threading.Event = threading.Event()
+        self.error: BaseException | None = None
+        self.committer: _GroupCommitter | None = committer
+
+    def wait(self) -> None:
+        """Blocks until the group is durable; re-raises the write error, if any."""
+        if not self.done.is_set() and self.committer is not None:
+            self.committer.flush(self)
+        self.done.wait()
+        if self.error is not None:
+            raise self.error
+
+class _GroupCommitter:
+    """
+    GROUP COMMIT (leader/follower):
+    Records queue up in a pending batch. The first caller to wait() on a batch
+    that is not durable yet becomes the leader: it takes every record queued so
+    far and writes them with a single fsync. Callers arriving during that fsync
+    queue behind it and are flushed together by the next leader. A lone writer
+    therefore never waits for company, and concurrent writers share fsyncs.
+
+    With a 'window', a leader whose previous group was shared first lingers that
+    long to gather more writers (only worth it when an fsync is slow).
+    """
+    def __init__(self, engine: 'StorageEngine', window: float) -> None:
+        self.engine: StorageEngine = engine
+        self.window: float = window
+        # _lock guards the pending batch; _flush_lock makes one leader at a time.
+        self._lock: threading.Lock = threading.Lock()
+        self._flush_lock: threading.Lock = threading.Lock()
+        self._batch: CommitBatch = CommitBatch(self)
+        self._closed: bool = False
+        self._last_group: int = 0
+
+    def enqueue(self, record: tuple[int, Any]) -> CommitBatch:
+        """Queues 'record' for the next group; wait() on the result for durability."""
+        with self._lock:
+            if self._closed:
+                raise RuntimeError("WAL group commit is closed")
+            batch: CommitBatch = self._batch
+            batch.lines.append(record)
+        return batch
+
+    def flush(self, batch: CommitBatch) -> None:
+        """Makes 'batch' durable, leading the group commit unless an earlier leader took it."""
+        with self._flush_lock:
+            if batch.done.is_set():
+                return
+            if self.window > 0 and self._last_group > 1:
+                time.sleep(self.window)
+            # Batches are only swapped here, so an unflushed 'batch' is the pending one.
+            self._commit()
+
+    def close(self) -> None:
+        """Flushes anything still queued; later enqueues raise."""
+        with self._lock:
+            self._closed = True
+        with self._flush_lock:
+            self._commit()
+
+    def _commit(self) -> None:
+        # Caller holds _flush_lock.
+        with self._lock:
+            batch, self._batch = self._batch, CommitBatch(self)
+        if batch.lines:
+            engine: StorageEngine = self.engine
+            try:
+                with engine._wal_lock:
+                    engine._append_records(batch.lines) # One fsync for the whole group
+                _GROUP_SIZE.observe(len(batch.lines))
+            except BaseException as e:
+                batch.error = e
+        self._last_group = len(batch.lines)
+        batch.done.set()
+
+def _record_for(entries: list[list[Any]]) -> tuple[int, Any]:
+    # A single change is a plain record; several form one atomic batch frame.
+    if len(entries) == 1:
+        if entries[0][1] is None:
+            return (REC_DELETE, [entries[0][0]])
+        return (REC_PUT, entries[0])
+    return (REC_BATCH, entries)
+
+# --- CHECKPOINT FILES ---
+# One JSON object per line, {"batch_id": ..., "details": ...}, in key order,
+# closed by a trailer line {"checkpoint": {...}} recording the kind of file,
+# how many records it holds and which WAL position it covers. A file without
+# the trailer is incomplete. (Older checkpoints were a single JSON list; both load.)
+#
+# 'checkpoint.json' is the BASE: the full tree. Between bases, checkpoints only
+# write a DELTA ('checkpoint.delta.<seq>.json') with the keys changed since the
+# previous checkpoint. Recovery loads the base and layers the deltas newer than
+# it on top; once the chain gets long, or a delta would rewrite a large share of
+# the tree, the next checkpoint compacts everything into a new base.
+CHECKPOINT_CHUNK: int = 1024
+DELTA_MAX_CHAIN: int = 8
+DELTA_MAX_RATIO: float = 0.25
+_DELTA_PREFIX: str = "checkpoint.delta."
+
+def _iter_snapshot_lines(btree_instance: Any, snapshot_lock: Any) -> Iterator[list[str]]:
+    """
+    Streams the tree as checkpoint lines, CHECKPOINT_CHUNK records at a time.
+
+    'snapshot_lock' is held only while one chunk is read and encoded; between
+    chunks writers run, and the next chunk resumes just after the last key written.
+    Anything changed meanwhile is also in the WAL after the covered position,
+    so replay brings the snapshot up to date.
+    """
+    guard: Any = snapshot_lock if snapshot_lock is not None else contextlib.nullcontext()
+    cursor: Any = None
+    last_key: Any = None
+    while True:
+        with guard:
+            if cursor is None:
+                cursor = btree_instance.cursor()
+            else:
+                cursor.seek(last_key, inclusive=False) # The tree may have changed meanwhile
+            records: list[tuple[Any, Any]] = cursor.take(CHECKPOINT_CHUNK)
+            chunk: list[str] = [json.dumps({"batch_id": k, "details": v}) + "\n" for k, v in records]
+        if not chunk:
+            return
+        last_key = records[-1][0]
+        yield chunk
+
+def _iter_delta_lines(btree_instance: Any, snapshot_lock: Any, keys: list[Any]) -> Iterator[list[str]]:
+    """
+    Streams the current values of 'keys' (sorted) as checkpoint lines, chunk by chunk,
+    holding 'snapshot_lock' only while one chunk is read and encoded.
+    """
+    guard: Any = snapshot_lock if snapshot_lock is not None else contextlib.nullcontext()
+    for pos in range(0, len(keys), CHECKPOINT_CHUNK):
+        chunk: list[str] = []
+        with guard:
+            # A deleted key is written with null details: a tombstone for recovery.
+            for k in keys[pos:pos + CHECKPOINT_CHUNK]:
+                chunk.append(json.dumps({"batch_id": k, "details": btree_instance.search(k)}) + "\n")
+        yield chunk
+
+def _is_paged(btree_instance: Any) -> bool:
+    """True for a tree kept in a page file, which checkpoints by flushing its pages."""
+    return callable(getattr(btree_instance, "flush", None))
+
+def _fsync_dir(path: str) -> None:
+    """Makes a rename inside 'path' durable (not supported on Windows)."""
+    if os.name == 'nt':
+        return
+    fd: int = os.open(path, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+def _read_checkpoint(path: str, trailer_out: dict[str, Any] | None = None) -> Iterator[tuple[Any, Any]]:
+    """
+    Streams (batch_id, details) pairs out of a checkpoint file, in file order.
+    In a delta, details of None mark a batch deleted since the previous snapshot.
+    Once exhausted, the trailer (if any) is copied into 'trailer_out'.
+    Raises ValueError if a line-format checkpoint is missing its trailer.
+    """
+    with open(path, 'r') as f:
+        first: str = f.read(1)
+        while first.isspace():
+            first = f.read(1)
+        f.seek(0)
+        if first == "[":
+            # Legacy checkpoint: one JSON list of {'batch_id', 'details'}
+            for item in json.load(f):
+                yield item['batch_id'], item['details']
+            return
+
+        trailer: dict[str, Any] | None = None
+        for line in f:
+            if not line.strip():
+                continue
+            record: dict[str, Any] = json.loads(line)
+            if "checkpoint" in record:
+                trailer = record["checkpoint"]
+                break
+            yield record['batch_id'], record['details']
+        if trailer is None:
+            raise ValueError("checkpoint has no trailer (incomplete write)")
+        if trailer_out is not None:
+            trailer_out.update(trailer)
+
+def _apply(btree_instance: Any, k: Any, v: Any) -> None:
+    """Applies one logged change: a None value is a delete, anything else an upsert."""
+    if v is None:
+        btree_instance.delete(k)
+    else:
+        btree_instance.insert(k, v)
+
+def _fold_json(data: bytes, changes: dict[Any, Any]) -> int:
+    """
+    Folds a newline-delimited JSON WAL into 'changes'. Unparseable (torn) lines are skipped.
+    """
+    wal_count: int = 0
+    for line in data.decode("utf-8", errors="replace").splitlines():
+        if line.strip():
+            try:
+                record: dict[str, Any] = json.loads(line)
+                if "batch" in record:
+                    # Batch frame: {'batch': [{'k': key, 'v': value}, ...]}
+                    for rec in record['batch']:
+                        changes[rec['k']] = rec['v']
+                        wal_count += 1
+                    continue
+                # WAL format is {'k': key, 'v': value}, or {'k': key, 'delete': true}
+                changes[record['k']] = None if record.get('delete') else record['v']
+                wal_count += 1
+            except ValueError:
+                continue
+    return wal_count
+
+def _fold_binary(data: bytes, changes: dict[Any, Any]) -> tuple[int, int, int]:
+    """
+    Folds a binary WAL into 'changes', stopping at the first torn or corrupt frame.
+    Returns (records, valid_size, last_seq); 'valid_size' is where the intact frames end.
+    """
+    version: int = data[len(WAL_MAGIC)] if len(data) > len(WAL_MAGIC) else WAL_FORMAT_VERSION
+    if version not in (1, WAL_FORMAT_VERSION):
+        raise ValueError(f"Unsupported WAL format version {version}")
+
+    wal_count: int = 0
+    good_end: int = 0
+    last_seq: int = 0
+    strings: list[str] = []
+    for end, seq, rec_type, payload in _iter_binary_frames(data[len(_WAL_HEADER):]):
+        good_end = end
+        last_seq = seq
+        if rec_type & REC_FLAG_ZLIB:
+            payload = zlib.decompress(payload)
+        if version > 1 and not rec_type & REC_FLAG_JSON:
+            # Values stay rows while folding; only the ones that survive become dicts.
+            wal_count += _unpack_entries(payload, bool(rec_type & REC_FLAG_WIDE), strings, changes)
+            continue
+        rec_type &= ~(REC_FLAG_ZLIB | REC_FLAG_JSON)
+        entries: Any = json.loads(payload)
+        if rec_type == REC_BATCH:
+            for k, v in entries:
+                changes[k] = v
+            wal_count += len(entries)
+        elif rec_type == REC_DELETE:
+            changes[entries[0]] = None
+            wal_count += 1
+        else:
+            changes[entries[0]] = entries[1]
+            wal_count += 1
+    full: int = _E_NAME | _E_EXPIRY | _E_QTY
+    for k, v in changes.items():
+        if type(v) is tuple:
+            if v[0] == full:
+                changes[k] = {"name": strings[v[1]], "expiry": strings[v[2]], "qty": v[3]}
+            else:
+                changes[k] = _unpack_value(v, strings)
+
+    # A header torn before its version byte leaves nothing worth keeping.
+    valid_size: int = len(_WAL_HEADER) + good_end if len(data) >= len(_WAL_HEADER) else 0
+    return wal_count, valid_size, last_seq
+
+def _decode_segment(path: str) -> tuple[dict[Any, Any], int, int, int]:
+    """
+    Reads one WAL segment and folds it down to the last logged value per key
+    (None for a delete). Runs in a replay worker process, so it only takes and
+    returns plain, picklable data.
+
+    Returns:
+        tuple: (changes, records, valid_size, last_seq). 'valid_size' is where a
+               torn binary tail starts (the file size when there is none) and
+               'last_seq' the last intact binary sequence number (0 for JSON).
+    """
+    with open(path, 'rb') as f:
+        data: bytes = f.read()
+    changes: dict[Any, Any] = {}
+    if data.startswith(WAL_MAGIC):
+        records, valid_size, last_seq = _fold_binary(data, changes)
+        return changes, records, valid_size, last_seq
+    return changes, _fold_json(data, changes), len(data), 0
+
+def _has_torn_tail(path: str) -> bool:
+    """
+    True if the segment at 'path' ends in a half-written record. Nothing may be
+    appended after it: replay stops at a torn binary frame, and a torn JSON line
+    would swallow the next record.
+    """
+    with open(path, "rb") as f:
+        data: bytes = f.read()
+    if data.startswith(WAL_MAGIC):
+        valid: int = len(_WAL_HEADER)
+        for end, _seq, _type, _payload in _iter_binary_frames(data[len(_WAL_HEADER):]):
+            valid = len(_WAL_HEADER) + end
+        return valid != len(data)
+    return bool(data) and not data.endswith(b"\n")
+
+def _merge_changes(items: Iterable[tuple[Any, Any]], keys: list[Any],
+                   changes: dict[Any, Any]) -> Iterator[tuple[Any, Any]]:
+    """
+    Merges the tree's sorted items with the sorted changed 'keys': a change
+    replaces the stored value, and a change of None drops the key.
+    """
+    i: int = 0
+    for k, v in items:
+        while i < len(keys) and keys[i] < k:
+            if changes[keys[i]] is not None:
+                yield keys[i], changes[keys[i]]
+            i += 1
+        if i < len(keys) and keys[i] == k:
+            if changes[k] is not None:
+                yield k, changes[k]
+            i += 1
+        else:
+            yield k, v
+    for k in keys[i:]:
+        if changes[k] is not None:
+            yield k, changes[k]
+
+def _apply_changes(btree_instance: Any, changes: dict[Any, Any]) -> None:
+    """
+    Applies the net change per key, in key order. An in-memory tree that holds no
+    more keys than there are changes is rebuilt bottom-up from the merge of both
+    (one O(n) bulk load); otherwise each key is upserted or deleted, in sorted
+    order so neighbouring keys hit the same nodes (and pages). Either way the
+    changed keys end up dirty, so the next checkpoint persists them.
+    """
+    keys: list[Any] = sorted(changes)
+    if not _is_paged(btree_instance) and len(keys) >= btree_instance.key_count:
+        btree_instance.bulk_load(_merge_changes(btree_instance.iter_items(), keys, changes))
+        btree_instance.mark_dirty(keys)
+        return
+    for k in keys:
+        _apply(btree_instance, k, changes[k])
+
+class RecoveryProgress:
+    """
+    How far the engine's recover_tree() has got.
+
+    Written by the recovering thread and read without locking by whoever
+    reports readiness (e.g. /api/ready): each field is a single attribute,
+    so a reader sees a slightly stale but never torn value.
+
+    Attributes:
+        state (str): "idle", "recovering", "ready" or "failed".
+        phase (str | None): "checkpoint", "deltas" or "wal" while recovering.
+        records (int): Records loaded or replayed so far.
+        error (str | None): Why the last recovery failed.
+    """
+    def __init__(self) -> None:
+        self.state: str = "idle"
+        self.phase: str | None = None
+        self.records: int = 0
+        self.error: str | None = None
+        self._started: float | None = None
+        self._finished: float | None = None
+
+    def begin(self) -> None:
+        self.state, self.phase, self.records, self.error = "recovering", None, 0, None
+        self._started, self._finished = time.perf_counter(), None
+
+    def end(self, error: BaseException | None = None) -> None:
+        self.state = "failed" if error is not None else "ready"
+        self.error = None if error is None else f"{type(error).__name__}: {error}"
+        self.phase = None
+        self._finished = time.perf_counter()
+
+    def track(self, records: Iterable[Any]) -> Iterator[Any]:
+        """Passes 'records' through, counting each one as it is loaded."""
+        for record in records:
+            self.records += 1
+            yield record
+
+    @property
+    def elapsed(self) -> float:
+        if self._started is None:
+            return 0.0
+        return (self._finished or time.perf_counter()) - self._started
+
+    def to_dict(self) -> dict[str, Any]:
+        return {
+            "state": self.state,
+            "phase": self.phase,
+            "records": self.records,
+            "elapsed_seconds": round(self.elapsed, 3),
+            "error": self.error,
+        }
+
+class _BackgroundCheckpointer:
+    """
+    BACKGROUND CHECKPOINTING:
+    Polls the WAL counters and takes a checkpoint as soon as the log grows past
+    'max_bytes' or 'max_records', or the oldest un-checkpointed record is older
+    than 'max_age' seconds. This keeps restart replay time bounded.
+    """
+    def __init__(self, engine: 'StorageEngine', btree_instance: Any, snapshot_lock: Any,
+                 max_bytes: int, max_records: int, max_age: float, interval: float) -> None:
+        self.engine: StorageEngine = engine
+        self.btree_instance: Any = btree_instance
+        self.snapshot_lock: Any = snapshot_lock
+        self.max_bytes: int = max_bytes
+        self.max_records: int = max_records
+        self.max_age: float = max_age
+        self.interval: float = interval
+        self._stop: threading.Event = threading.Event()
+        self._thread: threading.Thread = threading.Thread(
+            target=self._run, name="wal-checkpointer", daemon=True
+        )
+        self._thread.start()
+
+    def due(self) -> bool:
+        stats: dict[str, float] = self.engine.wal_stats()
+        if stats["records"] == 0:
+            return False
+        return (
+            stats["bytes"] >= self.max_bytes
+            or stats["records"] >= self.max_records
+            or stats["age_seconds"] >= self.max_age
+        )
+
+    def stop(self) -> None:
+        self._stop.set()
+        self._thread.join()
+
+    def _run(self) -> None:
+        while not self._stop.wait(self.interval):
+            if self.due():
+                try:
+                    self.engine.create_checkpoint(self.btree_instance, self.snapshot_lock)
+                except Exception as e:
+                    print(f" WAL: Background checkpoint failed: {e}")
+
+class StorageEngine:
     """
-    RESTORE PROCEDURE:
-    1. Load 'checkpoint.json' (The Base)
-    2. Replay 'recovery.wal' (The Updates since checkpoint)
+    The durable side of one AnchorMed store: the write-ahead log, the
+    checkpoint files and the recovery that rebuilds a tree from them, all kept
+    in one data directory.
+
+    Creating an engine does no I/O; the directory is created on first use
+    (see open()). Several engines can live in one process, each with its own
+    directory, locks and counters.
+
+    Attributes:
+        data_dir (str): Directory holding the WAL, checkpoints and page file.
+        legacy_wal_file (str): Path of an older single-file WAL (replayed first).
+        checkpoint_file (str): Path of the base checkpoint.
+        page_file (str): Path of the paged backend's data file.
+        wal_format (str): Encoding ("json" or "binary") for newly started WAL segments.
+        segment_bytes (int): Size at which the active WAL segment is sealed.
+        replay_workers (int): Processes used to decode a large WAL during recovery.
+        progress (RecoveryProgress): State of the current or last recovery.
     """
-    count: int = 0
-    
-    # PHASE 1: Load Snapshot
-    if os.path.exists(CHECKPOINT_FILE):
+    def __init__(self, data_dir: str | None = None, wal_format: str = "json",
+                 segment_bytes: int = WAL_SEGMENT_BYTES, replay_workers: int | None = None) -> None:
+        self.data_dir: str = data_dir or default_data_dir()
+        self.legacy_wal_file: str = os.path.join(self.data_dir, WAL_NAME)
+        self.checkpoint_file: str = os.path.join(self.data_dir, CHECKPOINT_NAME)
+        self.page_file: str = os.path.join(self.data_dir, PAGE_NAME)
+        self.wal_format: str = "json"
+        self.set_wal_format(wal_format)
+        self.segment_bytes: int = segment_bytes
+        self.replay_workers: int = replay_workers or os.cpu_count() or 1
+        self.progress: RecoveryProgress = RecoveryProgress()
+        self._opened: bool = False
+
+        # Serialises every write/fsync/roll of the WAL, so concurrent callers
+        # (Flask handles requests on several threads) never interleave partial records.
+        self._wal_lock: threading.Lock = threading.Lock()
+        # Number of the active segment (None until worked out from the directory)
+        # and its append handle, opened on the first write (guarded by _wal_lock).
+        self._segment: int | None = None
+        self._handle: Any = None
+        # Format of the active segment, its binary format version, next sequence number
+        # and string table (string -> id, see _pack_entries). All are worked out lazily
+        # (guarded by _wal_lock) and reset for each new segment.
+        self._disk_format: str | None = None
+        self._disk_version: int = WAL_FORMAT_VERSION
+        self._next_seq: int = 1
+        self._strings: dict[str, int] = {}
+        # What the WAL holds since the last checkpoint (guarded by _wal_lock).
+        # These drive the background checkpointer's size / count / age triggers.
+        self._wal_bytes: int = 0
+        self._wal_records: int = 0
+        self._last_checkpoint_at: float = time.monotonic()
+        self._committer: _GroupCommitter | None = None
+
+        # Only one checkpoint (shutdown or background) runs at a time.
+        self._checkpoint_lock: threading.Lock = threading.Lock()
+        # Checkpoint chain state (guarded by _checkpoint_lock). '_delta_seq' is the newest
+        # delta sequence on disk or covered by the base; None means the on-disk chain is
+        # unknown (recover_tree never ran), so the next checkpoint must be a full base.
+        self._delta_seq: int | None = None
+        self._delta_chain: int = 0
+        self._base_records: int = 0
+        self._checkpointer: _BackgroundCheckpointer | None = None
+
+    def open(self) -> None:
+        """
+        Creates the data directory if it doesn't exist. Safe to call repeatedly;
+        every method that touches the disk calls it first.
+        """
+        if self._opened:
+            return
+        os.makedirs(self.data_dir, exist_ok=True)
+        self._opened = True
+        print(f"--- ENGINE INITIALIZED ---")
+        print(f"DATABASE LOCKED TO: {self.data_dir}")
+
+    def set_wal_format(self, fmt: str) -> None:
+        """
+        Chooses the encoding ("json" or "binary") used for newly started WAL files.
+        """
+        if fmt not in ("json", "binary"):
+            raise ValueError(f"Unknown WAL format: {fmt!r}")
+        self.wal_format = fmt
+
+    # --- WAL ---
+    def _segment_path(self, number: int) -> str:
+        if number == 0:
+            return self.legacy_wal_file
+        return os.path.join(self.data_dir, f"{_SEGMENT_PREFIX}{number:06d}{_SEGMENT_SUFFIX}")
+
+    def wal_segments(self) -> list[tuple[int, str]]:
+        """
+        Returns the (number, path) of every WAL segment on disk, oldest first.
+        A legacy single-file WAL comes first, as segment 0.
+        """
+        segments: list[tuple[int, str]] = []
+        if not os.path.isdir(self.data_dir):
+            return segments
+        for name in os.listdir(self.data_dir):
+            if name == WAL_NAME:
+                segments.append((0, self.legacy_wal_file))
+            elif name.startswith(_SEGMENT_PREFIX) and name.endswith(_SEGMENT_SUFFIX):
+                number: str = name[len(_SEGMENT_PREFIX):-len(_SEGMENT_SUFFIX)]
+                if number.isdigit():
+                    segments.append((int(number), os.path.join(self.data_dir, name)))
+        return sorted(segments)
+
+    def _active_handle(self) -> Any:
+        """
+        Returns the active segment opened for binary append, opening it first if
+        needed: without a recovery, appending resumes in the newest segment on disk
+        (or the one after it, if that ends in a torn record). Caller must hold _wal_lock.
+        """
+        if self._handle is None:
+            if self._segment is None:
+                self._segment = max([1] + [number for number, _ in self.wal_segments()])
+                newest: str = self._segment_path(self._segment)
+                if os.path.exists(newest) and _has_torn_tail(newest):
+                    # Left by a crash that no recovery has seen yet: keep the damage
+                    # as it is and start the next segment (replay folds each on its own).
+                    print(f"WAL: Segment #{self._segment} ends in a torn record; continuing in a new segment.")
+                    self._segment += 1
+            self._handle = open(self._segment_path(self._segment), "ab")
+        return self._handle
+
+    def _roll_segment(self) -> None:
+        """Seals the active segment; the next write starts a new one. Caller holds _wal_lock."""
+        if self._handle is not None:
+            self._handle.close()
+            self._handle = None
+        self._segment += 1
+        self._reset_disk_format()
+
+    def _append_records(self, records: list[tuple[int, Any]]) -> None:
+        """
+        Writes and fsyncs 'records' at the end of the active segment, then seals
+        the segment once it has reached segment_bytes. Caller must hold _wal_lock.
+        """
+        f: Any = self._active_handle()
+        self._write_records(f, records)
+        if f.tell() >= self.segment_bytes:
+            self._roll_segment()
+
+    def _current_format(self, f: Any) -> str:
+        """
+        Returns the format to append in, writing the binary header into an empty segment.
+        Caller must hold _wal_lock; 'f' is the active segment opened for binary append.
+        """
+        if os.fstat(f.fileno()).st_size == 0:
+            self._disk_format = self.wal_format
+            self._disk_version = WAL_FORMAT_VERSION
+            self._next_seq = 1
+            self._strings = {}
+            if self._disk_format == "binary":
+                f.write(_WAL_HEADER)
+        elif self._disk_format is None:
+            with open(self._segment_path(self._segment), "rb") as r:
+                data: bytes = r.read()
+            if data.startswith(WAL_MAGIC):
+                # Keep appending in the segment's own version; version 1 payloads are JSON.
+                self._disk_format = "binary"
+                self._disk_version = data[len(WAL_MAGIC)] if len(data) > len(WAL_MAGIC) else WAL_FORMAT_VERSION
+                self._next_seq = 1
+                strings: list[str] = []
+                scratch: dict[Any, Any] = {}
+                for _end, seq, rec_type, payload in _iter_binary_frames(data[len(_WAL_HEADER):]):
+                    self._next_seq = seq + 1
+                    if self._disk_version > 1 and not rec_type & REC_FLAG_JSON:
+                        if rec_type & REC_FLAG_ZLIB:
+                            payload = zlib.decompress(payload)
+                        _unpack_entries(payload, bool(rec_type & REC_FLAG_WIDE), strings, scratch)
+                self._strings = {s: i for i, s in enumerate(strings)}
+            else:
+                self._disk_format = "json"
+        return self._disk_format
+
+    def _write_records(self, f: Any, records: list[tuple[int, Any]]) -> None:
+        """
+        Encodes (rec_type, entries) records in the segment's format, writes and fsyncs them.
+        Caller must hold _wal_lock.
+        """
+        chunks: list[bytes] = []
+        if self._current_format(f) == "binary":
+            for rec_type, entries in records:
+                payload: bytes | None = None
+                if self._disk_version > 1:
+                    packed_entries: tuple[bytes, bool] | None = _pack_entries(
+                        entries if rec_type == REC_BATCH else [(entries[0], entries[1] if rec_type == REC_PUT else None)],
+                        self._strings)
+                    if packed_entries is None:
+                        rec_type |= REC_FLAG_JSON
+                    else:
+                        payload = packed_entries[0]
+                        if packed_entries[1]:
+                            rec_type |= REC_FLAG_WIDE
+                if payload is None:
+                    payload = json.dumps(entries, **_COMPACT).encode("utf-8")
+                if len(payload) >= _ZLIB_MIN_PAYLOAD:
+                    packed: bytes = zlib.compress(payload, 1)
+                    if len(packed) < len(payload):
+                        payload, rec_type = packed, rec_type | REC_FLAG_ZLIB
+                chunks.append(_encode_frame(self._next_seq, rec_type, payload))
+                self._next_seq += 1
+        else:
+            for rec_type, entries in records:
+                if rec_type == REC_BATCH:
+                    line: str = json.dumps({"batch": [{"k": k, "v": v} for k, v in entries]})
+                elif rec_type == REC_DELETE:
+                    line = json.dumps({"k": entries[0], "delete": True})
+                else:
+                    line = json.dumps({"k": entries[0], "v": entries[1]})
+                chunks.append((line + "\n").encode("utf-8"))
+        data: bytes = b"".join(chunks)
         try:
-            with open(CHECKPOINT_FILE, 'r') as f:
-                snapshot: list[dict[str, Any]] = json.load(f)
-                for item in snapshot:
-                    # Note: get_all_data returns 'batch_id' and 'details'
-                    btree_instance.insert(item['batch_id'], item['details'])
-                    count += 1
-            print(f"WAL: Loaded {count} records from Checkpoint.")
-        except Exception as e:
-            print(f" WAL: Checkpoint corrupted: {e}")
+            f.write(data)
+            f.flush()
+        except BaseException:
+            # The string table and sequence numbers already count this write:
+            # work them out again from what actually reached the segment.
+            self._reset_disk_format()
+            raise
+        started: float = time.perf_counter()
+        os.fsync(f.fileno()) # Force write to disk
+        _FSYNC_SECONDS.observe(time.perf_counter() - started)
+        _APPENDED_BYTES.inc(amount=len(data))
+        self._wal_bytes += len(data)
+        self._wal_records += sum(len(entries) if rec_type == REC_BATCH else 1 for rec_type, entries in records)
 
-    # PHASE 2: Replay WAL
-    if os.path.exists(WAL_FILE):
-        wal_count: int = 0
+    def _reset_disk_format(self) -> None:
+        """Forgets the cached format when a new segment is started. Caller holds _wal_lock."""
+        self._disk_format = None
+        self._next_seq = 1
+        self._strings = {}
+
+    def wal_stats(self) -> dict[str, float]:
+        """
+        Returns what the WAL has accumulated since the last checkpoint.
+        """
+        with self._wal_lock:
+            return {
+                "bytes": self._wal_bytes,
+                "records": self._wal_records,
+                "age_seconds": time.monotonic() - self._last_checkpoint_at,
+            }
+
+    def _seal_wal(self) -> tuple[int, int]:
+        """
+        Seals the active segment (if anything was written to it) and returns
+        (last sealed segment, record count). Every record up to then is durable
+        and in a sealed segment; a checkpoint taken afterwards covers them all.
+        """
+        with self._wal_lock:
+            self._active_handle()
+            if self._handle.tell() > 0:
+                self._roll_segment()
+            else:
+                self._handle.close() # Nothing written yet: leave no empty file behind
+                self._handle = None
+                with contextlib.suppress(OSError):
+                    os.remove(self._segment_path(self._segment))
+            return self._segment - 1, self._wal_records
+
+    def _drop_segments(self, upto: int, records: int) -> None:
+        """
+        Deletes the WAL segments numbered up to 'upto' (covered by a checkpoint).
+        """
+        with self._wal_lock:
+            remaining: int = 0
+            for number, path in self.wal_segments():
+                if number <= upto:
+                    os.remove(path)
+                else:
+                    remaining += os.path.getsize(path)
+            self._wal_bytes = remaining
+            self._wal_records = max(0, self._wal_records - records)
+            self._last_checkpoint_at = time.monotonic()
+
+    def close(self) -> None:
+        """
+        Closes the active WAL segment (after disable_group_commit(), on shutdown).
+        Appending again later resumes in the newest segment on disk.
+        """
+        with self._wal_lock:
+            if self._handle is not None:
+                self._handle.close()
+                self._handle = None
+            self._segment = None
+            self._reset_disk_format()
+
+    def enable_group_commit(self, window_ms: float = 0.0) -> None:
+        """
+        Switches log_transaction to group-commit mode: records that queue up while
+        an fsync is running are made durable together by the next one.
+        A 'window_ms' makes each shared commit wait that long for more writers.
+        """
+        if self._committer is not None:
+            self._committer.window = window_ms / 1000
+            return
+        self.open()
+        self._committer = _GroupCommitter(self, window_ms / 1000)
+        print(f"WAL: Group commit enabled ({window_ms}ms window).")
+
+    def disable_group_commit(self) -> None:
+        """
+        Flushes any queued records and returns to one-fsync-per-transaction mode.
+        """
+        if self._committer is None:
+            return
+        committer, self._committer = self._committer, None
+        committer.close()
+
+    def _append_to_wal(self, record: tuple[int, Any]) -> CommitBatch:
+        """
+        Appends 'record' to the WAL in call order and returns its commit handle.
+        Without group commit the record is already durable on return (write errors
+        raise right here); with it, wait() on the handle for the shared fsync.
+        """
+        committer: _GroupCommitter | None = self._committer
+        if committer is not None:
+            return committer.enqueue(record)
+
+        self.open()
+        batch: CommitBatch = CommitBatch()
+        with self._wal_lock:
+            self._append_records([record])
+        batch.lines.append(record)
+        batch.done.set()
+        return batch
+
+    def log_transaction(self, key: str, value: dict[str, Any]) -> None:
+        """
+        Appends a new transaction to the Write-Ahead Log.
+        Returns only once the record is durable on disk.
+        """
+        self._append_to_wal((REC_PUT, [key, value])).wait()
+
+        print(f"WAL: Anchored '{key}' to disk.")
+
+    def log_transactions(self, records: Iterable[tuple[str, dict[str, Any]]]) -> int:
+        """
+        Appends many transactions to the Write-Ahead Log as ONE atomic frame.
+
+        The records are written as a single frame (in the JSON format, one line
+        {"batch": [{"k": ..., "v": ...}, ...]}) with a single fsync. A crash mid-write
+        leaves a torn frame that recovery discards, so either the whole batch is
+        replayed or none of it is.
+        Returns the number of records logged.
+        """
+        batch: list[list[Any]] = [[key, value] for key, value in records]
+        if not batch:
+            return 0
+
+        self._append_to_wal((REC_BATCH, batch)).wait()
+
+        print(f"WAL: Anchored batch of {len(batch)} records to disk.")
+        return len(batch)
+
+    def submit_transactions(self, records: Iterable[tuple[str, dict[str, Any]]]) -> CommitBatch:
+        """
+        Logs one or more transactions (atomically, as one frame) WITHOUT waiting
+        for the group fsync, and returns the commit handle. A value of None
+        records a delete of that key.
+
+        This lets a caller fix the WAL order and apply the change to memory while
+        holding its write lock, then release the lock and call handle.wait() before
+        acknowledging - so concurrent writers still share one group commit.
+        Without group commit the records are already durable on return.
+        """
+        entries: list[list[Any]] = [[key, value] for key, value in records]
+        if not entries:
+            batch: CommitBatch = CommitBatch()
+            batch.done.set()
+            return batch
+        return self._append_to_wal(_record_for(entries))
+
+    # --- CHECKPOINTS ---
+    def _delta_path(self, seq: int) -> str:
+        return os.path.join(self.data_dir, f"{_DELTA_PREFIX}{seq:06d}.json")
+
+    def _list_deltas(self) -> list[tuple[int, str]]:
+        """Returns the (seq, path) of every delta checkpoint on disk, oldest first."""
+        deltas: list[tuple[int, str]] = []
+        if not os.path.isdir(self.data_dir):
+            return deltas
+        for name in os.listdir(self.data_dir):
+            if name.startswith(_DELTA_PREFIX) and name.endswith(".json"):
+                seq: str = name[len(_DELTA_PREFIX):-len(".json")]
+                if seq.isdigit():
+                    deltas.append((int(seq), os.path.join(self.data_dir, name)))
+        return sorted(deltas)
+
+    def _write_checkpoint_file(self, path: str, chunks: Iterator[list[str]], trailer: dict[str, Any]) -> int:
+        """
+        Streams 'chunks' into 'path' + '.tmp', appends the trailer, fsyncs, and atomically
+        renames it into place. Returns the number of records written.
+        """
+        tmp_path: str = path + ".tmp"
+        total: int = 0
+        with open(tmp_path, 'w') as f:
+            for chunk in chunks:
+                f.writelines(chunk)
+                total += len(chunk)
+            trailer["records"] = total
+            trailer["created_at"] = time.time()
+            f.write(json.dumps({"checkpoint": trailer}) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+        _fsync_dir(self.data_dir)
+        return total
+
+    def create_checkpoint(self, btree_instance: Any, snapshot_lock: Any = None, full: bool = False) -> None:
+        """
+         THE SNAPSHOT MECHANISM
+        1. Seals the active WAL segment (the snapshot covers every sealed one) and
+           takes the tree's dirty keys, under 'snapshot_lock' if given: any lock
+           that keeps writers out - such as the read side of a reader-writer lock -
+           so every sealed record is already in the tree.
+        2. Writes either a DELTA with just those keys, or - when 'full' is set, no base
+           is known, the delta chain is long, or too much changed - a new BASE of the
+           whole tree, after which the old deltas are removed (compaction).
+           Either file is streamed chunk by chunk into a temp file, fsynced, and
+           atomically renamed into place.
+        3. Deletes the covered segments; records logged meanwhile are in newer ones.
+
+        Replaying a WAL record is idempotent (last write wins), so records logged
+        after the seal but already visible in the snapshot are harmless.
+        A crash at any point leaves either the old or the new checkpoint intact.
+
+        A paged tree (one with a flush() method) is its own snapshot: step 2 becomes
+        writing back its dirty pages and committing the page file.
+        """
+        self.open()
+        with self._checkpoint_lock:
+            print("\nWAL: Starting Checkpoint...")
+            started: float = time.perf_counter()
+
+            # 1. Seal the WAL segments covered by this snapshot
+            guard: Any = snapshot_lock if snapshot_lock is not None else contextlib.nullcontext()
+            if _is_paged(btree_instance):
+                # The flush must see a quiet tree, so it runs under the guard too.
+                # It writes at most the buffer pool's dirty pages, so the pause is bounded.
+                with guard:
+                    covered_segment, covered_records = self._seal_wal()
+                    btree_instance.take_dirty()
+                    pages: int = btree_instance.flush()
+                self._drop_segments(covered_segment, covered_records)
+                _CHECKPOINT_SECONDS.observe(time.perf_counter() - started, "pages")
+                print(f" WAL: Page checkpoint flushed {pages} pages. Log cleared.\n")
+                return
+
+            with guard:
+                covered_segment, covered_records = self._seal_wal()
+                dirty: set[Any] = btree_instance.take_dirty()
+
+            # 2. Delta or full base?
+            full = (
+                full
+                or self._delta_seq is None
+                or self._delta_chain >= DELTA_MAX_CHAIN
+                or len(dirty) > DELTA_MAX_RATIO * max(self._base_records, 1)
+            )
+            trailer: dict[str, Any] = {"wal_segment": covered_segment, "wal_records": covered_records}
+            try:
+                if full:
+                    # Compaction: the new base covers every delta on disk.
+                    covered_seq: int = max([self._delta_seq or 0] + [seq for seq, _ in self._list_deltas()])
+                    trailer.update({"kind": "base", "delta_seq": covered_seq})
+                    total: int = self._write_checkpoint_file(
+                        self.checkpoint_file, _iter_snapshot_lines(btree_instance, snapshot_lock), trailer
+                    )
+                    for seq, path in self._list_deltas():
+                        if seq <= covered_seq:
+                            os.remove(path)
+                    self._delta_seq, self._delta_chain, self._base_records = covered_seq, 0, total
+                elif dirty:
+                    seq = self._delta_seq + 1
+                    trailer.update({"kind": "delta", "delta_seq": seq})
+                    total = self._write_checkpoint_file(
+                        self._delta_path(seq), _iter_delta_lines(btree_instance, snapshot_lock, sorted(dirty)), trailer
+                    )
+                    self._delta_seq, self._delta_chain = seq, self._delta_chain + 1
+                else:
+                    total = 0
+            except BaseException:
+                btree_instance.mark_dirty(dirty) # Not persisted: keep them for the next checkpoint
+                raise
+
+            # 3. Drop the WAL segments the snapshot covers
+            self._drop_segments(covered_segment, covered_records)
+
+            _CHECKPOINT_SECONDS.observe(time.perf_counter() - started, "base" if full else "delta")
+            kind: str = "Full checkpoint" if full else f"Delta checkpoint #{self._delta_seq}"
+            print(f" WAL: {kind} created with {total} records. Log cleared.\n")
+
+    def start_background_checkpointer(self, btree_instance: Any, snapshot_lock: Any = None,
+                                      max_bytes: int = 16 * 1024 * 1024, max_records: int = 50_000,
+                                      max_age: float = 300.0, interval: float = 1.0) -> None:
+        """
+        Starts a daemon thread that checkpoints 'btree_instance' whenever the WAL
+        exceeds 'max_bytes' / 'max_records' or has gone 'max_age' seconds without one.
+        'snapshot_lock' must exclude writers while they log + apply a change (for
+        example the read side of the reader-writer lock those writers use).
+        """
+        if self._checkpointer is not None:
+            return
+        self._checkpointer = _BackgroundCheckpointer(
+            self, btree_instance, snapshot_lock, max_bytes, max_records, max_age, interval
+        )
+        print(f"WAL: Background checkpointer armed ({max_bytes} bytes / {max_records} records / {max_age}s).")
+
+    def stop_background_checkpointer(self) -> None:
+        """
+        Stops the background checkpointer (waiting for a running checkpoint to finish).
+        """
+        if self._checkpointer is None:
+            return
+        checkpointer, self._checkpointer = self._checkpointer, None
+        checkpointer.stop()
+
+    # --- RECOVERY ---
+    def recover_tree(self, btree_instance: Any) -> None:
+        """
+        RESTORE PROCEDURE:
+        1. Load 'checkpoint.json' (The Base, streamed and bulk-loaded bottom-up)
+        2. Layer the delta checkpoints newer than the base, oldest first
+        3. Replay the WAL segments (The Updates since the last checkpoint)
+
+        A paged tree that already holds a committed tree skips steps 1-2: its page
+        file IS the last checkpoint. A brand new page file is filled from the JSON
+        checkpoints once, and owns the data from its first flush on.
+
+        Progress is published on self.progress while this runs, so another
+        thread can report it (recovery may take a while on a large store).
+        """
+        progress: RecoveryProgress = self.progress
+        progress.begin()
         try:
-            with open(WAL_FILE, 'r') as f:
-                for line in f:
-                    if line.strip():
-                        try:
-                            data: dict[str, Any] = json.loads(line)
-                            # WAL format is {'k': key, 'v': value}
-                            btree_instance.insert(data['k'], data['v'])
-                            wal_count += 1
-                        except ValueError:
-                            continue
-            print(f"WAL: Replayed {wal_count} transactions from Log.")
+            self.open()
+            self._recover(btree_instance, progress)
+        except BaseException as e:
+            progress.end(e)
+            raise
+        progress.end()
+
+    def _recover(self, btree_instance: Any, progress: RecoveryProgress) -> None:
+        started: float = time.perf_counter()
+        count: int = 0
+        base_ok: bool = True
+        base_trailer: dict[str, Any] = {}
+        paged_snapshot: bool = _is_paged(btree_instance) and not btree_instance.fresh
+
+        # PHASE 1: Load Snapshot
+        progress.phase = "checkpoint"
+        if paged_snapshot:
+            print("WAL: Using the committed page file as the checkpoint.")
+        elif os.path.exists(self.checkpoint_file):
+            try:
+                # Note: checkpoints are written in key order, so the snapshot can be
+                # bulk-loaded bottom-up instead of inserted one by one.
+                try:
+                    count = btree_instance.bulk_load(
+                        progress.track(_read_checkpoint(self.checkpoint_file, base_trailer))
+                    )
+                except ValueError as e:
+                    # Not in key order (hand-edited or foreign file) or missing its trailer:
+                    # salvage what is readable, one insert at a time.
+                    print(f" WAL: Checkpoint not bulk-loadable ({e}), inserting record by record.")
+                    base_ok = False
+                    progress.records = 0
+                    try:
+                        for k, v in progress.track(_read_checkpoint(self.checkpoint_file, base_trailer)):
+                            btree_instance.insert(k, v)
+                            count += 1
+                    except ValueError:
+                        pass
+                print(f"WAL: Loaded {count} records from Checkpoint.")
+            except Exception as e:
+                base_ok = False
+                print(f" WAL: Checkpoint corrupted: {e}")
+
+        # PHASE 1b: Layer delta checkpoints written after the base
+        progress.phase = "deltas"
+        base_seq: int = base_trailer.get("delta_seq", 0)
+        base_count: int = count
+        last_seq: int = base_seq
+        chain: int = 0
+        for seq, path in ([] if paged_snapshot else self._list_deltas()):
+            if seq <= base_seq:
+                continue # Already compacted into the base (removal was interrupted)
+            delta_count: int = 0
+            try:
+                for k, v in progress.track(_read_checkpoint(path)):
+                    _apply(btree_instance, k, v)
+                    delta_count += 1
+            except Exception as e:
+                base_ok = False
+                print(f" WAL: Delta checkpoint #{seq} corrupted: {e}")
+            last_seq, chain = seq, chain + 1
+            count += delta_count
+            print(f"WAL: Layered {delta_count} records from Delta #{seq}.")
+
+        # Everything so far is already on disk; only WAL replays are new since then.
+        btree_instance.take_dirty()
+        with self._checkpoint_lock:
+            # A damaged base or delta forces the next checkpoint to write a fresh base.
+            self._delta_seq = last_seq if base_ok else None
+            self._delta_chain = chain
+            self._base_records = base_count
+
+        # PHASE 2: Replay WAL
+        progress.phase = "wal"
+        try:
+            wal_count: int = self._replay_wal(btree_instance, progress)
+            if wal_count:
+                print(f"WAL: Replayed {wal_count} transactions from Log.")
             count += wal_count
         except Exception as e:
             print(f" WAL: Error reading log: {e}")
 
-    print(f" RECOVERY COMPLETE. Total Records: {count}")
+        _RECOVERY_SECONDS.set(round(time.perf_counter() - started, 6))
+        print(f" RECOVERY COMPLETE. Total Records: {count}")
+
+    def _replay_wal(self, btree_instance: Any, progress: RecoveryProgress) -> int:
+        """
+        Replays every WAL segment on disk and returns the number of records.
+
+        Each segment is decoded on its own (in parallel for a large log) and folded
+        to the last value per key; the folds are layered oldest first and the net
+        result is applied to the tree in key order. Because every record is a full
+        upsert or delete, this ends in the same state as replaying one by one.
+        New writes then go to a fresh segment, never after a torn tail.
+        """
+        segments: list[tuple[int, str]] = self.wal_segments()
+        with self._wal_lock:
+            if self._handle is not None:
+                self._handle.close()
+                self._handle = None
+            self._segment = max([0] + [number for number, _ in segments]) + 1
+            self._reset_disk_format()
+            self._wal_bytes, self._wal_records = 0, 0
+        if not segments:
+            return 0
+
+        sizes: list[int] = [os.path.getsize(path) for _, path in segments]
+        changes: dict[Any, Any] = {}
+        wal_count: int = 0
+        for (number, _path), size, (folded, records, valid_size, last_seq) in zip(
+                segments, sizes, self._decode_segments([path for _, path in segments], sum(sizes), progress)):
+            if valid_size < size:
+                print(f" WAL: Torn tail in segment #{number}, ignoring {size - valid_size} bytes after seq {last_seq}.")
+            changes.update(folded)
+            wal_count += records
+        _apply_changes(btree_instance, changes)
+
+        with self._wal_lock:
+            self._wal_bytes, self._wal_records = sum(sizes), wal_count
+        return wal_count
+
+    def _decode_segments(self, paths: list[str], total_bytes: int,
+                         progress: RecoveryProgress) -> list[tuple[dict[Any, Any], int, int, int]]:
+        """
+        Runs _decode_segment over 'paths', in a process pool when the log is big
+        enough to pay for it, and returns the results in segment order.
+        """
+        results: list[tuple[dict[Any, Any], int, int, int]] = []
+        workers: int = min(self.replay_workers, len(paths))
+        if workers > 1 and total_bytes >= PARALLEL_REPLAY_MIN_BYTES:
+            try:
+                # 'spawn' everywhere: forking a process that is running other threads is unsafe.
+                with ProcessPoolExecutor(workers, mp_context=multiprocessing.get_context("spawn")) as pool:
+                    for result in pool.map(_decode_segment, paths):
+                        results.append(result)
+                        progress.records += result[1]
+                print(f"WAL: Decoded {len(paths)} segments with {workers} worker processes.")
+                return results
+            except (OSError, BrokenProcessPool) as e:
+                print(f" WAL: Parallel replay unavailable ({e}), decoding serially.")
+                progress.records -= sum(result[1] for result in results)
+                results = []
+        for path in paths:
+            result = _decode_segment(path)
+            results.append(result)
+            progress.records += result[1]
+        return results
+
+# --- DEFAULT ENGINE ---
+# The module-level functions below act on one process-wide engine, created on
+# first use in DATA_DIR (or wherever configure() points it). Tools and scripts
+# use these; the server holds its engine explicitly.
+_default: StorageEngine | None = None
+_default_lock: threading.Lock = threading.Lock()
+
+def configure(data_dir: str | None = None, wal_format: str | None = None, **options: Any) -> StorageEngine:
+    """
+    Replaces the default engine with one rooted at 'data_dir' (default:
+    default_data_dir()) and returns it; 'options' go to StorageEngine (e.g.
+    segment_bytes, replay_workers). No I/O happens until it is used.
+    Call this before the default engine has started work: the old one is
+    simply dropped, not shut down.
+    """
+    global _default, DATA_DIR, WAL_FILE, CHECKPOINT_FILE, PAGE_FILE
+    with _default_lock:
+        engine: StorageEngine = StorageEngine(data_dir, wal_format or WAL_FORMAT, **options)
+        _default = engine
+        DATA_DIR, WAL_FILE = engine.data_dir, engine.legacy_wal_file
+        CHECKPOINT_FILE, PAGE_FILE = engine.checkpoint_file, engine.page_file
+        return engine
+
+def default_engine() -> StorageEngine:
+    """Returns the default engine, creating it (without any I/O) on first call."""
+    global _default
+    with _default_lock:
+        if _default is None:
+            _default = StorageEngine(DATA_DIR, WAL_FORMAT)
+        return _default
+
+def set_wal_format(fmt: str) -> None:
+    """
+    Chooses the encoding ("json" or "binary") used for newly started WAL files.
+    """
+    global WAL_FORMAT
+    default_engine().set_wal_format(fmt)
+    WAL_FORMAT = fmt
+
+def wal_segments() -> list[tuple[int, str]]:
+    return default_engine().wal_segments()
+
+def wal_stats() -> dict[str, float]:
+    return default_engine().wal_stats()
+
+def enable_group_commit(window_ms: float = 0.0) -> None:
+    default_engine().enable_group_commit(window_ms)
+
+def disable_group_commit() -> None:
+    default_engine().disable_group_commit()
+
+def log_transaction(key: str, value: dict[str, Any]) -> None:
+    default_engine().log_transaction(key, value)
+
+def log_transactions(records: Iterable[tuple[str, dict[str, Any]]]) -> int:
+    return default_engine().log_transactions(records)
+
+def submit_transactions(records: Iterable[tuple[str, dict[str, Any]]]) -> CommitBatch:
+    return default_engine().submit_transactions(records)
+
+def create_checkpoint(btree_instance: Any, snapshot_lock: Any = None, full: bool = False) -> None:
+    default_engine().create_checkpoint(btree_instance, snapshot_lock, full)
+
+def start_background_checkpointer(btree_instance: Any, snapshot_lock: Any = None,
+                                  max_bytes: int = 16 * 1024 * 1024, max_records: int = 50_000,
+                                  max_age: float = 300.0, interval: float = 1.0) -> None:
+    default_engine().start_background_checkpointer(
+        btree_instance, snapshot_lock, max_bytes, max_records, max_age, interval
+    )
+
+def stop_background_checkpointer() -> None:
+    default_engine().stop_background_checkpointer()
+
+def recover_tree(btree_instance: Any) -> None:
+    default_engine().recover_tree(btree_instance)